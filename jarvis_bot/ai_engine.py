@@ -1,30 +1,149 @@
 import requests
+import contextvars
+import copy
 import json
+import logging
 import os
-import tkinter as tk
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from memory import Memory
-from dotenv import load_dotenv
+from backends import BackendClient, BackendRegistry
+from cache import ResponseCache, SemanticCache, OllamaEmbedder, make_cache_key
+from retrieval import ConversationRetriever
+from router import QueryRouter
+from context import ContextBuilder, estimate_tokens
+from scheduler import RequestScheduler
+from telemetry import telemetry, configure_logging
+
+log = logging.getLogger("jarvis.engine")
+
+
+class ErrorResponse(str):
+    """Text a backend call returns instead of an answer: an error or a fallback message.
+
+    AIEngine.is_error_response tells these apart from answers by type, so a model
+    answer that happens to start with "Error" still counts as an answer.
+    """
+
+
+class LabelledAnswer(str):
+    """An answer prefixed with the label of the provider that gave it (see AIEngine.labelled)."""
+
+    def __new__(cls, text, provider):
+        answer = super().__new__(cls, text)
+        answer.provider = provider
+        return answer
+
+
+class AnswerStream:
+    """Assembles a streamed answer from the lines of a response body, fed one at a time.
+
+    Reading the body is left to the caller, so AIEngine and AsyncAIEngine parse
+    chunks, cut at stop sequences and pass partial text on in the same way.
+    """
+
+    def __init__(self, engine, provider, stops, on_partial=None):
+        self.engine = engine
+        self.provider = provider
+        self.stops = stops
+        self.on_partial = on_partial
+        self.text = ""
+
+    def add(self, delta):
+        """Appends delta and passes the text on; True once a stop sequence has been reached."""
+        self.text += delta
+        # Backstop for stop sequences the server let through: the caller stops reading
+        # and drops the connection, which makes the backend stop generating
+        cut = self.engine.find_stop_sequence(self.text, self.stops, len(delta))
+        if cut != -1:
+            self.text = self.text[:cut]
+            log.debug("Stop sequence reached, ending %s stream early", self.provider.name)
+        if self.on_partial and self.text:
+            self.on_partial(self.text)
+        return cut != -1
+
+
+class OllamaStream(AnswerStream):
+    """An Ollama /api/generate stream: one JSON object per line until "done" is true."""
+
+    def __init__(self, engine, provider, data, turn, on_partial=None):
+        super().__init__(engine, provider, data["options"].get("stop", []), on_partial)
+        self.data = data
+        self.turn = turn
+        self.error = None
+
+    def feed(self, line):
+        """Handles one line; True when the answer is over early (a stop sequence or an error)."""
+        if not line:
+            return False
+        chunk = json.loads(line)
+        if "error" in chunk:
+            self.error = ErrorResponse(f"Error: {chunk['error']}")
+            return True
+        if chunk.get("response") and self.add(chunk["response"]):
+            return True
+        if chunk.get("done") and chunk.get("context"):
+            self.engine.remember_phi3_context(chunk, self.data, self.turn)
+        return False
+
+    def answer(self):
+        return self.error or self.text or ErrorResponse(f"Error: No response from {self.provider.label}.")
+
+
+class OpenAIStream(AnswerStream):
+    """An OpenAI chat completion stream of server-sent events."""
+
+    def feed(self, line):
+        """Handles one line; True once a stop sequence has been reached."""
+        delta = self.engine.parse_openai_event(line)
+        return bool(delta) and self.add(delta)
+
+    def answer(self):
+        log.debug("%s stream finished with %d characters", self.provider.name, len(self.text))
+        return self.text.strip()
 
-class AIEngine:
-    def __init__(self, model_name="phi3", api_url="http://localhost:11434/api/generate"):
-        self.model_name = model_name
-        self.api_url = api_url
-        self.memory = Memory()
-        self.stop_response_flag = False
-
-        # Load OpenAI API key from .env
-        self.openai_api_key = os.getenv("OPENAI_API_KEY")
-
-        # Debugging: Print the API key to confirm it's loaded
-        if self.openai_api_key:
-            print(f"[DEBUG] OpenAI API Key Loaded: {self.openai_api_key[:5]}********")
-        else:
-            print("[DEBUG] OpenAI API Key is missing!")
 
-        self.openai_url = "https://api.openai.com/v1/chat/completions"
+class AIEngine:
+    def __init__(self, model_name=None, api_url=None, memory=None, backends=None):
+        # Model providers, their health and failover order (see backends.BackendRegistry).
+        # Each has its own pooled keep-alive client; model_name and api_url override
+        # the local Ollama provider.
+        self.backends = backends or BackendRegistry.from_config()
+        if model_name:
+            self.backends.local.model = model_name
+        if api_url:
+            self.backends.local.url = api_url
+        self.memory = memory or Memory()
+
+        # Streaming HTTP responses still being read, mapped to the cancel event of the
+        # call that owns them; stop_response() closes them all
+        self.active_streams = {}
+        self.stream_lock = threading.Lock()
+        # Cancel events of the get_response calls running now; a stop sets exactly these
+        self.running_calls = set()
+
+        # Whether a stopped (partial) answer should still be written to memory
+        self.store_partial_responses = False
+
+        # Batch runs turn these off to get fresh answers and keep them out of the
+        # conversation history (answers are still cached)
+        self.use_cached_answers = True
+        self.store_conversations = True
+
+        # API keys come from .env
+        for provider in self.backends.providers.values():
+            if not provider.configured:
+                log.info("No API key for %s; it is skipped until one is set", provider.name)
 
         # 🔥 FIX: Ensure `ai_mode` exists
-        self.ai_mode = "hybrid"  # Possible values: "phi3_only", "openai_only", "hybrid"
+        self.ai_mode = "hybrid"  # "<provider>_only", "hybrid" or "hybrid_hedged"; see self.backends.modes()
+        if self.ai_mode not in self.backends.modes():
+            self.ai_mode = self.backends.modes()[0]
+
+        # Workers for hedged hybrid mode, which runs both backends at once
+        self.hedge_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="hedge")
 
         # Define categories where OpenAI should be used
         self.factual_categories = [
@@ -32,121 +151,660 @@ class AIEngine:
             "historical event", "what happened in", "results of",
             "final score", "winner of"
         ]
+        # Compiled whole-word router over those keywords; more rules go through
+        # self.router.add_keywords/add_pattern, and `python router.py train` fits
+        # the optional classifier it loads from next to memory.db
+        router_model = os.path.join(os.path.dirname(os.path.abspath(self.memory.db_path)), "router_model.npz")
+        self.router = QueryRouter(classifier_path=router_model)
+        self.router.add_keywords(self.factual_categories)
+
+        # Caching for AI responses: bounded LRU in memory, backed by memory.db so
+        # warm answers survive a restart. Keys cover the question alone, so both
+        # tiers sit out when the backend asked gets context (see prompt_has_context)
+        self.cache = ResponseCache(max_entries=500, db_path=self.memory.db_path, writer=self.memory.writer)
+        # Part of every cache key; each for_session() engine gets its own
+        self.cache_scope = ""
+
+        # Answers to "latest"/"news" style questions go stale quickly
+        self.volatile_cache_ttl = 10 * 60
+
+        # Second tier for rephrasings ("what can you do?" vs "what can you help me with").
+        # Off until use_semantic_cache(): it needs an embedding model that keeps word
+        # order, which cache.HashingEmbedder doesn't ("10 km to miles" = "10 miles to km").
+        self.semantic_cache = None
+
+        # Past turns and user_data facts relevant to a question are added to the
+        # Phi-3 prompt; the vector index lives next to memory.db
+        index_path = os.path.join(os.path.dirname(os.path.abspath(self.memory.db_path)), "memory_index")
+        self.retriever = ConversationRetriever(self.memory, index_path)
+        self.retrieval_top_k = 3
+
+        # Multi-turn context: recent history trimmed to a token budget, and the
+        # KV state Ollama returns after each answer so the next turn only has to
+        # evaluate its own tokens
+        self.context_builder = ContextBuilder(token_budget=1536)
+        self.context_history_turns = 10
+        self.phi3_session = None
+        self.turn_counter = 0  # bumped whenever a turn is stored
+
+        # Stream partial text into update_chat_live while the model generates
+        self.stream_responses = True
+
+        # How long Ollama keeps the model loaded after a request; warm_up() preloads it
+        self.model_keep_alive = "30m"
+
+        # Generation limits per backend. Phi-3 likes to carry on with invented
+        # "User:" turns and "---" instruction dumps; stopping there saves the
+        # seconds it would spend generating them.
+        self.generation_options = {
+            "phi3": {
+                "num_predict": 320,
+                "temperature": 0.7,
+                "stop": ["\nUser:", "\nAI:", "\n---", "<|user|>", "<|end|>"]
+            },
+            "openai": {
+                "max_tokens": 600,
+                "temperature": 0.3,
+                "stop": ["\nUser:"]
+            }
+        }
+        # Per-mode overrides, e.g. {"phi3_only": {"phi3": {"num_predict": 600}}}
+        self.mode_generation_options = {}
 
-        # Caching for AI responses
-        self.cache = {}
-
-
-    def get_response(self, user_input, update_chat_live):
-        """Handles AI response based on selected mode."""
-        print(f"[DEBUG] Current AI mode: {self.ai_mode}")
-
-        # Check cache first
-        if user_input in self.cache:
-            print("[DEBUG] Returning cached response...")
-            cached_response = self.cache[user_input]
-            update_chat_live(cached_response)
-            return cached_response
-
-        # Mode logic
-        if self.ai_mode == "phi3_only":
-            print("[DEBUG] Using Phi-3 only...")
-            final_response = f"(Phi-3) {self.ask_phi3(user_input)}"
+        # GUIs submit through this bounded worker pool instead of starting a thread per message
+        self.scheduler = RequestScheduler(self, workers=2)
 
-        elif self.ai_mode == "openai_only":
-            print("[DEBUG] Using OpenAI only...")
-            final_response = f"(OpenAI) {self.get_openai_response(user_input)}"
+        # Stage timings, counters and per-request traces (see telemetry.py)
+        self.telemetry = telemetry
 
-        else:  # Hybrid Mode
-            print("[DEBUG] Asking Phi-3...")
-            phi3_response = self.ask_phi3(user_input)
 
-            if self.should_use_openai(user_input):
-                print("[DEBUG] Phi-3's response may not be reliable, asking OpenAI directly...")
-                final_response = f"(OpenAI) {self.get_openai_response(user_input)}"
+    def get_response(self, user_input, update_chat_live, cancel=None):
+        """Handles AI response based on selected mode; setting cancel stops just this call."""
+        cancel = cancel or threading.Event()
+        with self.stream_lock:
+            self.running_calls.add(cancel)
+        try:
+            return self.answer(user_input, update_chat_live, cancel)
+        finally:
+            with self.stream_lock:
+                self.running_calls.discard(cancel)
+
+    def answer(self, user_input, update_chat_live, cancel):
+        with self.telemetry.trace(user_input):
+            log.debug("Current AI mode: %s", self.ai_mode)
+
+            # Routing first: whether the cache may answer depends on the backend asked
+            with self.telemetry.span("routing"):
+                backend = self.choose_backend(user_input)
+            with self.telemetry.span("cache_lookup"):
+                cache_key, time_sensitive, cached_response = self.lookup_cached(user_input, backend)
+            if cached_response is not None:
+                log.debug("Returning cached response")
+                self.telemetry.count("requests", backend="cache")
+                update_chat_live(cached_response)
+                return cached_response
+
+            self.telemetry.count("requests", backend=backend)
+            if backend == "hedged":
+                final_response = self.hedged_response(user_input, update_chat_live, cancel)
             else:
-                final_response = f"(Phi-3) {phi3_response}"
-
-        # Clean up response
+                final_response = self.ask_with_failover(backend, user_input, update_chat_live, cancel)
+
+            final_response = self.finish_response(
+                user_input, final_response, cache_key, time_sensitive, self.is_cancelled(cancel)
+            )
+
+            # Update chat UI
+            update_chat_live(final_response)
+            return final_response
+
+    def use_semantic_cache(self, model="nomic-embed-text", threshold=0.9):
+        """Turns on the rephrasing tier, embedding prompts with an Ollama model on the local provider."""
+        local = self.backends.local
+        if local.kind != "ollama":
+            raise ValueError(f"The semantic cache needs an Ollama provider to embed with, not {local.kind!r}")
+        url = local.url.rsplit("/api/", 1)[0] + "/api/embeddings"
+        # Its own slots, so a lookup never queues behind generations streaming on local.client
+        client = BackendClient(f"{local.name}-embeddings", read_timeout=30, max_concurrency=4)
+        self.semantic_cache = SemanticCache(OllamaEmbedder(client, url, model), threshold=threshold)
+
+    def lookup_cached(self, user_input, backend):
+        """Returns (cache key, time sensitive, cached answer or None) for user_input routed to backend.
+
+        The key is None when backend's prompt carries context, so the answer is not cached either.
+        """
+        # Time-sensitive questions must not be answered by a merely similar one
+        time_sensitive = self.should_use_openai(user_input)
+        if self.prompt_has_context(backend):
+            self.telemetry.count("cache_bypassed")
+            return None, time_sensitive, None
+        cache_key = self.cache_key(user_input)
+        if not self.use_cached_answers:
+            return cache_key, time_sensitive, None
+        cached_response = self.cache.get(cache_key)
+        tier = "exact"
+        if cached_response is None and self.semantic_cache and not time_sensitive:
+            cached_response = self.semantic_cache.get(self.cache_namespace(), user_input)
+            tier = "semantic"
+        if cached_response is None:
+            self.telemetry.count("cache_misses")
+        else:
+            self.telemetry.count("cache_hits", tier=tier)
+        return cache_key, time_sensitive, cached_response
+
+    def choose_backend(self, user_input):
+        """The provider name to ask for user_input under the current mode, or "hedged"."""
+        if self.ai_mode.endswith("_only"):
+            return self.ai_mode[:-len("_only")]
+        # Hybrid modes: route before calling anything, so factual questions
+        # don't pay for a local answer that would be thrown away
+        decision = self.router.route(user_input)
+        if decision.route == "openai":
+            log.debug("Asking %s directly (confidence %.2f, matched %s)",
+                      self.backends.remote.name, decision.confidence, decision.matches)
+            return self.backends.remote.name
+        if self.ai_mode == "hybrid_hedged":
+            return "hedged"
+        return self.backends.local.name
+
+    def finish_response(self, user_input, final_response, cache_key, time_sensitive, cancelled=False):
+        """Cleans up a labelled answer, caches and stores it, and returns the text to show.
+
+        The text is an ErrorResponse if final_response was one. Only answers from a
+        provider whose prompt carried no context are cached.
+        """
+        failed = self.is_error_response(final_response)
+        # A failover may have moved the question to a backend that does get context
+        provider = getattr(final_response, "provider", None)
+        cacheable = cache_key is not None and provider is not None and not self.prompt_has_context(provider)
         final_response = final_response.replace("Jarvis:", "").strip()
 
-        # Store response in cache
-        self.cache[user_input] = final_response
-        self.memory.store_conversation(user_input, final_response)
-
-        # Update chat UI
-        update_chat_live(final_response)
-        return final_response
-
-    def ask_phi3(self, user_input):
-        """Queries Phi-3 API for a response."""
+        # A stopped answer is incomplete, so it never goes into the cache
+        if cancelled:
+            log.debug("Response stopped before completion")
+            self.telemetry.count("cancelled")
+            final_response = f"{final_response} [stopped]"
+            if self.store_partial_responses and self.store_conversations:
+                with self.telemetry.span("memory_write"):
+                    self.memory.store_conversation(user_input, final_response)
+                self.turn_counter += 1
+            return final_response
+
+        # Store response in cache (backend errors are not worth remembering)
+        with self.telemetry.span("post_process"):
+            if cacheable and not failed:
+                ttl = self.volatile_cache_ttl if time_sensitive else None
+                self.cache.put(cache_key, final_response, ttl=ttl)
+                if self.semantic_cache and not time_sensitive:
+                    self.semantic_cache.put(self.cache_namespace(), user_input, final_response)
+        if self.store_conversations:
+            with self.telemetry.span("memory_write"):
+                self.memory.store_conversation(user_input, final_response)
+            self.turn_counter += 1
+        return ErrorResponse(final_response) if failed else final_response
+
+    def for_session(self, memory):
+        """An engine for a separate conversation kept in memory (e.g. a server.SessionMemory).
+
+        It shares this engine's settings, clients and scheduler but has its own
+        history, Ollama context and running calls, and its cache entries are scoped
+        to memory.session_id. Retrieval is off, since the index covers this
+        engine's memory only.
+        """
+        engine = copy.copy(self)
+        engine.memory = memory
+        engine.cache_scope = f"session:{memory.session_id}"
+        engine.retriever = None
+        engine.phi3_session = None
+        engine.turn_counter = 0
+        engine.active_streams = {}
+        engine.stream_lock = threading.Lock()
+        engine.running_calls = set()
+        return engine
+
+    def get_generation_options(self, backend):
+        """Generation options for a provider (or provider name) under the current mode.
+
+        Providers without options of their own use those of the built-in backend of
+        their kind ("phi3" for Ollama, "openai" for OpenAI-compatible APIs).
+        """
+        if not isinstance(backend, str):
+            backend = backend.name if backend.name in self.generation_options else \
+                {"ollama": "phi3", "openai": "openai"}[backend.kind]
+        options = dict(self.generation_options.get(backend, {}))
+        options.update(self.mode_generation_options.get(self.ai_mode, {}).get(backend, {}))
+        return options
+
+    def find_stop_sequence(self, text, stops, new_chars):
+        """Index of the first stop sequence in text, looking only where the newest chunk could complete one."""
+        start = max(0, len(text) - new_chars - max(map(len, stops), default=0))
+        positions = [text.find(stop, start) for stop in stops]
+        positions = [position for position in positions if position != -1]
+        return min(positions) if positions else -1
+
+    def prompt_has_context(self, backend):
+        """True when the prompt for backend (a provider, its name or "hedged") carries
+        conversation history, Ollama's context or retrieved memories.
+
+        Only Ollama prompts do; OpenAI requests send the question alone. An answer to
+        such a prompt depends on more than the question, so it must neither be served
+        from nor stored in the caches.
+        """
+        if backend == "hedged":
+            return any(self.prompt_has_context(provider) for provider in (self.backends.local, self.backends.remote))
+        provider = self.backends.get(backend) if isinstance(backend, str) else backend
+        return provider.kind == "ollama" and bool(
+            self.context_history_turns or (self.retriever and self.retrieval_top_k))
+
+    def cache_namespace(self):
+        """Mode, models and scope an answer was produced under; cached answers never cross it."""
+        return f"{self.ai_mode}|{self.models_key()}|{self.cache_scope}"
+
+    def cache_key(self, user_input):
+        """Cache key for user_input under the current mode, models and scope."""
+        return make_cache_key(self.ai_mode, self.models_key(), user_input, self.cache_scope)
+
+    def models_key(self):
+        return "+".join(provider.model for provider in self.backends.providers.values())
+
+    def is_error_response(self, response):
+        """True for the ErrorResponse texts the backend calls return instead of an answer, and for empty answers."""
+        return isinstance(response, ErrorResponse) or not response.split(") ", 1)[-1].strip()
+
+    def labelled(self, provider, answer):
+        """answer prefixed with "(<provider label>) ": an ErrorResponse if it was one, else a LabelledAnswer."""
+        text = f"({provider.label}) {answer}"
+        return ErrorResponse(text) if isinstance(answer, ErrorResponse) else LabelledAnswer(text, provider)
+
+    def live_callback(self, label, update_chat_live):
+        """Wraps the UI callback so partial text carries the backend label, or None when not streaming."""
+        if not self.stream_responses:
+            return None
+        return lambda partial_text: update_chat_live(f"{label}{partial_text}".replace("Jarvis:", "").strip())
+
+    def timed_partial(self, provider, started, on_partial):
+        """Wraps on_partial so the first streamed text is recorded as provider's first-token time."""
+        first = [True]
+
+        def wrapped(text):
+            if first[0]:
+                first[0] = False
+                seconds = time.perf_counter() - started
+                self.telemetry.stage(f"{provider.name}_first_token", seconds)
+                provider.record_latency(seconds)
+            if on_partial:
+                on_partial(text)
+
+        return wrapped
+
+    def ask_backend(self, provider, user_input, on_partial=None, cancel=None):
+        """Asks one provider with the protocol of its kind and records how the call went."""
+        ask = self.ask_phi3 if provider.kind == "ollama" else self.get_openai_response
+        answer = ask(user_input, on_partial, cancel, provider)
+        if not self.is_cancelled(cancel):
+            provider.record(not self.is_error_response(answer))
+        return answer
+
+    def ask_with_failover(self, name, user_input, update_chat_live, cancel=None):
+        """Asks provider name, moving on to the next candidate if it is down, slow or fails before answering.
+
+        Returns the answer labelled with the provider that gave it.
+        """
+        # "<name>_only" modes never fall back to a backend of another kind
+        for provider in self.backends.candidates(name, same_kind=self.ai_mode.endswith("_only")):
+            live = self.live_callback(f"({provider.label}) ", update_chat_live)
+            streamed = []
+
+            def on_partial(text):
+                streamed.append(True)
+                if live:
+                    live(text)
+
+            answer = self.ask_backend(provider, user_input, on_partial, cancel)
+            if streamed or self.is_cancelled(cancel) or not self.is_error_response(answer):
+                break
+            log.warning("%s failed before answering (%.80s); trying the next backend", provider.name, answer)
+            self.telemetry.count("failovers", backend=provider.name)
+        return self.labelled(provider, answer)
+
+    def hedged_response(self, user_input, update_chat_live, cancel=None):
+        """Sends the question to the local and remote providers and keeps whichever starts answering first."""
+        local, remote = self.backends.local, self.backends.remote
+        if not (self.backends.is_available(local) and self.backends.is_available(remote)):
+            # Nothing to race; ask whichever is up (or report the local error)
+            name = remote.name if self.backends.is_available(remote) else local.name
+            return self.ask_with_failover(name, user_input, update_chat_live, cancel)
+
+        providers = {local.name: local, remote.name: remote}
+        cancels = {name: self.child_cancel(cancel) for name in providers}
+        live = {name: self.live_callback(f"({provider.label}) ", update_chat_live)
+                for name, provider in providers.items()}
+        winner = []
+        winner_lock = threading.Lock()
+
+        def on_partial(name, text):
+            # The first backend to produce text wins; the other one is cut off right away
+            with winner_lock:
+                if not winner:
+                    winner.append(name)
+                    loser = remote.name if name == local.name else local.name
+                    log.debug("%s answered first, cancelling %s", name, loser)
+                    self.cancel_streams(cancels[loser])
+            if winner[0] == name and live[name]:
+                live[name](text)
+
+        # Each call runs in a copy of this context so its stages land in this request's trace
+        futures = {
+            self.hedge_pool.submit(contextvars.copy_context().run, self.ask_backend, provider, user_input,
+                                   lambda text, name=name: on_partial(name, text), cancels[name]): name
+            for name, provider in providers.items()
+        }
+        results = {}
+        for future in as_completed(futures):
+            name = futures[future]
+            results[name] = future.result()
+            if winner and winner[0] == name:
+                return self.labelled(providers[name], results[name])
+
+        # Neither backend produced text (errors, missing API key); report the local outcome
+        return self.labelled(local, results[local.name])
+
+    def child_cancel(self, parent):
+        """A cancel event that also counts as set once parent is set."""
+        cancel = threading.Event()
+        cancel.parent = parent
+        return cancel
+
+    def is_cancelled(self, cancel):
+        while cancel is not None:
+            if cancel.is_set():
+                return True
+            cancel = getattr(cancel, "parent", None)
+        return False
+
+    def owned_by(self, owner, cancel):
+        while owner is not None:
+            if owner is cancel:
+                return True
+            owner = getattr(owner, "parent", None)
+        return False
+
+    def stop_response(self):
+        """Stops queued and running generations by closing their connections to the backend."""
+        # Only the calls running now; one submitted after the stop starts with a clear event
+        with self.stream_lock:
+            running = list(self.running_calls)
+        for cancel in running:
+            cancel.set()
+        self.scheduler.cancel_all()
+        aborted = self.cancel_streams()
+        log.info("Stop requested, aborted %d stream(s)", aborted)
+
+    def cancel_streams(self, cancel=None):
+        """Aborts the streams owned by cancel or its children (after setting it), or every stream if None."""
+        if cancel is not None:
+            cancel.set()
+        with self.stream_lock:
+            streams = [response for response, owner in self.active_streams.items()
+                       if cancel is None or self.owned_by(owner, cancel)]
+        for response in streams:
+            self.abort_stream(response)
+        return len(streams)
+
+    def abort_stream(self, response):
+        """Shuts down the socket under a streaming response so a blocked read returns at once."""
+        # Ollama cancels the generation as soon as the client disconnects
+        connection = getattr(response.raw, "_connection", None)
+        sock = getattr(connection, "sock", None)
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        response.close()
+
+    def open_stream(self, client, url, cancel=None, **kwargs):
+        """Starts a streaming POST and registers it so stop_response() can abort it."""
+        response = client.post(url, **kwargs)
+        with self.stream_lock:
+            self.active_streams[response] = cancel
+        if self.is_cancelled(cancel):
+            self.abort_stream(response)
+        return response
+
+    def close_stream(self, client, response):
+        """Unregisters a stream and returns its connection slot to the client."""
+        with self.stream_lock:
+            self.active_streams.pop(response, None)
+        client.release(response)
+
+    def build_phi3_prompt(self, user_input, model=None):
+        """Returns the Phi-3 prompt and the Ollama context to continue from (None for a fresh start)."""
         prompt = f"User: {user_input}\nAI:"
-        data = {"model": self.model_name, "prompt": prompt, "stream": False}  # No streaming
-
+        if self.retriever and self.retrieval_top_k:
+            remembered = self.retriever.retrieve(user_input, self.retrieval_top_k)
+            if remembered:
+                lines = "\n".join(f"- {item}" for item in remembered)
+                prompt = f"Things you remember about the user:\n{lines}\n\n{prompt}"
+
+        # Continue the previous Phi-3 turn if it is the last thing said and there is room
+        session = self.phi3_session
+        if (session and self.context_history_turns and session["model"] == (model or self.backends.local.model)
+                and session["turn"] == self.turn_counter
+                and len(session["context"]) + estimate_tokens(prompt) <= self.context_builder.token_budget):
+            return prompt, session["context"]
+
+        history = list(reversed(self.memory.get_recent_conversations(self.context_history_turns)))
+        return self.context_builder.build(history, prompt, self.backends.labels()), None
+
+    def phi3_request(self, user_input, provider=None):
+        """Returns the Ollama request body for user_input and the turn it answers."""
+        provider = provider or self.backends.local
+        turn = self.turn_counter
+        prompt, context = self.build_phi3_prompt(user_input, provider.model)
+        # Always stream from Ollama so a stop can cut the generation short
+        data = {"model": provider.model, "prompt": prompt, "stream": True,
+                "options": self.get_generation_options(provider), "keep_alive": self.model_keep_alive}
+        if context:
+            data["context"] = context
+        return data, turn
+
+    def remember_phi3_context(self, chunk, data, turn):
+        """Keeps the context from Ollama's final chunk so the next turn can continue it."""
+        log.debug("Phi-3 evaluated %s prompt tokens (%s context)", chunk.get("prompt_eval_count", "?"),
+                  "continued" if "context" in data else "fresh")
+        # Valid for the next question only if this answer is the turn that gets stored
+        self.phi3_session = {"model": data["model"], "context": chunk["context"], "turn": turn + 1}
+
+    def ask_phi3(self, user_input, on_partial=None, cancel=None, provider=None):
+        """Queries an Ollama model (Phi-3 unless provider says otherwise), streaming partial text to on_partial."""
+        provider = provider or self.backends.local
+        with self.telemetry.span("prompt_build"):
+            data, turn = self.phi3_request(user_input, provider)
+
+        response = None
+        started = time.perf_counter()
+        stream = OllamaStream(self, provider, data, turn, self.timed_partial(provider, started, on_partial))
         try:
-            response = requests.post(self.api_url, json=data)
-            response_json = response.json()
-            return response_json.get("response", "Error: No response from Phi-3.")
-        except requests.exceptions.RequestException as e:
-            return f"Error: {str(e)}"
-
-    def get_openai_response(self, user_input):
-        """Calls OpenAI API only when necessary."""
-        if not self.openai_api_key:
-            print("[DEBUG] OpenAI API key is missing or not loaded.")
-            return "I couldn't find an answer, and OpenAI access is not configured."
-
-        print(f"[DEBUG] Using OpenAI API key: {self.openai_api_key[:5]}********")
-
+            response = self.open_stream(provider.client, provider.url, cancel, json=data)
+            self.telemetry.stage(f"{provider.name}_connect", time.perf_counter() - started)
+
+            # The loop runs to the end of the body so the connection can be reused
+            for line in response.iter_lines():
+                if self.is_cancelled(cancel) or stream.feed(line):
+                    break
+            if self.is_cancelled(cancel):
+                return stream.text
+            return stream.answer()
+        except (requests.exceptions.RequestException, ValueError) as e:
+            if self.is_cancelled(cancel):
+                return stream.text
+            return self.backend_error(provider, e)
+        except AttributeError:
+            # urllib3 drops its file object when abort_stream closes the response mid-read
+            if self.is_cancelled(cancel):
+                return stream.text
+            raise
+        finally:
+            if response is not None:
+                self.close_stream(provider.client, response)
+            self.telemetry.stage(f"{provider.name}_complete", time.perf_counter() - started)
+
+    def openai_request(self, user_input, provider=None):
+        """Returns the headers and streaming request body for an OpenAI chat completion."""
+        provider = provider or self.backends.remote
         headers = {
-            "Authorization": f"Bearer {self.openai_api_key}",
+            "Authorization": f"Bearer {provider.api_key}",
             "Content-Type": "application/json"
         }
         data = {
-            "model": "gpt-4o",  # Switched to GPT-4o for better accuracy
+            "model": provider.model,
             "messages": [
                 {"role": "system", "content": "You are an AI assistant providing factual, up-to-date information."},
                 {"role": "user", "content": user_input}
             ],
-            "temperature": 0.3
+            "stream": True  # Streamed so partial text can be shown and a stop can abort it
         }
-
+        data.update(self.get_generation_options(provider))
+        return headers, data
+
+    def openai_error_message(self, response_json):
+        """Answer or error text from a non-streamed OpenAI JSON body."""
+        # Check if "choices" is in the response
+        if "choices" in response_json:
+            return response_json["choices"][0]["message"]["content"].strip()
+        error_message = response_json.get("error", {}).get("message", "Unknown error")
+        return ErrorResponse(f"OpenAI API Error: {error_message}")
+
+    def backend_error(self, provider, error):
+        """Logs and counts a failed call to provider; returns the ErrorResponse to show for it."""
+        log.warning("%s request failed: %r", provider.name, error)
+        self.telemetry.count("backend_errors", backend=provider.name)
+        detail = str(error) or type(error).__name__
+        if provider.kind == "ollama":
+            return ErrorResponse(f"Error: {detail}")
+        return ErrorResponse(f"Error contacting {provider.label}: {detail}")
+
+    def http_error(self, provider, status, response_json):
+        """Logs and counts an HTTP error from an OpenAI-compatible provider; returns its ErrorResponse."""
+        log.warning("%s returned HTTP %s", provider.name, status)
+        self.telemetry.count("backend_errors", backend=provider.name)
+        return self.openai_error_message(response_json)
+
+    def not_configured(self, provider):
+        """The ErrorResponse for a provider asked without an API key."""
+        log.debug("No API key for %s", provider.name)
+        return ErrorResponse(f"I couldn't find an answer, and {provider.label} access is not configured.")
+
+    def parse_openai_event(self, line):
+        """Text delta carried by one server-sent event line, or None."""
+        if not line or not line.startswith(b"data:"):
+            return None
+        payload = line[len(b"data:"):].decode("utf-8").strip()
+        if payload == "[DONE]":
+            return None
+        chunk = json.loads(payload)
+        return chunk["choices"][0].get("delta", {}).get("content") if chunk.get("choices") else None
+
+    def get_openai_response(self, user_input, on_partial=None, cancel=None, provider=None):
+        """Calls an OpenAI-compatible API (OpenAI unless provider says otherwise), streaming partial text to on_partial."""
+        provider = provider or self.backends.remote
+        if not provider.api_key:
+            return self.not_configured(provider)
+
+        headers, data = self.openai_request(user_input, provider)
+
+        response = None
+        started = time.perf_counter()
+        stream = OpenAIStream(self, provider, data.get("stop", []), self.timed_partial(provider, started, on_partial))
         try:
-            print("[DEBUG] Sending request to OpenAI...")
-            response = requests.post(self.openai_url, headers=headers, json=data)
-
-            # Print raw response status and content for debugging
-            print(f"[DEBUG] OpenAI response status: {response.status_code}")
-            print(f"[DEBUG] OpenAI raw response: {response.text}")
-
-            response_json = response.json()
-
-            # Check if "choices" is in the response
-            if "choices" in response_json:
-                return response_json["choices"][0]["message"]["content"].strip()
-            else:
-                error_message = response_json.get("error", {}).get("message", "Unknown error")
-                return f"OpenAI API Error: {error_message}"
-
-        except requests.exceptions.RequestException as e:
-            print("[DEBUG] OpenAI request failed:", e)
-            return f"Error contacting OpenAI: {str(e)}"
+            response = self.open_stream(provider.client, provider.url, cancel, headers=headers, json=data)
+            self.telemetry.stage(f"{provider.name}_connect", time.perf_counter() - started)
+
+            if response.ok:
+                return self.read_openai_stream(response, stream, cancel)
+
+            if log.isEnabledFor(logging.DEBUG):
+                log.debug("%s error body: %.500s", provider.name, response.text)
+            return self.http_error(provider, response.status_code, response.json())
+
+        except (requests.exceptions.RequestException, ValueError) as e:
+            if self.is_cancelled(cancel):
+                return stream.answer()
+            return self.backend_error(provider, e)
+        except AttributeError:
+            # urllib3 drops its file object when abort_stream closes the response mid-read
+            if self.is_cancelled(cancel):
+                return stream.answer()
+            raise
+        finally:
+            if response is not None:
+                self.close_stream(provider.client, response)
+            self.telemetry.stage(f"{provider.name}_complete", time.perf_counter() - started)
+
+    def read_openai_stream(self, response, stream, cancel=None):
+        """Feeds an OpenAI server-sent event body to stream and returns the answer."""
+        try:
+            # Read on past [DONE] to the end of the body so the connection can be reused
+            for line in response.iter_lines():
+                if self.is_cancelled(cancel) or stream.feed(line):
+                    break
+        except requests.exceptions.RequestException:
+            # Reading an aborted stream fails; keep what arrived before the stop
+            if not self.is_cancelled(cancel):
+                raise
+        return stream.answer()
 
     def should_use_openai(self, user_input):
         """Determines if OpenAI should be used based on the type of query."""
-        return any(keyword in user_input.lower() for keyword in self.factual_categories)
+        return self.router.route(user_input).route == "openai"
+
+    def warm_up(self):
+        """Loads the Ollama model(s) the current mode asks into memory ahead of the first question.
+
+        An empty generate request makes Ollama load the model and keep it for
+        model_keep_alive; it also opens the pooled connection the first answer reuses.
+        """
+        names = [self.ai_mode[:-len("_only")]] if self.ai_mode.endswith("_only") else [self.backends.local.name]
+        for provider in map(self.backends.get, names):
+            if provider.kind != "ollama":
+                continue
+            started = time.perf_counter()
+            response = None
+            try:
+                response = provider.client.post(
+                    provider.url, json={"model": provider.model, "stream": False, "keep_alive": self.model_keep_alive}
+                )
+                response.raise_for_status()
+                response.content  # read to the end so the connection is reused
+            except requests.exceptions.RequestException as e:
+                log.info("Could not preload %s: %s", provider.name, e)
+                continue
+            finally:
+                if response is not None:
+                    provider.client.release(response)
+            elapsed = time.perf_counter() - started
+            self.telemetry.observe("warm_up_seconds", elapsed, backend=provider.name)
+            log.info("Preloaded %s in %.2fs", provider.name, elapsed)
+
+    def start_warm_up(self):
+        """Runs warm_up() on a daemon thread."""
+        thread = threading.Thread(target=self.warm_up, name="model-warm-up", daemon=True)
+        thread.start()
+        return thread
 
     def set_ai_mode(self, mode):
         """Allows switching between AI modes dynamically."""
-        if mode in ["phi3_only", "openai_only", "hybrid"]:
+        if mode in self.backends.modes():
             self.ai_mode = mode
-            print(f"[DEBUG] AI mode changed to: {mode}")
+            log.info("AI mode changed to: %s", mode)
         else:
-            print("[DEBUG] Invalid AI mode selection.")
+            log.warning("Invalid AI mode selection: %s", mode)
 
 # GUI Integration
 class AIInterface:
     def __init__(self, root, ai_engine):
+        import tkinter as tk
         self.root = root
         self.ai_engine = ai_engine
         self.root.title("AI Assistant")
@@ -154,7 +812,7 @@ class AIInterface:
         # Dropdown for AI Mode Selection
         self.ai_mode_var = tk.StringVar(value=self.ai_engine.ai_mode)
         self.ai_mode_dropdown = tk.OptionMenu(
-            root, self.ai_mode_var, "phi3_only", "openai_only", "hybrid", self.change_ai_mode
+            root, self.ai_mode_var, *self.ai_engine.backends.modes(), command=self.change_ai_mode
         )
         self.ai_mode_dropdown.pack(pady=10)
 
@@ -175,9 +833,10 @@ class AIInterface:
         user_input = self.input_entry.get()
         if not user_input.strip():
             return
-        self.input_entry.delete(0, tk.END)
+        self.input_entry.delete(0, "end")
         self.update_chat(f"You: {user_input}")
-        response = self.ai_engine.get_response(user_input, self.update_chat)
+        # update_chat adds a line per call, so only the finished answer is shown
+        response = self.ai_engine.get_response(user_input, lambda text: None)
         self.update_chat(f"Jarvis: {response}")
 
     def update_chat(self, message):
@@ -188,9 +847,10 @@ class AIInterface:
 
     def change_ai_mode(self, mode):
         self.ai_engine.set_ai_mode(mode)
-        print(f"[DEBUG] AI mode switched to: {mode}")
 
 if __name__ == "__main__":
+    import tkinter as tk
+    configure_logging()
     root = tk.Tk()
     ai_engine = AIEngine()
     app = AIInterface(root, ai_engine)
@@ -0,0 +1,388 @@
+import asyncio
+import copy
+import logging
+import time
+import aiohttp
+from ai_engine import AIEngine, OllamaStream, OpenAIStream
+from backends import BackendBusyError, BackendClient
+from telemetry import configure_logging
+
+log = logging.getLogger("jarvis.async_engine")
+
+
+class AsyncBackendClient:
+    """aiohttp counterpart of backends.BackendClient.
+
+    One keep-alive session per backend with the same timeouts, retry policy and
+    concurrency cap, but waiting for a slot or for bytes never blocks a thread.
+    urllib3 retries for BackendClient; aiohttp has no retry of its own, so send()
+    applies the same policy by hand.
+    """
+
+    RETRY_STATUSES = BackendClient.RETRY_STATUSES
+
+    def __init__(self, name, connect_timeout=3.05, read_timeout=120, max_retries=3,
+                 backoff_factor=0.5, max_concurrency=2, pool_size=4, queue_timeout=None):
+        self.name = name
+        self.timeout = aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.max_concurrency = max_concurrency
+        self.pool_size = max(pool_size, max_concurrency)
+        self.queue_timeout = queue_timeout
+        self.session = None  # created on first use, inside the running loop
+        self.slots = asyncio.BoundedSemaphore(max_concurrency)
+        self.held = set()
+
+    @classmethod
+    def like(cls, client, **overrides):
+        """An async client with the timeouts and limits of a BackendClient, unless overridden."""
+        connect_timeout, read_timeout = client.timeout
+        settings = {"max_retries": client.max_retries, "backoff_factor": client.backoff_factor,
+                    "max_concurrency": client.max_concurrency, "pool_size": client.pool_size,
+                    "queue_timeout": client.queue_timeout}
+        settings.update(overrides)
+        return cls(client.name, connect_timeout, read_timeout, **settings)
+
+    async def post(self, url, **kwargs):
+        """Sends a POST once a slot is free; pair every call with release()."""
+        try:
+            await asyncio.wait_for(self.slots.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            raise BackendBusyError(f"{self.name} backend is busy ({self.max_concurrency} requests in flight)")
+        try:
+            response = await self.send(url, **kwargs)
+        except BaseException:
+            self.slots.release()
+            raise
+        self.held.add(response)
+        return response
+
+    async def send(self, url, **kwargs):
+        # Connection errors and overload statuses are retried with exponential backoff;
+        # in both cases the model never started on the request
+        if self.session is None:
+            self.session = aiohttp.ClientSession(
+                timeout=self.timeout, connector=aiohttp.TCPConnector(limit=self.pool_size)
+            )
+        for attempt in range(self.max_retries + 1):
+            delay = self.backoff_factor * (2 ** attempt)
+            try:
+                response = await self.session.post(url, **kwargs)
+            except aiohttp.ClientConnectorError:
+                if attempt == self.max_retries:
+                    raise
+            else:
+                if response.status not in self.RETRY_STATUSES or attempt == self.max_retries:
+                    return response
+                retry_after = response.headers.get("Retry-After", "")
+                if retry_after.isdigit():
+                    delay = int(retry_after)
+                response.release()
+            await asyncio.sleep(delay)
+
+    def release(self, response):
+        """Frees the slot held by response.
+
+        A body that was read to the end leaves its connection in the pool; one that
+        was abandoned part-way has its connection closed, which also tells Ollama to
+        stop generating.
+        """
+        if response not in self.held:
+            return
+        self.held.discard(response)
+        try:
+            if response.content.at_eof():
+                response.release()
+            else:
+                response.close()
+        finally:
+            self.slots.release()
+
+    async def close(self):
+        """Closes every pooled connection."""
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+
+class AsyncMemory:
+    """Awaitable view of a Memory.
+
+    Reads run on the default executor so a slow query never stalls the event
+    loop; store_conversation only queues the write, so it is called directly.
+    """
+
+    def __init__(self, memory):
+        self.memory = memory
+
+    async def store_conversation(self, user_input, ai_response):
+        self.memory.store_conversation(user_input, ai_response)
+
+    async def flush(self):
+        await asyncio.to_thread(self.memory.flush)
+
+    async def get_recent_conversations(self, limit=5):
+        return await asyncio.to_thread(self.memory.get_recent_conversations, limit)
+
+    async def search_conversations(self, query, limit=10, offset=0, highlight=("[", "]")):
+        return await asyncio.to_thread(self.memory.search_conversations, query, limit, offset, highlight)
+
+    async def store_user_data(self, key, value):
+        await asyncio.to_thread(self.memory.store_user_data, key, value)
+
+    async def get_user_data(self, key):
+        return await asyncio.to_thread(self.memory.get_user_data, key)
+
+    async def get_all_user_data(self):
+        return await asyncio.to_thread(self.memory.get_all_user_data)
+
+    async def clear_memory(self):
+        await asyncio.to_thread(self.memory.clear_memory)
+
+
+class AsyncAIEngine:
+    """asyncio API over an AIEngine.
+
+    Shares the engine's mode, caches, memory, prompt building and generation
+    options, and answers exactly as AIEngine.get_response would, but talks to the
+    backends through aiohttp so many conversations can run on one event loop
+    without a thread each. To stop a call, cancel its task: the backend connection
+    is dropped, and the partial answer is stored only if the engine's
+    store_partial_responses is set.
+    """
+
+    def __init__(self, engine=None, max_concurrency=None):
+        self.engine = engine or AIEngine()
+        self.memory = AsyncMemory(self.engine.memory)
+        # By default each backend gets as many requests in flight as the sync client allows
+        limits = {"max_concurrency": max_concurrency} if max_concurrency else {}
+        self.clients = {name: AsyncBackendClient.like(provider.client, **limits)
+                        for name, provider in self.engine.backends.providers.items()}
+
+    def for_session(self, memory):
+        """An AsyncAIEngine for a separate conversation, sharing this one's HTTP clients."""
+        session = copy.copy(self)
+        session.engine = self.engine.for_session(memory)
+        session.memory = AsyncMemory(memory)
+        return session
+
+    async def get_response(self, user_input, update_chat_live=None):
+        """Answers user_input, passing the labelled text so far to update_chat_live if given."""
+        engine = self.engine
+        telemetry = engine.telemetry
+        with telemetry.trace(user_input):
+            # Routing first: whether the cache may answer depends on the backend asked
+            with telemetry.span("routing"):
+                backend = engine.choose_backend(user_input)
+            # Cache lookups and the post-processing below may touch SQLite or an
+            # embedding model, so they run off the event loop
+            with telemetry.span("cache_lookup"):
+                cache_key, time_sensitive, cached_response = await asyncio.to_thread(
+                    engine.lookup_cached, user_input, backend)
+            if cached_response is not None:
+                log.debug("Returning cached response")
+                telemetry.count("requests", backend="cache")
+                if update_chat_live:
+                    update_chat_live(cached_response)
+                return cached_response
+
+            # Remember the newest partial text so a cancelled call can still be recorded
+            latest = [""]
+
+            def on_update(text):
+                latest[0] = text
+                if update_chat_live:
+                    update_chat_live(text)
+
+            try:
+                telemetry.count("requests", backend=backend)
+                if backend == "hedged":
+                    final_response = await self.hedged_response(user_input, on_update)
+                else:
+                    final_response = await self.ask_with_failover(backend, user_input, on_update)
+            except asyncio.CancelledError:
+                # Only queues the partial turn for the memory writer; awaiting here could be cancelled again
+                engine.finish_response(user_input, latest[0], cache_key, time_sensitive, cancelled=True)
+                raise
+
+            final_response = await asyncio.to_thread(
+                engine.finish_response, user_input, final_response, cache_key, time_sensitive
+            )
+            if update_chat_live:
+                update_chat_live(final_response)
+            return final_response
+
+    async def stream_response(self, user_input):
+        """Async iterator over the labelled answer so far; the last item is the final answer.
+
+        Updates that arrive while the consumer is busy are collapsed into the newest
+        one, since each carries the whole text, and repeats are skipped. Leaving the
+        loop early cancels the call.
+        """
+        updates = asyncio.Queue()
+        task = asyncio.ensure_future(self.get_response(user_input, updates.put_nowait))
+        task.add_done_callback(lambda _: updates.put_nowait(None))
+        try:
+            finished = False
+            last = None
+            while not finished:
+                text = await updates.get()
+                while not updates.empty():
+                    newer = updates.get_nowait()
+                    if newer is None:
+                        finished = True
+                    else:
+                        text = newer
+                if text is None:
+                    break
+                if text != last:
+                    last = text
+                    yield text
+            await task  # surfaces an exception raised by get_response
+        finally:
+            task.cancel()
+
+    async def ask_backend(self, provider, user_input, on_partial=None):
+        """Asks one provider with the protocol of its kind and records how the call went."""
+        ask = self.ask_phi3 if provider.kind == "ollama" else self.get_openai_response
+        answer = await ask(user_input, on_partial, provider)
+        provider.record(not self.engine.is_error_response(answer))
+        return answer
+
+    async def ask_with_failover(self, name, user_input, update_chat_live=None):
+        """Asks provider name, moving on to the next candidate if it is down, slow or fails before answering."""
+        engine = self.engine
+        for provider in engine.backends.candidates(name, same_kind=engine.ai_mode.endswith("_only")):
+            live = engine.live_callback(f"({provider.label}) ", update_chat_live) if update_chat_live else None
+            streamed = []
+
+            def on_partial(text):
+                streamed.append(True)
+                if live:
+                    live(text)
+
+            answer = await self.ask_backend(provider, user_input, on_partial)
+            if streamed or not engine.is_error_response(answer):
+                break
+            log.warning("%s failed before answering (%.80s); trying the next backend", provider.name, answer)
+            engine.telemetry.count("failovers", backend=provider.name)
+        return engine.labelled(provider, answer)
+
+    async def ask_phi3(self, user_input, on_partial=None, provider=None):
+        """Queries an Ollama model (Phi-3 unless provider says otherwise), streaming partial text to on_partial."""
+        engine = self.engine
+        provider = provider or engine.backends.local
+        client = self.clients[provider.name]
+        # Retrieval and history reads touch SQLite and NumPy; keep them off the loop
+        with engine.telemetry.span("prompt_build"):
+            data, turn = await asyncio.to_thread(engine.phi3_request, user_input, provider)
+
+        response = None
+        started = time.perf_counter()
+        stream = OllamaStream(engine, provider, data, turn, engine.timed_partial(provider, started, on_partial))
+        try:
+            response = await client.post(provider.url, json=data)
+            engine.telemetry.stage(f"{provider.name}_connect", time.perf_counter() - started)
+            response.raise_for_status()
+            async for line in response.content:
+                if stream.feed(line.strip()):
+                    break
+            return stream.answer()
+        except (aiohttp.ClientError, asyncio.TimeoutError, BackendBusyError, ValueError) as e:
+            return engine.backend_error(provider, e)
+        finally:
+            if response is not None:
+                client.release(response)
+            engine.telemetry.stage(f"{provider.name}_complete", time.perf_counter() - started)
+
+    async def get_openai_response(self, user_input, on_partial=None, provider=None):
+        """Calls an OpenAI-compatible API (OpenAI unless provider says otherwise), streaming partial text to on_partial."""
+        engine = self.engine
+        provider = provider or engine.backends.remote
+        client = self.clients[provider.name]
+        if not provider.api_key:
+            return engine.not_configured(provider)
+
+        headers, data = engine.openai_request(user_input, provider)
+        response = None
+        started = time.perf_counter()
+        stream = OpenAIStream(engine, provider, data.get("stop", []), engine.timed_partial(provider, started, on_partial))
+        try:
+            response = await client.post(provider.url, headers=headers, json=data)
+            engine.telemetry.stage(f"{provider.name}_connect", time.perf_counter() - started)
+            if not response.ok:
+                return engine.http_error(provider, response.status, await response.json(content_type=None))
+
+            async for line in response.content:
+                if stream.feed(line.strip()):
+                    break
+            return stream.answer()
+        except (aiohttp.ClientError, asyncio.TimeoutError, BackendBusyError, ValueError) as e:
+            return engine.backend_error(provider, e)
+        finally:
+            if response is not None:
+                client.release(response)
+            engine.telemetry.stage(f"{provider.name}_complete", time.perf_counter() - started)
+
+    async def hedged_response(self, user_input, update_chat_live=None):
+        """Sends the question to the local and remote providers and keeps whichever starts answering first."""
+        backends = self.engine.backends
+        local, remote = backends.local, backends.remote
+        if not (backends.is_available(local) and backends.is_available(remote)):
+            # Nothing to race; ask whichever is up (or report the local error)
+            name = remote.name if backends.is_available(remote) else local.name
+            return await self.ask_with_failover(name, user_input, update_chat_live)
+
+        providers = {local.name: local, remote.name: remote}
+        live = {name: self.engine.live_callback(f"({provider.label}) ", update_chat_live) if update_chat_live else None
+                for name, provider in providers.items()}
+        winner = []
+        tasks = {}
+
+        def on_partial(name, text):
+            # The first backend to produce text wins; the other one is cancelled right away
+            if not winner:
+                winner.append(name)
+                loser = remote.name if name == local.name else local.name
+                log.debug("%s answered first, cancelling %s", name, loser)
+                tasks[loser].cancel()
+            if winner[0] == name and live[name]:
+                live[name](text)
+
+        for name, provider in providers.items():
+            tasks[name] = asyncio.ensure_future(
+                self.ask_backend(provider, user_input, lambda text, name=name: on_partial(name, text))
+            )
+        results = dict(zip(tasks, await asyncio.gather(*tasks.values(), return_exceptions=True)))
+        # Neither backend produced text (errors, missing API key); report the local outcome
+        name = winner[0] if winner else local.name
+        if isinstance(results[name], BaseException):
+            # An exception from the call being kept is a failure, not text to show
+            raise results[name]
+        return self.engine.labelled(providers[name], results[name])
+
+    async def close(self):
+        """Closes the backend sessions; the wrapped AIEngine stays usable."""
+        for client in self.clients.values():
+            await client.close()
+
+
+async def demo(prompts, concurrency=8):
+    """Answers prompts concurrently on one event loop and prints each answer."""
+    engine = AsyncAIEngine()
+    limit = asyncio.Semaphore(concurrency)
+
+    async def answer(prompt):
+        async with limit:
+            print(f"{prompt} -> {await engine.get_response(prompt)}")
+
+    try:
+        await asyncio.gather(*(answer(prompt) for prompt in prompts))
+    finally:
+        await engine.close()
+
+
+if __name__ == "__main__":
+    configure_logging()
+    asyncio.run(demo(["Hello!", "What can you do?", "Tell me a joke."]))
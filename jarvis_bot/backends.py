@@ -0,0 +1,318 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from urllib.parse import urljoin
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+log = logging.getLogger("jarvis.backends")
+
+
+class BackendBusyError(requests.exceptions.RequestException):
+    """Raised when a backend has no free slot within the queue timeout."""
+
+
+class BackendClient:
+    """Pooled keep-alive HTTP client for one model backend (Ollama, OpenAI, ...)."""
+
+    RETRY_STATUSES = (429, 502, 503, 504)
+
+    def __init__(self, name, connect_timeout=3.05, read_timeout=120, max_retries=3,
+                 backoff_factor=0.5, max_concurrency=2, pool_size=4, queue_timeout=None):
+        self.name = name
+        self.timeout = (connect_timeout, read_timeout)
+        self.queue_timeout = queue_timeout
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.pool_size = pool_size
+
+        # Connection errors and overload statuses are retried with exponential backoff.
+        # POST is retried too: a failed connect or a 429/503 means the model never ran.
+        retry = Retry(
+            total=max_retries,
+            connect=max_retries,
+            read=0,
+            status=max_retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=self.RETRY_STATUSES,
+            allowed_methods=None,
+            respect_retry_after_header=True,
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        # Caps how many requests this backend serves at once
+        self.slots = threading.BoundedSemaphore(max_concurrency)
+        self.held = set()
+        self.lock = threading.Lock()
+
+    def post(self, url, **kwargs):
+        """Sends a streaming POST once a slot is free; pair every call with release()."""
+        if not self.slots.acquire(timeout=self.queue_timeout):
+            raise BackendBusyError(f"{self.name} backend is busy ({self.max_concurrency} requests in flight)")
+        try:
+            kwargs.setdefault("timeout", self.timeout)
+            response = self.session.post(url, stream=True, **kwargs)
+        except BaseException:
+            self.slots.release()
+            raise
+        with self.lock:
+            self.held.add(response)
+        return response
+
+    def release(self, response):
+        """Frees the slot held by response.
+
+        A stream that was read to the end goes back to the pool for reuse; one that
+        was abandoned part-way has its connection closed.
+        """
+        with self.lock:
+            if response not in self.held:
+                return
+            self.held.discard(response)
+        try:
+            response.close()
+        finally:
+            self.slots.release()
+
+    def close(self):
+        """Closes every pooled connection."""
+        self.session.close()
+
+
+class Provider:
+    """A model endpoint from the backend config: an Ollama model or an OpenAI-compatible chat API.
+
+    Keeps the outcomes and times to first token of its last `window` calls, which
+    is what BackendRegistry fails over on.
+    """
+
+    KINDS = ("ollama", "openai")
+
+    def __init__(self, name, kind, url, model, label=None, api_key=None, api_key_env=None,
+                 read_timeout=120, max_concurrency=2, slow_after=None, window=20):
+        if kind not in self.KINDS:
+            raise ValueError(f"Backend {name!r} has unknown kind {kind!r} (expected one of {self.KINDS})")
+        self.name = name
+        self.kind = kind
+        self.url = url
+        self.model = model
+        self.label = label or name
+        self.api_key = api_key or (os.getenv(api_key_env) if api_key_env else None)
+        self.slow_after = slow_after  # seconds to first token that count as too slow
+        self.client = BackendClient(name, read_timeout=read_timeout, max_concurrency=max_concurrency)
+
+        self.outcomes = deque(maxlen=window)  # True for an answer, False for an error
+        self.latencies = deque(maxlen=window)  # seconds to first token
+        self.healthy = True  # result of the last health check
+        self.tripped_at = None  # when it was last found failing or slow
+        self.lock = threading.Lock()
+
+    @property
+    def configured(self):
+        return self.kind != "openai" or bool(self.api_key)
+
+    def record(self, ok):
+        with self.lock:
+            self.outcomes.append(ok)
+
+    def record_latency(self, seconds):
+        with self.lock:
+            self.latencies.append(seconds)
+
+    def error_rate(self):
+        outcomes = list(self.outcomes)
+        return outcomes.count(False) / len(outcomes) if outcomes else 0.0
+
+    def latency(self):
+        """Median time to first token over the window, or None before the first answer."""
+        latencies = sorted(self.latencies)
+        return latencies[len(latencies) // 2] if latencies else None
+
+    def health_url(self):
+        if self.kind == "ollama":
+            return urljoin(self.url, "/api/tags")
+        return self.url.rsplit("/chat/completions", 1)[0] + "/models"
+
+    def status(self):
+        latency = self.latency()
+        return {
+            "kind": self.kind, "model": self.model, "configured": self.configured, "healthy": self.healthy,
+            "tripped": self.tripped_at is not None, "calls": len(self.outcomes),
+            "error_rate": round(self.error_rate(), 3),
+            "latency": round(latency, 4) if latency is not None else None
+        }
+
+
+class BackendRegistry:
+    """The configured providers, their health, and the order to try them in.
+
+    Providers are read from a JSON file: the JARVIS_BACKENDS path, else
+    backends.json next to this module, else the built-in Phi-3 + OpenAI pair.
+
+        {"local": "phi3", "remote": "groq", "providers": [
+            {"name": "phi3", "kind": "ollama", "label": "Phi-3",
+             "url": "http://localhost:11434/api/generate", "model": "phi3"},
+            {"name": "groq", "kind": "openai", "label": "Groq", "model": "llama-3.1-8b-instant",
+             "url": "https://api.groq.com/openai/v1/chat/completions",
+             "api_key_env": "GROQ_API_KEY", "slow_after": 2.0}
+        ]}
+
+    Every provider gets a "<name>_only" mode; hybrid modes route between local
+    (default: the first Ollama provider) and remote (the first OpenAI-compatible
+    one). A provider is skipped while its last health check failed, or while more
+    than max_error_rate of its recent calls failed or its median time to first
+    token is over its slow_after; retry_after seconds later it gets a fresh start.
+    """
+
+    DEFAULT_PROVIDERS = [
+        {"name": "phi3", "kind": "ollama", "label": "Phi-3", "model": "phi3",
+         "url": "http://localhost:11434/api/generate"},
+        {"name": "openai", "kind": "openai", "label": "OpenAI", "model": "gpt-4o",  # GPT-4o for better accuracy
+         "url": "https://api.openai.com/v1/chat/completions", "api_key_env": "OPENAI_API_KEY",
+         "read_timeout": 60, "max_concurrency": 4}
+    ]
+
+    def __init__(self, providers, local=None, remote=None, max_error_rate=0.5, min_calls=4, retry_after=30.0):
+        self.providers = {provider.name: provider for provider in providers}
+        if not self.providers:
+            raise ValueError("No backends configured")
+        first_of = lambda kind: next((p.name for p in providers if p.kind == kind), providers[0].name)
+        self.local = self.providers[local or first_of("ollama")]
+        self.remote = self.providers[remote or first_of("openai")]
+        self.max_error_rate = max_error_rate
+        self.min_calls = min_calls
+        self.retry_after = retry_after
+        self.health_thread = None
+        self.stop_checks = threading.Event()
+
+    @classmethod
+    def from_config(cls, path=None):
+        try:
+            from dotenv import load_dotenv
+            load_dotenv()  # API keys may come from .env
+        except ImportError:
+            pass
+        path = path or os.getenv("JARVIS_BACKENDS")
+        config = {}
+        if path:
+            with open(path) as f:
+                config = json.load(f)
+        else:
+            default_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "backends.json")
+            if os.path.exists(default_path):
+                with open(default_path) as f:
+                    config = json.load(f)
+        specs = config.pop("providers", None) or cls.DEFAULT_PROVIDERS
+        return cls([Provider(**spec) for spec in specs], **config)
+
+    def get(self, name):
+        return self.providers[name]
+
+    def labels(self):
+        """The labels answers are prefixed with, e.g. "Phi-3" in "(Phi-3) Hello"."""
+        return [provider.label for provider in self.providers.values()]
+
+    def modes(self):
+        """The ai_mode values these providers support, for mode selectors and validation."""
+        modes = [f"{name}_only" for name in self.providers]
+        if self.local is not self.remote:
+            modes += ["hybrid", "hybrid_hedged"]
+        return modes
+
+    def is_available(self, provider):
+        if not provider.configured or not provider.healthy:
+            return False
+        with provider.lock:
+            failing = len(provider.outcomes) >= self.min_calls and provider.error_rate() > self.max_error_rate
+            latency = provider.latency()
+            slow = (provider.slow_after is not None and len(provider.latencies) >= self.min_calls
+                    and latency > provider.slow_after)
+            if not (failing or slow):
+                provider.tripped_at = None
+                return True
+            now = time.time()
+            if provider.tripped_at is None:
+                provider.tripped_at = now
+                log.warning("Backend %s is %s; failing over", provider.name,
+                            "failing" if failing else f"slow ({latency:.2f}s to first token)")
+                return False
+            if now - provider.tripped_at < self.retry_after:
+                return False
+            # Give it another chance with a clean record
+            provider.outcomes.clear()
+            provider.latencies.clear()
+            provider.tripped_at = None
+            return True
+
+    def candidates(self, name, same_kind=False):
+        """Providers to try for a call meant for name, best first.
+
+        name comes first if it is available; the other available providers follow,
+        those of the same kind and then the fastest first, with those not yet timed
+        last. same_kind=True leaves out providers of another kind (for "<name>_only"
+        modes). An unavailable name is kept as the last resort, so its own error is
+        what the user sees.
+        """
+        preferred = self.providers[name]
+        others = [p for p in self.providers.values() if p is not preferred and self.is_available(p)
+                  and not (same_kind and p.kind != preferred.kind)]
+
+        def rank(provider):
+            latency = provider.latency()
+            return provider.kind != preferred.kind, latency is None, latency or 0.0
+
+        others.sort(key=rank)
+        if self.is_available(preferred):
+            return [preferred] + others
+        return others + [preferred]
+
+    def check(self, provider):
+        """Health-checks provider with a cheap GET (Ollama /api/tags, OpenAI /models)."""
+        headers = {"Authorization": f"Bearer {provider.api_key}"} if provider.api_key else {}
+        try:
+            response = provider.client.session.get(provider.health_url(), headers=headers, timeout=(3.05, 5))
+            healthy = response.status_code < 500  # reachable; a 401/404 here still means it is up
+            response.close()
+        except requests.exceptions.RequestException:
+            healthy = False
+        if healthy != provider.healthy:
+            log.warning("Backend %s is %s", provider.name, "back up" if healthy else "down")
+        provider.healthy = healthy
+        return healthy
+
+    def check_all(self):
+        return {name: self.check(provider) for name, provider in self.providers.items() if provider.configured}
+
+    def start_health_checks(self, interval=30.0):
+        """Checks every configured provider now and then every interval seconds, on a daemon thread."""
+        if self.health_thread is not None:
+            return
+
+        def loop():
+            while True:
+                self.check_all()
+                if self.stop_checks.wait(interval):
+                    return
+
+        self.stop_checks.clear()
+        self.health_thread = threading.Thread(target=loop, name="backend-health", daemon=True)
+        self.health_thread.start()
+
+    def stop_health_checks(self):
+        self.stop_checks.set()
+        if self.health_thread is not None:
+            self.health_thread.join()
+            self.health_thread = None
+
+    def status(self):
+        return {name: {**provider.status(), "available": self.is_available(provider)}
+                for name, provider in self.providers.items()}
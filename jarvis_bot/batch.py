@@ -0,0 +1,232 @@
+"""Headless batch mode: answers a JSONL file of prompts without a GUI.
+
+Each input line is either a JSON string or an object with a "prompt" field (and
+optionally an "id"). Every answered line becomes one output line:
+
+    {"id": ..., "line": 7, "prompt": "...", "response": "...", "seconds": 1.42, "error": false}
+
+Example:
+    python batch.py prompts.jsonl -o answers.jsonl --concurrency 8 --mode phi3_only
+    cat prompts.jsonl | python batch.py - -o answers.jsonl --as-completed
+
+Progress is checkpointed next to the output (answers.jsonl.progress); running the
+same command again after an interruption continues where it stopped. By default
+the prompts are answered independently (no history or retrieval), are not
+written to the conversation history, but do warm the response cache.
+"""
+
+import startup
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from ai_engine import AIEngine, ErrorResponse
+from async_engine import AsyncAIEngine
+from backends import BackendRegistry
+from memory import Memory
+from telemetry import configure_logging
+
+
+class Checkpoint:
+    """How far a batch run got, saved atomically beside its output file.
+
+    next_line is the first input line not yet written; done holds the lines past
+    it that were written out of order; output_bytes is the output size at that
+    point, so a resumed run can cut off anything written after the last save.
+    """
+
+    def __init__(self, path, interval=1.0):
+        self.path = path
+        self.interval = interval
+        self.saved_at = 0.0
+        self.reset()
+        if os.path.exists(path):
+            with open(path) as f:
+                self.state = json.load(f)
+
+    def reset(self):
+        self.state = {"next_line": 0, "done": [], "output_bytes": 0}
+
+    def save(self, next_line, done, output_bytes, force=False):
+        now = time.monotonic()
+        if not force and now - self.saved_at < self.interval:
+            return
+        self.saved_at = now
+        self.state = {"next_line": next_line, "done": sorted(done), "output_bytes": output_bytes}
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump(self.state, f)
+        os.replace(temp_path, self.path)
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def parse_record(line_number, line):
+    """Returns (id, prompt) for an input line, or None for a blank one."""
+    line = line.strip()
+    if not line:
+        return None
+    record = json.loads(line)
+    if isinstance(record, str):
+        return line_number + 1, record
+    return record.get("id", line_number + 1), record["prompt"]
+
+
+class BatchRunner:
+    """Feeds input lines to an AsyncAIEngine and writes answers as JSONL.
+
+    At most concurrency prompts are answered at once. In ordered mode results are
+    held back until every earlier line is written; window caps how many lines can
+    be in flight or held back, so one slow prompt cannot make memory grow without
+    bound.
+    """
+
+    def __init__(self, engine, output, checkpoint, concurrency=4, ordered=True, window=None):
+        self.engine = engine
+        self.output = output
+        self.checkpoint = checkpoint
+        self.ordered = ordered
+        self.slots = asyncio.Semaphore(concurrency)
+        self.window = window or concurrency * 4
+        self.next_line = checkpoint.state["next_line"]
+        self.done = set(checkpoint.state["done"])
+        self.held = {}  # line -> result waiting for earlier lines (ordered mode)
+        self.counters = {"answered": 0, "errors": 0, "skipped": 0}
+
+    async def answer(self, line_number, line):
+        try:
+            parsed = parse_record(line_number, line)
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            return {"id": line_number + 1, "line": line_number + 1, "prompt": None,
+                    "response": f"Error: unreadable input line ({e})", "seconds": 0.0, "error": True}
+        if parsed is None:
+            return None
+        record_id, prompt = parsed
+        async with self.slots:
+            started = time.perf_counter()
+            try:
+                response = await self.engine.get_response(prompt)
+            except Exception as e:
+                response = ErrorResponse(f"Error: {e}")
+            seconds = time.perf_counter() - started
+        return {"id": record_id, "line": line_number + 1, "prompt": prompt, "response": response,
+                "seconds": round(seconds, 3), "error": self.engine.engine.is_error_response(response)}
+
+    def finished(self, line_number, result):
+        if not self.ordered:
+            self.emit(line_number, result)
+        else:
+            self.held[line_number] = result
+            while self.next_line in self.held:
+                self.emit(self.next_line, self.held.pop(self.next_line))
+        self.output.flush()
+        self.checkpoint.save(self.next_line, self.done, self.output.tell())
+
+    def emit(self, line_number, result):
+        if result is not None:
+            self.output.write(json.dumps(result, ensure_ascii=False) + "\n")
+            self.counters["errors" if result["error"] else "answered"] += 1
+        self.done.add(line_number)
+        while self.next_line in self.done:
+            self.done.remove(self.next_line)
+            self.next_line += 1
+
+    async def run(self, lines):
+        running = {}  # task -> line number
+        resume_from = self.next_line
+        already_done = set(self.done)
+        line_number = -1
+        try:
+            while True:
+                # Reading stdin can block, so it happens off the loop
+                line = await asyncio.to_thread(next, lines, None)
+                if line is None:
+                    break
+                line_number += 1
+                if line_number < resume_from or line_number in already_done:
+                    self.counters["skipped"] += 1
+                    continue
+                while len(running) + len(self.held) >= self.window:
+                    await self.collect(running)
+                running[asyncio.ensure_future(self.answer(line_number, line))] = line_number
+            while running:
+                await self.collect(running)
+        finally:
+            # Also on Ctrl+C, so the next run resumes from the last written line
+            self.checkpoint.save(self.next_line, self.done, self.output.tell(), force=True)
+
+    async def collect(self, running):
+        finished, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+        for task in finished:
+            self.finished(running.pop(task), task.result())
+
+
+async def run_batch(args):
+    ai_engine = AIEngine(memory=Memory(args.db))
+    ai_engine.stream_responses = False
+    if args.mode:
+        ai_engine.set_ai_mode(args.mode)
+    ai_engine.use_cached_answers = not args.fresh
+    ai_engine.store_conversations = args.store
+    if not args.context:
+        ai_engine.context_history_turns = 0
+        ai_engine.retrieval_top_k = 0
+    engine = AsyncAIEngine(ai_engine, max_concurrency=args.concurrency)
+    startup.mark("engine")
+    startup.mark("ready")
+    if startup.probing():
+        await engine.close()
+        ai_engine.memory.close()
+        return
+
+    checkpoint = Checkpoint(args.checkpoint or f"{args.output}.progress")
+    if not os.path.exists(args.output):
+        checkpoint.reset()  # nothing to resume into
+    # Anything written after the last checkpoint is redone, so drop it first
+    mode = "r+" if os.path.exists(checkpoint.path) and checkpoint.state["output_bytes"] else "w"
+    source = sys.stdin if args.input == "-" else open(args.input, encoding="utf-8")
+    with source, open(args.output, mode, encoding="utf-8") as output:
+        output.seek(checkpoint.state["output_bytes"])
+        output.truncate()
+        runner = BatchRunner(engine, output, checkpoint, args.concurrency, ordered=not args.as_completed)
+        started = time.perf_counter()
+        try:
+            await runner.run(iter(source))
+        finally:
+            await engine.close()
+    elapsed = time.perf_counter() - started
+    checkpoint.remove()
+    ai_engine.memory.close()
+
+    counters = runner.counters
+    total = counters["answered"] + counters["errors"]
+    print(f"{total} prompts in {elapsed:.1f}s ({total / elapsed if elapsed else 0:.2f}/s): "
+          f"{counters['errors']} errors, {counters['skipped']} already done, "
+          f"cache hit rate {ai_engine.cache.stats()['hit_rate']:.0%}", file=sys.stderr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Answer a JSONL file of prompts without a GUI.")
+    parser.add_argument("input", help="JSONL file of prompts, or - for stdin")
+    parser.add_argument("-o", "--output", required=True, help="JSONL file to write answers to")
+    parser.add_argument("-c", "--concurrency", type=int, default=4, help="prompts answered at once")
+    parser.add_argument("--mode", choices=BackendRegistry.from_config().modes())
+    parser.add_argument("--as-completed", action="store_true",
+                        help="write answers as they finish instead of in input order")
+    parser.add_argument("--checkpoint", help="progress file (default: OUTPUT.progress)")
+    parser.add_argument("--db", default="memory.db", help="memory database (holds the response cache)")
+    parser.add_argument("--fresh", action="store_true", help="ignore cached answers")
+    parser.add_argument("--context", action="store_true",
+                        help="use conversation history and retrieval like the chat window does")
+    parser.add_argument("--store", action="store_true", help="record the turns in conversation history")
+    args = parser.parse_args(argv)
+    configure_logging()
+    asyncio.run(run_batch(args))
+
+
+if __name__ == "__main__":
+    main()
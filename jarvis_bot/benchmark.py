@@ -0,0 +1,241 @@
+"""End-to-end and micro benchmarks against stand-in Ollama/OpenAI servers.
+
+    python benchmark.py                              # every mode, results/benchmark-<time>.json
+    python benchmark.py --modes hybrid --requests 400 --concurrency 8
+    python benchmark.py --ttft 0.2 --token-delay 0.03 --compare results/benchmark-old.json
+
+The end-to-end part drives AIEngine.get_response from a thread pool (as the GUI
+scheduler does) in each ai_mode and reports latency percentiles, time to first
+streamed text, throughput and cache hit rate. The micro part times Memory
+operations (including the cost of getting a write onto disk), the response
+caches and should_use_openai. Results are saved as JSON; --compare prints the
+change against an earlier file.
+"""
+
+import argparse
+import itertools
+import json
+import os
+import random
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from ai_engine import AIEngine
+from cache import SemanticCache, HashingEmbedder
+from fake_backends import FakeBackend, start_in_thread, point_engine_at
+from memory import Memory
+from telemetry import configure_logging
+
+MODES = ["phi3_only", "openai_only", "hybrid", "hybrid_hedged"]
+
+OPENERS = ["Tell me about", "How do I", "Explain", "Give me ideas for", "What do you think of", "Help me with"]
+TOPICS = [
+    "sourdough", "bonsai", "compilers", "marathons", "jazz", "origami", "tax returns", "sailing", "chess",
+    "gardening", "watercolors", "kubernetes", "beekeeping", "poetry", "woodworking", "astronomy", "knitting",
+    "photography", "budgeting", "climbing", "espresso", "guitar", "sleep", "meditation", "python"
+]
+FACTUAL = ["What is the latest news about", "Who won the", "What are the current results of"]
+
+
+def make_workload(count, repeat_ratio=0.3, factual_ratio=0.15, seed=1):
+    """Prompt list where repeat_ratio of requests re-ask an earlier prompt."""
+    rng = random.Random(seed)
+    prompts = []
+    for n in range(count):
+        if prompts and rng.random() < repeat_ratio:
+            prompts.append(rng.choice(prompts))
+        elif rng.random() < factual_ratio:
+            prompts.append(f"{rng.choice(FACTUAL)} {rng.choice(TOPICS)} {n}?")
+        else:
+            prompts.append(f"{rng.choice(OPENERS)} {rng.choice(TOPICS)} and {rng.choice(TOPICS)} #{n}")
+    return prompts
+
+
+def percentiles(values):
+    if not values:
+        return {"p50": None, "p95": None, "p99": None}
+    values = sorted(values)
+    pick = lambda fraction: round(values[min(len(values) - 1, int(fraction * len(values)))], 5)
+    return {"p50": pick(0.50), "p95": pick(0.95), "p99": pick(0.99)}
+
+
+def time_per_call(function, repeat):
+    """Mean seconds per call of function over repeat calls."""
+    started = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    return (time.perf_counter() - started) / repeat
+
+
+def bench_mode(mode, prompts, ollama_url, openai_url, concurrency, db_dir):
+    """Runs prompts through a fresh AIEngine in mode and returns its measurements."""
+    engine = AIEngine(memory=Memory(os.path.join(db_dir, f"{mode}.db")))
+    point_engine_at(engine, ollama_url, openai_url)
+    engine.set_ai_mode(mode)
+    # Each prompt stands alone, so repeated prompts can be answered from the cache
+    engine.context_history_turns = 0
+    engine.retrieval_top_k = 0
+
+    def one(prompt):
+        started = time.perf_counter()
+        first_text = []
+
+        def update(text):
+            if not first_text:
+                first_text.append(time.perf_counter() - started)
+
+        engine.get_response(prompt, update)
+        return time.perf_counter() - started, first_text[0]
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one, prompts))
+    elapsed = time.perf_counter() - started
+    engine.memory.flush()
+
+    cache = engine.cache.stats()
+    semantic = engine.semantic_cache.stats() if engine.semantic_cache is not None else {"hits": 0}
+    lookups = cache["hits"] + cache["misses"]
+    engine.memory.close()
+    return {
+        "requests": len(prompts),
+        "seconds": round(elapsed, 3),
+        "throughput": round(len(prompts) / elapsed, 2),
+        "latency": percentiles([latency for latency, _ in results]),
+        "first_text": percentiles([first for _, first in results]),
+        "cache_hit_rate": round((cache["hits"] + semantic["hits"]) / lookups, 3) if lookups else 0.0,
+        "exact_cache_hits": cache["hits"],
+        "semantic_cache_hits": semantic["hits"]
+    }
+
+
+def bench_memory(db_dir, rows=20000, repeat=2000):
+    """Per-operation cost of Memory calls, in microseconds."""
+    memory = Memory(os.path.join(db_dir, "micro.db"))
+    results = {}
+    n = iter(range(10 ** 9))
+
+    results["store_conversation_queued"] = time_per_call(
+        lambda: memory.store_conversation(f"question {next(n)}", "an answer of ordinary length " * 4), repeat
+    )
+    memory.flush()
+    # The cost a caller pays to know its turn is on disk: one transaction per write
+    results["store_conversation_durable"] = time_per_call(
+        lambda: (memory.store_conversation(f"question {next(n)}", "answer"), memory.flush()), repeat // 10
+    )
+    # The writer thread's cost per row when writes arrive faster than it commits
+    started = time.perf_counter()
+    for i in range(rows):
+        memory.store_conversation(f"bulk question {i} about {TOPICS[i % len(TOPICS)]}", "bulk answer " * 8)
+    memory.flush()
+    results["store_conversation_batched_per_row"] = (time.perf_counter() - started) / rows
+
+    results["get_recent_conversations_10"] = time_per_call(lambda: memory.get_recent_conversations(10), repeat)
+    results["search_conversations"] = time_per_call(lambda: memory.search_conversations("sourdough bulk"), repeat // 10)
+    results["store_user_data"] = time_per_call(lambda: memory.store_user_data("name", str(next(n))), repeat // 10)
+    results["get_user_data"] = time_per_call(lambda: memory.get_user_data("name"), repeat)
+    memory.close()
+    return {name: round(seconds * 1e6, 2) for name, seconds in results.items()}
+
+
+def bench_engine_helpers(db_dir, repeat=20000):
+    """Per-call cost of routing and cache lookups, in microseconds."""
+    engine = AIEngine(memory=Memory(os.path.join(db_dir, "helpers.db")))
+    prompts = make_workload(200, repeat_ratio=0.0, factual_ratio=0.3)
+    cycle = itertools.cycle(prompts)
+    results = {"should_use_openai": time_per_call(lambda: engine.should_use_openai(next(cycle)), repeat)}
+
+    # The engine's semantic tier is off by default; time the matrix lookup with the local embedder
+    semantic_cache = SemanticCache(HashingEmbedder(), threshold=0.9)
+    for prompt in prompts:
+        engine.cache.put(engine.cache_key(prompt), "cached answer")
+        semantic_cache.put(engine.cache_namespace(), prompt, "cached answer")
+    cycle = itertools.cycle(prompts)
+    results["cache_get_hit"] = time_per_call(lambda: engine.cache.get(engine.cache_key(next(cycle))), repeat)
+    results["cache_get_miss"] = time_per_call(lambda: engine.cache.get(engine.cache_key("never asked")), repeat // 10)
+    results["semantic_cache_get"] = time_per_call(
+        lambda: semantic_cache.get(engine.cache_namespace(), "never asked before"), repeat // 10
+    )
+    results["cache_put"] = time_per_call(lambda: engine.cache.put(engine.cache_key(next(cycle)), "answer"), repeat // 10)
+    engine.memory.close()
+    return {name: round(seconds * 1e6, 3) for name, seconds in results.items()}
+
+
+def compare(current, previous, path=()):
+    """Prints every numeric result that moved by more than 5% since previous."""
+    for key, value in current.items():
+        old = previous.get(key) if isinstance(previous, dict) else None
+        if isinstance(value, dict):
+            compare(value, old or {}, path + (key,))
+        elif isinstance(value, (int, float)) and isinstance(old, (int, float)) and old:
+            change = (value - old) / old
+            if abs(change) > 0.05:
+                print(f"  {'.'.join(path + (key,)):<50} {old:>12} -> {value:<12} ({change:+.0%})")
+
+
+def run(args):
+    ollama = FakeBackend(args.tokens, args.ttft, args.token_delay, args.ollama_concurrency)
+    openai = FakeBackend(args.tokens, args.openai_ttft, args.openai_token_delay)
+    ollama_url, stop_ollama = start_in_thread(ollama)
+    openai_url, stop_openai = start_in_thread(openai)
+    db_dir = tempfile.mkdtemp()
+    prompts = make_workload(args.requests, args.repeat_ratio)
+    results = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        "modes": {},
+        "memory_us": {},
+        "engine_us": {}
+    }
+
+    try:
+        for mode in args.modes:
+            results["modes"][mode] = bench_mode(mode, prompts, ollama_url, openai_url, args.concurrency, db_dir)
+        if not args.skip_micro:
+            results["memory_us"] = bench_memory(db_dir)
+            results["engine_us"] = bench_engine_helpers(db_dir)
+    finally:
+        stop_ollama()
+        stop_openai()
+
+    print(f"{args.requests} requests, concurrency {args.concurrency}, {args.repeat_ratio:.0%} repeats; "
+          f"Ollama TTFT {args.ttft}s + {args.tokens} x {args.token_delay}s")
+    print(f"{'mode':<14} {'req/s':>7} {'p50':>7} {'p95':>7} {'p99':>7} {'ttft50':>7} {'ttft95':>7} {'hits':>6}")
+    for mode, r in results["modes"].items():
+        print(f"{mode:<14} {r['throughput']:>7} {r['latency']['p50']:>7.3f} {r['latency']['p95']:>7.3f} "
+              f"{r['latency']['p99']:>7.3f} {r['first_text']['p50']:>7.3f} {r['first_text']['p95']:>7.3f} "
+              f"{r['cache_hit_rate']:>6.1%}")
+    for section in ("memory_us", "engine_us"):
+        for name, micros in results[section].items():
+            print(f"  {name:<40} {micros:>10} us")
+
+    output = args.output or os.path.join("results", f"benchmark-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Saved {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+        print(f"Changes since {args.compare} ({previous.get('timestamp')}):")
+        compare(results, previous)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark Jarvis against stand-in model servers.")
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=MODES)
+    parser.add_argument("--requests", type=int, default=120)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--repeat-ratio", type=float, default=0.3, help="share of prompts asked before")
+    parser.add_argument("--tokens", type=int, default=20, help="tokens per stand-in answer")
+    parser.add_argument("--ttft", type=float, default=0.08, help="Ollama time to first token (s)")
+    parser.add_argument("--token-delay", type=float, default=0.01, help="Ollama seconds per token")
+    parser.add_argument("--ollama-concurrency", type=int, default=2, help="generations Ollama runs at once")
+    parser.add_argument("--openai-ttft", type=float, default=0.3)
+    parser.add_argument("--openai-token-delay", type=float, default=0.005)
+    parser.add_argument("--skip-micro", action="store_true")
+    parser.add_argument("-o", "--output", help="results file (default: results/benchmark-<time>.json)")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    configure_logging()
+    run(parser.parse_args())
@@ -0,0 +1,286 @@
+import logging
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+import numpy as np
+
+log = logging.getLogger("jarvis.cache")
+
+def normalize_prompt(text):
+    """Lowercases and collapses whitespace so trivially different prompts share a key."""
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+
+def make_cache_key(mode, model, prompt, scope=""):
+    """Builds a key that keeps answers from different modes, models and scopes (e.g. sessions) apart."""
+    if scope:
+        return f"{mode}|{model}|{scope}|{normalize_prompt(prompt)}"
+    return f"{mode}|{model}|{normalize_prompt(prompt)}"
+
+
+class ResponseCache:
+    """LRU response cache with per-entry TTLs and an optional SQLite tier.
+
+    The in-memory tier holds at most max_entries answers. When db_path is given,
+    every answer is also written to a response_cache table in that database so
+    warm answers survive a restart; misses in memory fall through to it. Passing
+    a memory.WriteBehindWriter for that database moves those writes off the caller.
+    The database is only opened when the SQLite tier is first used.
+    """
+
+    def __init__(self, max_entries=500, default_ttl=7 * 24 * 3600, db_path=None, max_persistent_entries=5000,
+                 writer=None, trim_every=100):
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self.max_persistent_entries = max_persistent_entries
+        self.writer = writer
+        # The SQLite table is cut back to max_persistent_entries once every trim_every puts
+        self.trim_every = trim_every
+        self.puts = 0
+        self.entries = OrderedDict()  # key -> (response, expires_at)
+        self.lock = threading.Lock()
+        self.db_lock = threading.Lock()  # guards self.conn, so memory hits never wait on SQLite
+        self.stats_counters = {
+            "hits": 0, "misses": 0, "evictions": 0, "expirations": 0, "persistent_hits": 0
+        }
+
+        self.db_path = db_path
+        self.conn = None  # see connection()
+
+    def connection(self):
+        """The SQLite tier's connection, opened on first use (None without a db_path)."""
+        if self.conn is not None or not self.db_path:
+            return self.conn
+        with self.db_lock:
+            opening = self.conn is None
+            if opening:
+                conn = sqlite3.connect(self.db_path, check_same_thread=False)
+                conn.execute('''
+                    CREATE TABLE IF NOT EXISTS response_cache (
+                        key TEXT PRIMARY KEY,
+                        response TEXT,
+                        expires_at REAL
+                    )
+                ''')
+                conn.commit()
+                self.conn = conn
+        if opening:
+            self.write("DELETE FROM response_cache WHERE expires_at <= ?", (time.time(),))
+        return self.conn
+
+    def get(self, key):
+        """Returns the cached response for key, or None on a miss."""
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                response, expires_at = entry
+                if expires_at > now:
+                    self.entries.move_to_end(key)
+                    self.stats_counters["hits"] += 1
+                    return response
+                del self.entries[key]
+                self.stats_counters["expirations"] += 1
+
+        conn = self.connection()
+        if conn is not None:
+            with self.db_lock:
+                row = conn.execute(
+                    "SELECT response, expires_at FROM response_cache WHERE key = ?", (key,)
+                ).fetchone()
+            if row and row[1] > now:
+                with self.lock:
+                    self.store_in_memory(key, row[0], row[1])
+                    self.stats_counters["hits"] += 1
+                    self.stats_counters["persistent_hits"] += 1
+                return row[0]
+
+        with self.lock:
+            self.stats_counters["misses"] += 1
+        return None
+
+    def put(self, key, response, ttl=None):
+        """Caches response under key for ttl seconds (default_ttl if None)."""
+        expires_at = time.time() + (self.default_ttl if ttl is None else ttl)
+        with self.lock:
+            self.store_in_memory(key, response, expires_at)
+            self.puts += 1
+            trim = self.puts % self.trim_every == 0
+        if self.connection() is not None:
+            self.write("REPLACE INTO response_cache (key, response, expires_at) VALUES (?, ?, ?)",
+                       (key, response, expires_at))
+        if self.conn is not None and trim:
+            # Keep the table bounded; the rows expiring soonest go first
+            self.write('''
+                DELETE FROM response_cache WHERE key IN (
+                    SELECT key FROM response_cache ORDER BY expires_at DESC LIMIT -1 OFFSET ?
+                )
+            ''', (self.max_persistent_entries,))
+
+    def write(self, sql, params):
+        if self.writer is not None:
+            self.writer.submit(sql, params)
+            return
+        with self.db_lock:
+            self.conn.execute(sql, params)
+            self.conn.commit()
+
+    def store_in_memory(self, key, response, expires_at):
+        # Caller holds self.lock
+        self.entries[key] = (response, expires_at)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.stats_counters["evictions"] += 1
+
+    def clear(self):
+        """Drops every cached answer from both tiers."""
+        with self.lock:
+            self.entries.clear()
+        if self.connection() is not None:
+            self.write("DELETE FROM response_cache", ())
+
+    def stats(self):
+        """Returns hit/miss/eviction counters plus the current size."""
+        with self.lock:
+            stats = dict(self.stats_counters)
+            stats["size"] = len(self.entries)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+    def __len__(self):
+        return len(self.entries)
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+
+
+class HashingEmbedder:
+    """Local bag-of-character-trigrams embedder; no model call, a few microseconds per prompt.
+
+    It ignores word order, so "convert 10 km to miles" and "convert 10 miles to km"
+    embed identically: good enough for routing and retrieval, too coarse to serve answers on.
+    """
+
+    def __init__(self, dim=512):
+        self.dim = dim
+
+    def embed(self, text):
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for word in normalize_prompt(text).split():
+            word = f" {word.strip('?!.,')} "
+            for i in range(len(word) - 2):
+                vector[zlib.crc32(word[i:i + 3].encode("utf-8")) % self.dim] += 1.0
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+
+class OllamaEmbedder:
+    """Embeds prompts with Ollama's /api/embeddings endpoint."""
+
+    def __init__(self, client, url="http://localhost:11434/api/embeddings", model="nomic-embed-text"):
+        self.client = client
+        self.url = url
+        self.model = model
+
+    def embed(self, text):
+        response = self.client.post(self.url, json={"model": self.model, "prompt": normalize_prompt(text)})
+        try:
+            vector = np.asarray(response.json()["embedding"], dtype=np.float32)
+        finally:
+            self.client.release(response)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+
+class SemanticCache:
+    """Near-duplicate cache: serves an answer whose prompt embedding is close enough to the query.
+
+    Embeddings are unit vectors kept in one preallocated NumPy matrix, so a lookup is a
+    single matrix-vector product plus argmax. Each row is tagged with a namespace (mode
+    and model) and an expiry time; when full, the least recently used row is replaced.
+    """
+
+    def __init__(self, embedder, threshold=0.9, max_entries=5000, default_ttl=7 * 24 * 3600):
+        self.embedder = embedder
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self.lock = threading.Lock()
+        self.vectors = None  # allocated on first add, once the embedding size is known
+        self.namespaces = np.zeros(max_entries, dtype=np.int32)
+        self.expires_at = np.zeros(max_entries, dtype=np.float64)
+        self.last_used = np.zeros(max_entries, dtype=np.float64)
+        self.responses = [None] * max_entries
+        self.namespace_ids = {}
+        self.count = 0
+        self.stats_counters = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def namespace_id(self, namespace):
+        return self.namespace_ids.setdefault(namespace, len(self.namespace_ids) + 1)
+
+    def get(self, namespace, prompt):
+        """Returns the best cached answer for prompt within namespace, or None."""
+        vector = self.embed(prompt)
+        now = time.time()
+        with self.lock:
+            if vector is None or self.count == 0:
+                self.stats_counters["misses"] += 1
+                return None
+            scores = self.vectors[:self.count] @ vector
+            live = (self.namespaces[:self.count] == self.namespace_id(namespace)) & (self.expires_at[:self.count] > now)
+            scores = np.where(live, scores, -1.0)
+            best = int(np.argmax(scores))
+            if scores[best] < self.threshold:
+                self.stats_counters["misses"] += 1
+                return None
+            self.last_used[best] = now
+            self.stats_counters["hits"] += 1
+            return self.responses[best]
+
+    def put(self, namespace, prompt, response, ttl=None):
+        """Adds prompt's embedding and answer to the index."""
+        vector = self.embed(prompt)
+        if vector is None:
+            return
+        now = time.time()
+        with self.lock:
+            if self.vectors is None:
+                self.vectors = np.zeros((self.max_entries, len(vector)), dtype=np.float32)
+            if self.count < self.max_entries:
+                row = self.count
+                self.count += 1
+            else:
+                # Prefer a row that has already expired, else the least recently used one
+                expired = np.flatnonzero(self.expires_at <= now)
+                row = int(expired[0]) if len(expired) else int(np.argmin(self.last_used))
+                self.stats_counters["evictions"] += 1
+            self.vectors[row] = vector
+            self.namespaces[row] = self.namespace_id(namespace)
+            self.expires_at[row] = now + (self.default_ttl if ttl is None else ttl)
+            self.last_used[row] = now
+            self.responses[row] = response
+
+    def embed(self, prompt):
+        # An unreachable embedding model makes this tier miss; it never fails the request
+        try:
+            return self.embedder.embed(prompt)
+        except Exception as e:
+            log.warning("Embedding failed, skipping the semantic cache: %s", e)
+            return None
+
+    def clear(self):
+        with self.lock:
+            self.count = 0
+            self.responses = [None] * self.max_entries
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.stats_counters)
+            stats["size"] = self.count
+        return stats
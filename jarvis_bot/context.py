@@ -0,0 +1,52 @@
+import re
+
+
+def estimate_tokens(text):
+    """Rough token count; English text averages about four characters per token."""
+    return len(text) // 4 + 1
+
+
+def strip_label(response, labels):
+    """Removes the "(<label>) " get_response puts on stored answers, for any of the given provider labels."""
+    if not labels:
+        return response
+    return re.sub(rf"^\(({'|'.join(map(re.escape, labels))})\)\s*", "", response)
+
+
+class ContextBuilder:
+    """Assembles a multi-turn prompt that fits a token budget.
+
+    The newest verbatim_turns exchanges are kept word for word; older ones are
+    cut down to their first sentence, and if the prompt still does not fit, the
+    oldest turns are dropped entirely.
+    """
+
+    def __init__(self, token_budget=1536, verbatim_turns=4, summary_chars=160):
+        self.token_budget = token_budget
+        self.verbatim_turns = verbatim_turns
+        self.summary_chars = summary_chars
+
+    def summarize(self, text):
+        first_sentence = re.split(r"(?<=[.!?])\s", text.strip(), maxsplit=1)[0]
+        if len(first_sentence) > self.summary_chars:
+            first_sentence = first_sentence[:self.summary_chars].rstrip() + "..."
+        return first_sentence
+
+    def build(self, history, prompt, labels=()):
+        """Prefixes prompt with as much of history (oldest first) as the budget allows.
+
+        labels are the provider labels to strip from stored answers (see strip_label).
+        """
+        remaining = self.token_budget - estimate_tokens(prompt)
+        turns = []
+        for age, (user_input, ai_response) in enumerate(reversed(history)):
+            ai_response = strip_label(ai_response, labels)
+            if age >= self.verbatim_turns:
+                ai_response = self.summarize(ai_response)
+            turn = f"User: {user_input}\nAI: {ai_response}\n"
+            cost = estimate_tokens(turn)
+            if cost > remaining:
+                break
+            remaining -= cost
+            turns.append(turn)
+        return "".join(reversed(turns)) + prompt
@@ -0,0 +1,187 @@
+"""Stand-in Ollama and OpenAI servers for load tests and benchmarks.
+
+Both speak just enough of the real streaming protocols for AIEngine and
+AsyncAIEngine: Ollama's /api/generate NDJSON stream and OpenAI's
+/v1/chat/completions server-sent events, plus Ollama's /api/embeddings. Answers are a fixed number of short
+tokens with a configurable time to first token and delay per token, so results
+measure Jarvis rather than a model.
+
+    python fake_backends.py --port 11434 --tokens 40 --token-delay 0.02
+"""
+
+import argparse
+import asyncio
+import json
+import threading
+import time
+import zlib
+from aiohttp import web
+
+
+class FakeBackend:
+    """An aiohttp app serving canned streamed answers, with request counters."""
+
+    def __init__(self, tokens=20, first_token_delay=0.05, token_delay=0.01, max_concurrency=None, load_delay=0.0):
+        self.tokens = tokens
+        self.first_token_delay = first_token_delay
+        self.token_delay = token_delay
+        # Like Ollama, the first request for a model waits load_delay while it loads
+        self.load_delay = load_delay
+        self.loaded = set()
+        self.load_lock = asyncio.Lock()
+        # Like a single Ollama instance, serve only this many generations at once
+        self.slots = asyncio.Semaphore(max_concurrency) if max_concurrency else None
+        self.counters = {"requests": 0, "in_flight": 0, "max_in_flight": 0, "disconnects": 0}
+        self.client_ports = set()  # one per TCP connection the clients opened
+        self.fail_next = 0  # answer this many generate requests with 503, as an overloaded server would
+        self.runner = None
+        self.url = None
+
+        self.app = web.Application()
+        self.app.router.add_post("/api/generate", self.ollama_generate)
+        self.app.router.add_post("/v1/chat/completions", self.openai_chat)
+        self.app.router.add_post("/api/embeddings", self.ollama_embeddings)
+        self.app.router.add_get("/api/tags", self.list_models)
+        self.app.router.add_get("/v1/models", self.list_models)
+
+    def words(self):
+        return [f" word{n}" if n else "Answer" for n in range(self.tokens)]
+
+    async def stream(self, request, content_type, chunks):
+        self.counters["requests"] += 1
+        response = web.StreamResponse(headers={"Content-Type": content_type})
+        await response.prepare(request)
+        if self.slots:
+            await self.slots.acquire()
+        self.counters["in_flight"] += 1
+        self.counters["max_in_flight"] = max(self.counters["max_in_flight"], self.counters["in_flight"])
+        try:
+            await asyncio.sleep(self.first_token_delay)
+            for n, chunk in enumerate(chunks):
+                if n:
+                    await asyncio.sleep(self.token_delay)
+                await response.write(chunk)
+            await response.write_eof()
+        except ConnectionResetError:
+            # The client went away (stop button, stop sequence); a real backend stops generating here
+            self.counters["disconnects"] += 1
+        finally:
+            self.counters["in_flight"] -= 1
+            if self.slots:
+                self.slots.release()
+        return response
+
+    async def load(self, model):
+        if self.load_delay and model not in self.loaded:
+            async with self.load_lock:
+                if model not in self.loaded:
+                    await asyncio.sleep(self.load_delay)
+                    self.loaded.add(model)
+
+    async def ollama_generate(self, request):
+        self.client_ports.add(request.transport.get_extra_info("peername")[1])
+        if self.fail_next:
+            self.fail_next -= 1
+            return web.Response(status=503, headers={"Retry-After": "0"})
+        body = await request.json()
+        started = time.perf_counter()
+        await self.load(body.get("model"))
+        if not body.get("prompt"):
+            # An empty prompt only loads the model (what AIEngine.warm_up sends)
+            return web.json_response({"model": body.get("model"), "response": "", "done": True, "done_reason": "load"})
+        chunks = [json.dumps({"model": body.get("model"), "response": word, "done": False}).encode() + b"\n"
+                  for word in self.words()]
+        chunks.append(json.dumps({
+            "model": body.get("model"), "response": "", "done": True, "context": [1, 2, 3],
+            "prompt_eval_count": len(body.get("prompt", "")) // 4 + 1,
+            "eval_count": self.tokens, "total_duration": int((time.perf_counter() - started) * 1e9)
+        }).encode() + b"\n")
+        return await self.stream(request, "application/x-ndjson", chunks)
+
+    async def openai_chat(self, request):
+        body = await request.json()
+        chunks = [b"data: " + json.dumps({"model": body.get("model"),
+                                          "choices": [{"delta": {"content": word}}]}).encode() + b"\n\n"
+                  for word in self.words()]
+        chunks.append(b"data: [DONE]\n\n")
+        return await self.stream(request, "text/event-stream", chunks)
+
+    async def ollama_embeddings(self, request):
+        # Hashed word pairs: word order matters, as it does for a real embedding model
+        body = await request.json()
+        words = ["^"] + body.get("prompt", "").split()
+        embedding = [0.0] * 64
+        for pair in zip(words, words[1:]):
+            embedding[zlib.crc32(" ".join(pair).encode()) % 64] += 1.0
+        return web.json_response({"embedding": embedding})
+
+    async def list_models(self, request):
+        # Health checks only need a quick answer; this is neither API's exact shape
+        return web.json_response({"models": [{"name": "stand-in"}], "data": [{"id": "stand-in"}]})
+
+    async def start(self, host="127.0.0.1", port=0):
+        """Starts serving and returns the base URL."""
+        self.runner = web.AppRunner(self.app)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, host, port).start()
+        self.url = f"http://{host}:{self.runner.addresses[0][1]}"
+        return self.url
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+
+
+def start_in_thread(backend, host="127.0.0.1", port=0):
+    """Serves backend from its own event loop thread, for driving the sync AIEngine.
+
+    Returns (base_url, stop) where stop() shuts the server and thread down.
+    """
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, name="fake-backend", daemon=True)
+    thread.start()
+    url = asyncio.run_coroutine_threadsafe(backend.start(host, port), loop).result()
+
+    def stop():
+        asyncio.run_coroutine_threadsafe(backend.stop(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
+
+    return url, stop
+
+
+def point_engine_at(engine, base_url, openai_base_url=None):
+    """Sends an AIEngine's Ollama and OpenAI-compatible requests to stand-in backends."""
+    for provider in engine.backends.providers.values():
+        if provider.kind == "ollama":
+            provider.url = f"{base_url}/api/generate"
+        else:
+            provider.url = f"{openai_base_url or base_url}/v1/chat/completions"
+            provider.api_key = provider.api_key or "sk-stand-in"
+
+
+async def serve(args):
+    backend = FakeBackend(args.tokens, args.first_token_delay, args.token_delay, args.max_concurrency, args.load_delay)
+    url = await backend.start(args.host, args.port)
+    print(f"Stand-in backend on {url} (Ollama: {url}/api/generate, OpenAI: {url}/v1/chat/completions)")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await backend.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve stand-in Ollama/OpenAI streaming endpoints.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--tokens", type=int, default=20)
+    parser.add_argument("--first-token-delay", type=float, default=0.05)
+    parser.add_argument("--token-delay", type=float, default=0.01)
+    parser.add_argument("--max-concurrency", type=int, help="generations served at once")
+    parser.add_argument("--load-delay", type=float, default=0.0, help="seconds to load a model on first use")
+    try:
+        asyncio.run(serve(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
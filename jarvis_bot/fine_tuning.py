@@ -0,0 +1,381 @@
+"""Turns training_data.jsonl into packed, memory-mapped token shards for fine-tuning.
+
+    python fine_tuning.py prepare                                 # training_data.jsonl -> dataset/
+    python fine_tuning.py prepare --tokenizer tokenizer.json --seq-len 4096 --workers 8
+    python fine_tuning.py bench --records 200000                  # records/sec, pool vs. one process
+
+Examples are rendered with the Phi-3 chat template, tokenized in a process pool
+and packed back to back into rows of seq_len tokens (an example that does not
+fit is continued on the next row), so no step of training is spent on padding.
+Each shard is three raw arrays beside index.json:
+
+    shard-00000.tokens   token ids, rows x seq_len (uint16, or uint32 for big vocabularies)
+    shard-00000.mask     1 where the token is part of an answer (the loss is taken there)
+    shard-00000.starts   offsets within the shard at which each example starts
+
+PackedDataset maps them with np.memmap, so a training loop reads any row without
+parsing or tokenizing anything and without loading the dataset into RAM. The
+shards are only rebuilt when the source file or the settings change.
+
+The tokenizer is a tokenizer.json (or a Hugging Face model name) loaded with the
+`tokenizers` package when that is installed, otherwise ByteTokenizer, which
+needs nothing and works offline.
+"""
+
+import argparse
+import json
+import logging
+import os
+import re
+import tempfile
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from telemetry import configure_logging
+
+try:
+    from tokenizers import Tokenizer
+except ImportError:
+    Tokenizer = None
+
+log = logging.getLogger("jarvis.fine_tuning")
+
+# The Phi-3 chat template; the answer part of it is what the model learns to write
+PROMPT_TEMPLATE = "<|user|>\n{input}<|end|>\n<|assistant|>\n"
+ANSWER_TEMPLATE = "{output}<|end|>\n"
+SPECIAL_TOKENS = ["<|endoftext|>", "<|user|>", "<|assistant|>", "<|end|>"]
+
+
+class ByteTokenizer:
+    """UTF-8 bytes as token ids 0-255 and the special tokens after them; pure Python, no vocabulary file."""
+
+    name = "bytes"
+
+    def __init__(self, special_tokens=SPECIAL_TOKENS):
+        self.special_ids = {token: 256 + n for n, token in enumerate(special_tokens)}
+        self.special = re.compile("(" + "|".join(map(re.escape, special_tokens)) + ")")
+        self.vocab_size = 256 + len(special_tokens)
+        self.eos_id = self.special_ids["<|endoftext|>"]
+
+    def encode(self, text):
+        ids = []
+        for n, part in enumerate(self.special.split(text)):
+            if n % 2:
+                ids.append(self.special_ids[part])
+            else:
+                ids.extend(part.encode("utf-8"))
+        return ids
+
+    def decode(self, ids):
+        names = {token_id: token for token, token_id in self.special_ids.items()}
+        text, pending = [], bytearray()
+        for token_id in ids:
+            if token_id < 256:
+                pending.append(token_id)
+                continue
+            text.append(pending.decode("utf-8", errors="replace"))
+            pending.clear()
+            text.append(names.get(token_id, ""))
+        text.append(pending.decode("utf-8", errors="replace"))
+        return "".join(text)
+
+
+class LibraryTokenizer:
+    """A tokenizer from the `tokenizers` package, behind the same encode/decode as ByteTokenizer."""
+
+    def __init__(self, spec):
+        if Tokenizer is None:
+            raise ImportError(f"The tokenizers package is needed for {spec!r}; leave --tokenizer out to use bytes.")
+        self.tokenizer = Tokenizer.from_file(spec) if os.path.exists(spec) else Tokenizer.from_pretrained(spec)
+        self.name = os.path.basename(spec)
+        self.vocab_size = self.tokenizer.get_vocab_size()
+        self.eos_id = self.tokenizer.token_to_id("<|endoftext|>")
+        if self.eos_id is None:
+            self.eos_id = self.vocab_size - 1
+
+    def encode(self, text):
+        return self.tokenizer.encode(text, add_special_tokens=False).ids
+
+    def decode(self, ids):
+        return self.tokenizer.decode(list(ids), skip_special_tokens=False)
+
+
+def load_tokenizer(spec=None):
+    """ByteTokenizer when spec is None, otherwise the tokenizer.json file or model name spec."""
+    return ByteTokenizer() if spec is None else LibraryTokenizer(spec)
+
+
+# Each pool process loads the tokenizer once, in init_worker()
+worker_tokenizer = None
+
+
+def init_worker(spec):
+    global worker_tokenizer
+    os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")  # the pool is the parallelism
+    worker_tokenizer = load_tokenizer(spec)
+
+
+def tokenize_lines(lines):
+    """Tokenizes a batch of JSONL lines; returns (tokens, mask, lengths) arrays for the batch."""
+    tokenizer = worker_tokenizer
+    tokens, parts = [], []  # parts: prompt and answer lengths, alternating
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        record = json.loads(line)
+        prompt = tokenizer.encode(PROMPT_TEMPLATE.format(input=record["input"]))
+        answer = tokenizer.encode(ANSWER_TEMPLATE.format(output=record["output"]))
+        answer.append(tokenizer.eos_id)
+        tokens += prompt
+        tokens += answer
+        parts += (len(prompt), len(answer))
+    parts = np.array(parts, dtype=np.int64)
+    mask = np.repeat(np.tile(np.array([0, 1], dtype=np.uint8), len(parts) // 2), parts)
+    return np.array(tokens, dtype=np.uint32), mask, parts[0::2] + parts[1::2]
+
+
+def read_batches(path, batch_size):
+    with open(path, encoding="utf-8") as f:
+        batch = []
+        for line in f:
+            batch.append(line)
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+
+def tokenized_batches(path, spec, workers, batch_size):
+    """tokenize_lines() of every batch of the file, in file order.
+
+    With workers > 1 the batches go to a process pool, at most two per process in
+    flight, so memory stays flat however long the file is; otherwise they are
+    tokenized in this process.
+    """
+    if workers <= 1:
+        init_worker(spec)
+        yield from map(tokenize_lines, read_batches(path, batch_size))
+        return
+    with ProcessPoolExecutor(workers, initializer=init_worker, initargs=(spec,)) as pool:
+        running = deque()
+        for batch in read_batches(path, batch_size):
+            running.append(pool.submit(tokenize_lines, batch))
+            if len(running) >= 2 * workers:
+                yield running.popleft().result()
+        while running:
+            yield running.popleft().result()
+
+
+class ShardWriter:
+    """Packs token streams into rows of seq_len and writes a shard every rows_per_shard rows."""
+
+    def __init__(self, directory, seq_len, rows_per_shard, dtype, pad_id):
+        self.directory = directory
+        self.seq_len = seq_len
+        self.rows_per_shard = rows_per_shard
+        self.pad_id = pad_id
+        self.tokens = np.full(rows_per_shard * seq_len, pad_id, dtype=dtype)
+        self.mask = np.zeros(rows_per_shard * seq_len, dtype=np.uint8)
+        self.starts = []
+        self.fill = 0
+        self.shards = []
+
+    def add(self, tokens, mask, lengths):
+        # Where each example of the batch starts, relative to the shard being filled
+        starts = np.concatenate(([0], np.cumsum(lengths)[:-1])) + self.fill
+        done = 0
+        while done < len(tokens):
+            room = len(self.tokens) - self.fill
+            count = min(room, len(tokens) - done)
+            self.tokens[self.fill:self.fill + count] = tokens[done:done + count]
+            self.mask[self.fill:self.fill + count] = mask[done:done + count]
+            inside = starts < self.fill + count
+            self.starts.extend(starts[inside].tolist())
+            starts = starts[~inside] - len(self.tokens)
+            self.fill += count
+            done += count
+            if self.fill == len(self.tokens):
+                self.write()
+
+    def write(self):
+        rows = -(-self.fill // self.seq_len)  # the last shard's last row is padded
+        size = rows * self.seq_len
+        name = f"shard-{len(self.shards):05d}"
+        for suffix, array in (("tokens", self.tokens[:size]), ("mask", self.mask[:size]),
+                              ("starts", np.array(self.starts, dtype=np.int64))):
+            array.tofile(os.path.join(self.directory, f"{name}.{suffix}"))
+        self.shards.append({"name": name, "rows": rows, "examples": len(self.starts)})
+        self.tokens.fill(self.pad_id)
+        self.mask.fill(0)
+        self.starts = []
+        self.fill = 0
+
+    def close(self):
+        if self.fill:
+            self.write()
+
+
+def source_stamp(path):
+    status = os.stat(path)
+    return {"path": os.path.abspath(path), "size": status.st_size, "mtime_ns": status.st_mtime_ns}
+
+
+def prepare(source="training_data.jsonl", directory="dataset", tokenizer=None, seq_len=2048, rows_per_shard=4096,
+            workers=None, batch_size=256, force=False):
+    """Tokenizes and packs source into shards in directory; returns the index, reusing an up-to-date one."""
+    if workers is None:
+        workers = os.cpu_count() or 1
+    index_path = os.path.join(directory, "index.json")
+    settings = {"source": source_stamp(source), "tokenizer": tokenizer or "bytes", "seq_len": seq_len,
+                "rows_per_shard": rows_per_shard, "template": PROMPT_TEMPLATE + ANSWER_TEMPLATE}
+    if not force and os.path.exists(index_path):
+        with open(index_path) as f:
+            index = json.load(f)
+        if index["settings"] == settings:
+            log.info("%s is up to date", directory)
+            return index
+
+    os.makedirs(directory, exist_ok=True)
+    if os.path.exists(index_path):
+        os.remove(index_path)  # shards are about to be overwritten; without an index they are not a dataset
+    loaded = load_tokenizer(tokenizer)
+    dtype = np.uint16 if loaded.vocab_size <= 1 << 16 else np.uint32
+    writer = ShardWriter(directory, seq_len, rows_per_shard, dtype, loaded.eos_id)
+    examples = tokens = answer_tokens = 0
+    started = time.perf_counter()
+    for batch_tokens, batch_mask, lengths in tokenized_batches(source, tokenizer, workers, batch_size):
+        writer.add(batch_tokens, batch_mask, lengths)
+        examples += len(lengths)
+        tokens += len(batch_tokens)
+        answer_tokens += int(batch_mask.sum())
+    writer.close()
+    index = {
+        "settings": settings, "vocab_size": loaded.vocab_size, "dtype": np.dtype(dtype).name,
+        "pad_id": loaded.eos_id, "eos_id": loaded.eos_id, "examples": examples, "tokens": tokens,
+        "answer_tokens": answer_tokens, "rows": sum(shard["rows"] for shard in writer.shards),
+        "shards": writer.shards, "seconds": round(time.perf_counter() - started, 3),
+    }
+    temp_path = f"{index_path}.tmp"
+    with open(temp_path, "w") as f:
+        json.dump(index, f, indent=1)
+    os.replace(temp_path, index_path)
+    return index
+
+
+class PackedDataset:
+    """Rows of a prepared dataset, memory-mapped; dataset[i] is (tokens, mask) for row i without a copy."""
+
+    def __init__(self, directory="dataset"):
+        self.directory = directory
+        with open(os.path.join(directory, "index.json")) as f:
+            self.index = json.load(f)
+        self.seq_len = self.index["settings"]["seq_len"]
+        self.dtype = np.dtype(self.index["dtype"])
+        self.first_rows = np.cumsum([0] + [shard["rows"] for shard in self.index["shards"]])
+        self.mapped = {}
+
+    def __len__(self):
+        return int(self.first_rows[-1])
+
+    def shard(self, number):
+        """(tokens, mask, starts) of one shard, mapped on first use."""
+        if number not in self.mapped:
+            shard = self.index["shards"][number]
+            path = os.path.join(self.directory, shard["name"])
+            shape = (shard["rows"], self.seq_len)
+            self.mapped[number] = (np.memmap(f"{path}.tokens", dtype=self.dtype, mode="r", shape=shape),
+                                   np.memmap(f"{path}.mask", dtype=np.uint8, mode="r", shape=shape),
+                                   np.fromfile(f"{path}.starts", dtype=np.int64))
+        return self.mapped[number]
+
+    def locate(self, row):
+        if not 0 <= row < len(self):
+            raise IndexError(row)
+        number = int(np.searchsorted(self.first_rows, row, side="right")) - 1
+        return number, row - int(self.first_rows[number])
+
+    def __getitem__(self, row):
+        number, local = self.locate(row)
+        tokens, mask, _ = self.shard(number)
+        return tokens[local], mask[local]
+
+    def example_starts(self, row):
+        """Offsets within row at which examples start, for keeping attention inside each example."""
+        number, local = self.locate(row)
+        starts = self.shard(number)[2]
+        begin = local * self.seq_len
+        inside = starts[np.searchsorted(starts, begin):np.searchsorted(starts, begin + self.seq_len)]
+        return inside - begin
+
+
+def make_bench_source(path, records):
+    """A training_data.jsonl of records synthetic examples of mixed length."""
+    with open(path, "w", encoding="utf-8") as f:
+        for n in range(records):
+            answer = " ".join(f"word{n % 97}-{i}" for i in range(10 + n % 90))
+            f.write(json.dumps({"input": f"Question number {n}: what about topic {n % 13}?", "output": answer}) + "\n")
+
+
+def bench(records=200000, workers=None, seq_len=2048):
+    """Prepares the same synthetic file in one process and in a pool, and times random row reads."""
+    workers = workers or os.cpu_count() or 1
+    directory = tempfile.mkdtemp()
+    source = os.path.join(directory, "training_data.jsonl")
+    make_bench_source(source, records)
+    print(f"{records} records ({os.path.getsize(source) / 1e6:.1f} MB of JSONL), "
+          f"{os.cpu_count()} CPUs, seq_len {seq_len}")
+    print(f"{'path':<14} {'seconds':>8} {'records/s':>10} {'tokens/s':>10}")
+    contents = []
+    for name, count in (("one process", 1), (f"{workers} workers", workers)):
+        output = os.path.join(directory, f"dataset-{count}")
+        index = prepare(source, output, seq_len=seq_len, workers=count, force=True)
+        seconds = index["seconds"]
+        print(f"{name:<14} {seconds:>8.2f} {records / seconds:>10.0f} {index['tokens'] / seconds:>10.0f}")
+        contents.append([np.fromfile(os.path.join(output, f"{shard['name']}.tokens"), dtype=index["dtype"]).tobytes()
+                         for shard in index["shards"]])
+    print(f"shards identical: {contents[0] == contents[1]}; "
+          f"{index['rows']} rows, {sum(os.path.getsize(os.path.join(output, name)) for name in os.listdir(output)) / 1e6:.1f} "
+          f"MB on disk, {index['answer_tokens'] / index['tokens']:.0%} of tokens in answers")
+
+    # An epoch in random order straight from the shards, against tokenizing the file again
+    dataset = PackedDataset(output)
+    started = time.perf_counter()
+    answer_tokens = 0
+    for row in np.random.default_rng(0).permutation(len(dataset)):
+        tokens, mask = dataset[int(row)]
+        answer_tokens += int(mask.sum())
+    seconds = time.perf_counter() - started
+    print(f"epoch from the shards in random order: {seconds:.2f}s ({seconds / len(dataset) * 1e6:.0f} us a row, "
+          f"answer tokens {'match' if answer_tokens == index['answer_tokens'] else 'DIFFER'})")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Prepare packed, memory-mapped fine-tuning shards.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    prepare_parser = commands.add_parser("prepare", help="tokenize and pack a JSONL file of examples")
+    prepare_parser.add_argument("source", nargs="?", default="training_data.jsonl")
+    prepare_parser.add_argument("-o", "--output", default="dataset", help="directory for the shards")
+    prepare_parser.add_argument("--tokenizer", help="tokenizer.json or Hugging Face model name (default: bytes)")
+    prepare_parser.add_argument("--seq-len", type=int, default=2048)
+    prepare_parser.add_argument("--rows-per-shard", type=int, default=4096)
+    prepare_parser.add_argument("--workers", type=int, help="tokenizing processes (default: one per CPU)")
+    prepare_parser.add_argument("--force", action="store_true", help="rebuild even if the shards are up to date")
+    bench_parser = commands.add_parser("bench", help="records/sec in a process pool vs. one process")
+    bench_parser.add_argument("--records", type=int, default=200000)
+    bench_parser.add_argument("--workers", type=int)
+    args = parser.parse_args(argv)
+    configure_logging()
+    if args.command == "bench":
+        bench(args.records, args.workers)
+        return
+    index = prepare(args.source, args.output, args.tokenizer, args.seq_len, args.rows_per_shard, args.workers,
+                    force=args.force)
+    print(f"{index['examples']} examples, {index['tokens']} tokens in {index['rows']} rows of {args.seq_len} "
+          f"({len(index['shards'])} shards) in {args.output}")
+
+
+if __name__ == "__main__":
+    main()
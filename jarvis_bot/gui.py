@@ -1,13 +1,17 @@
+import startup
+import time
 import tkinter as tk
 from tkinter import ttk
-import threading
-import time
-from ai_engine import AIEngine
+from telemetry import configure_logging, telemetry
+from transcript import Transcript
+from ui_updates import UpdateCoalescer
 
 class JarvisGUI:
-    def __init__(self, root, ai_engine):
+    def __init__(self, root, ai_engine=None, transcript_capacity=500):
+        # Without an engine the window starts empty-handed; attach_engine() supplies
+        # it once startup.load_engine() has built it
         self.root = root
-        self.ai_engine = ai_engine
+        self.ai_engine = None
         self.root.title("AI Assistant")
 
         # Window sizing & centering
@@ -44,17 +48,24 @@ class JarvisGUI:
         # Top frame: AI mode selection
         top_frame = ttk.Frame(self.root, style="DarkFrame.TFrame")
         top_frame.pack(fill="x", padx=10, pady=10)
-        self.ai_mode_var = tk.StringVar(value=self.ai_engine.ai_mode)
+        self.ai_mode_var = tk.StringVar(value="")
         self.ai_mode_dropdown = ttk.Combobox(
             top_frame,
             textvariable=self.ai_mode_var,
-            values=["phi3_only", "openai_only", "hybrid"],
-            state="readonly",
+            values=[],
+            state="disabled",
             style="DarkCombobox.TCombobox"
         )
         self.ai_mode_dropdown.bind("<<ComboboxSelected>>", self.change_ai_mode)
         self.ai_mode_dropdown.pack(side="left", padx=5)
 
+        # Optional per-stage timing line under each answer
+        style.configure("DarkCheck.TCheckbutton", background="#2b2b2b", foreground="#ffffff",
+                        font=("Segoe UI", 10))
+        self.show_timings_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(top_frame, text="Show timings", variable=self.show_timings_var,
+                        style="DarkCheck.TCheckbutton").pack(side="right", padx=5)
+
         # Chat frame
         chat_frame = ttk.Frame(self.root, style="DarkFrame.TFrame")
         chat_frame.pack(fill="both", expand=True, padx=10, pady=5)
@@ -72,9 +83,12 @@ class JarvisGUI:
         )
         self.chat_history.pack(side="left", fill="both", expand=True)
 
-        self.scrollbar = ttk.Scrollbar(chat_frame, command=self.chat_history.yview)
+        self.scrollbar = ttk.Scrollbar(chat_frame, command=self.scroll_chat)
         self.scrollbar.pack(side="right", fill="y")
         self.chat_history.configure(yscrollcommand=self.scrollbar.set)
+        # Reaching the top by wheel pages in earlier turns (the class binding scrolls first)
+        for sequence in ("<MouseWheel>", "<Button-4>"):
+            self.chat_history.bind(sequence, lambda event: self.root.after_idle(self.load_older_if_at_top))
 
         # Define two text tags for user and bot
         self.chat_history.tag_config(
@@ -91,6 +105,10 @@ class JarvisGUI:
             spacing1=5,
             spacing3=5
         )
+        self.chat_history.tag_config("timing", foreground="#8c8c8c", font=("Segoe UI", 9))
+
+        # Only the newest messages stay in the Text widget; older turns page back in from memory
+        self.transcript = Transcript(self, None, transcript_capacity, bot_sender=None)
 
         # Input frame
         input_frame = ttk.Frame(self.root, style="DarkFrame.TFrame")
@@ -131,8 +149,30 @@ class JarvisGUI:
         self.circle_radius = 10
         self.grow = True
 
-        # For measuring how long the AI took
-        self.start_time = None
+        # Questions still waiting for an answer (request id -> question), in send order,
+        # and those sent before the engine was ready
+        self.pending_requests = {}
+        self.waiting_messages = []
+
+        # Request whose streamed text is shown; marks where it starts in the chat
+        self.live_request_id = None
+        self.live_response_active = False
+        self.live_text = ""
+
+        # Streamed text is drawn by a timer at most 30 times a second, not once per token
+        self.updates = UpdateCoalescer(self.update_live_response, self.root.after, telemetry=telemetry)
+
+        if ai_engine is not None:
+            self.attach_engine(ai_engine)
+
+    def attach_engine(self, ai_engine):
+        self.ai_engine = ai_engine
+        self.transcript.set_memory(ai_engine.memory)
+        self.ai_mode_var.set(ai_engine.ai_mode)
+        self.ai_mode_dropdown.configure(values=ai_engine.backends.modes(), state="readonly")
+        waiting, self.waiting_messages = self.waiting_messages, []
+        for user_input in waiting:
+            self.submit(user_input)
 
     def send_message(self, event=None):
         user_input = self.entry.get().strip()
@@ -144,32 +184,96 @@ class JarvisGUI:
         self.entry.delete(0, tk.END)
 
         # Start the pulsing circle
-        self.start_thinking()
+        if not self.pending_requests and not self.waiting_messages:
+            self.start_thinking()
+            self.updates.start()
 
-        # Record the start time
-        self.start_time = time.time()
-
-        # Offload AI call to a thread
-        threading.Thread(target=self.process_response, args=(user_input,), daemon=True).start()
+        if self.ai_engine is None:
+            self.waiting_messages.append(user_input)
+            return
+        self.submit(user_input)
+
+    def submit(self, user_input):
+        # Queue the AI call on the engine's scheduler; callbacks arrive on its worker
+        # threads, so hand them to Tk's main loop (streamed text through the coalescer)
+        request_id = self.ai_engine.scheduler.submit(
+            user_input,
+            on_partial=self.updates.push,
+            on_done=lambda rid, response, elapsed, trace: self.root.after(
+                0, self.finish_response, rid, response, elapsed, trace, time.perf_counter()
+            )
+        )
+        self.pending_requests[request_id] = user_input
 
-    def process_response(self, user_input):
-        # Get final response (no partial text)
-        response = self.ai_engine.get_response(user_input, update_chat_live=lambda x: None)
-        self.root.after(0, self.finish_response, response)
+    def update_live_response(self, request_id, partial):
+        # Not drawn while paging back through history; the final answer brings the view back
+        if not self.transcript.following:
+            return
+        # Only one answer streams at a time; the others show up when they finish
+        if self.live_request_id is None:
+            self.live_request_id = request_id
+        if request_id != self.live_request_id:
+            return
 
-    def finish_response(self, response):
-        # Stop pulsing circle
-        self.stop_thinking()
+        # Update the in-progress response in place instead of adding a new line per chunk;
+        # usually the text only grew, so just the new words are inserted
+        text = partial.strip()
+        self.chat_history.config(state="normal")
+        if self.live_response_active and text.startswith(self.live_text):
+            self.chat_history.insert("end-2c", text[len(self.live_text):], "bot")
+        else:
+            if self.live_response_active:
+                self.chat_history.delete("live_start", "end-1c")
+            else:
+                self.chat_history.mark_set("live_start", "end-1c")
+                self.chat_history.mark_gravity("live_start", "left")
+                self.live_response_active = True
+            self.chat_history.insert("end", text + "\n", "bot")
+        self.live_text = text
+        self.chat_history.config(state="disabled")
+        self.chat_history.see("end")
 
-        # Calculate how long the AI spent thinking
-        if self.start_time:
-            thought_time = time.time() - self.start_time
-            # Insert a line in chat: "Thought for X.XX seconds" with "bot" style
+    def clear_live_response(self):
+        if self.live_response_active:
+            self.chat_history.config(state="normal")
+            self.chat_history.delete("live_start", "end-1c")
+            self.chat_history.config(state="disabled")
+            self.live_response_active = False
+            self.live_text = ""
+
+    def finish_response(self, request_id, response, thought_time, trace=None, handed_over_at=None):
+        question = self.pending_requests.pop(request_id, None)
+        answered_in_order = not self.pending_requests or request_id < min(self.pending_requests)
+        self.updates.discard(request_id)
+
+        # Stop pulsing circle once nothing is pending
+        if not self.pending_requests:
+            self.stop_thinking()
+            self.updates.stop()
+
+        # The final response replaces whatever was streamed so far. Another request's
+        # streamed text is removed too and redrawn below on its next update, so the
+        # in-progress message always stays last.
+        self.clear_live_response()
+        if request_id == self.live_request_id:
+            self.live_request_id = None
+
+        # Insert a line in chat: "Thought for X.XX seconds" with "bot" style; say which
+        # question it answers when answers come back out of order
+        if question is not None and not answered_in_order:
+            self.add_chat_line(f"Thought for {thought_time:.2f} seconds (re: \"{question}\")", "bot")
+        else:
             self.add_chat_line(f"Thought for {thought_time:.2f} seconds", "bot")
 
         # Insert the final AI response with the "bot" tag
         self.add_chat_line(response.strip(), "bot")
 
+        # UI delivery: waiting for the Tk main loop plus drawing the answer
+        if trace is not None and handed_over_at is not None:
+            telemetry.stage("ui_delivery", time.perf_counter() - handed_over_at, trace)
+            if self.show_timings_var.get():
+                self.add_chat_line(trace.summary(), "timing")
+
     # Pulsing circle logic
     def start_thinking(self):
         self.circle_radius = 10
@@ -207,16 +311,53 @@ class JarvisGUI:
 
     # Updated add_chat_line method with optional tag
     def add_chat_line(self, message, tag=None):
+        self.transcript.append(None, message, tag)
+        self.chat_history.see("end")
+
+    # Transcript view: each message is drawn as its own line(s) ending in a newline
+    def show_messages(self, messages, at_top):
+        # Streamed text must stay last; it is redrawn on its next update
+        self.clear_live_response()
+        chunks = []
+        for message in messages:
+            text = f"{message.sender}: {message.text}" if message.sender else message.text
+            chunks += [text + "\n", message.tag or ()]
         self.chat_history.config(state="normal")
-        if tag:
-            self.chat_history.insert("end", message + "\n", tag)
+        self.chat_history.insert("1.0" if at_top else "end", *chunks)
+        self.chat_history.config(state="disabled")
+
+    def remove_messages(self, messages, from_top):
+        self.clear_live_response()
+        lines = sum(message.text.count("\n") + 1 for message in messages)
+        self.chat_history.config(state="normal")
+        if from_top:
+            self.chat_history.delete("1.0", f"1.0 + {lines} lines")
         else:
-            self.chat_history.insert("end", message + "\n")
+            self.chat_history.delete(f"end-1c - {lines} lines", "end-1c")
         self.chat_history.config(state="disabled")
-        self.chat_history.see("end")
+
+    def scroll_chat(self, *args):
+        self.chat_history.yview(*args)
+        self.load_older_if_at_top()
+
+    def load_older_if_at_top(self):
+        if self.chat_history.yview()[0] > 0 or not self.transcript.has_older():
+            return
+        # Keep the line that was at the top in place rather than jumping to the oldest;
+        # a right-gravity mark ends up after the text inserted in front of it
+        self.chat_history.mark_set("previous_top", "1.0")
+        self.chat_history.mark_gravity("previous_top", "right")
+        if self.transcript.load_older():
+            self.chat_history.yview("previous_top")
+        self.chat_history.mark_unset("previous_top")
 
     def stop_response(self):
-        self.ai_engine.stop_response_flag = True
+        self.waiting_messages.clear()
+        if self.ai_engine is not None:
+            self.ai_engine.stop_response()
+        if not self.pending_requests:
+            self.stop_thinking()
+            self.updates.stop()
 
     def clear_placeholder(self, event):
         if self.entry.get() == "Type your message...":
@@ -229,10 +370,30 @@ class JarvisGUI:
     def change_ai_mode(self, event=None):
         mode = self.ai_mode_var.get()
         self.ai_engine.set_ai_mode(mode)
-        print(f"[DEBUG] AI mode switched to: {mode}")
 
-if __name__ == "__main__":
+def run():
+    """Shows the window at once; the engine is attached when the background startup has built it."""
+    configure_logging()
     root = tk.Tk()
-    ai_engine = AIEngine()
-    app = JarvisGUI(root, ai_engine)
+    app = JarvisGUI(root)
+    events = []
+
+    def started(event):
+        startup.mark(event)
+        events.append(event)
+        if startup.probing() and len(events) == 2:
+            root.destroy()
+
+    def attach(engine):
+        app.attach_engine(engine)
+        started("ready")
+
+    root.after_idle(started, "window")
+    startup.load_engine(
+        lambda engine: root.after(0, attach, engine),
+        lambda error: root.after(0, app.add_chat_line, f"Error: could not start the engine: {error}", "bot")
+    )
     root.mainloop()
+
+if __name__ == "__main__":
+    run()
@@ -1,9 +1,5 @@
-from gui import JarvisGUI
-from ai_engine import AIEngine
-import tkinter as tk
+import startup  # first, so startup times count from here
+from gui import run
 
 if __name__ == "__main__":
-    root = tk.Tk()
-    ai_engine = AIEngine()
-    app = JarvisGUI(root, ai_engine)
-    root.mainloop()
+    run()
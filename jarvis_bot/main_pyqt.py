@@ -1,15 +1,67 @@
-import sys, threading, time
+import startup
+import asyncio
+import html
+import itertools
+import logging
+import sys
+import time
 from PyQt5 import QtWidgets, QtGui, QtCore
-from ai_engine import AIEngine
+from telemetry import configure_logging, telemetry
+from transcript import Transcript
+from ui_updates import UpdateCoalescer
+
+try:
+    # Runs asyncio on Qt's event loop, so answers need no worker threads at all
+    import qasync
+except ImportError:
+    qasync = None
+
+log = logging.getLogger("jarvis.gui")
 
 class JarvisWindow(QtWidgets.QMainWindow):
-    response_ready = QtCore.pyqtSignal(str)
+    # request id, answer, seconds since sent, telemetry trace, perf_counter when handed to the GUI thread
+    response_ready = QtCore.pyqtSignal(int, str, float, object, float)
+    # the engine built by startup.load_engine(), or the error that stopped it
+    engine_ready = QtCore.pyqtSignal(object)
+    engine_failed = QtCore.pyqtSignal(str)
     
-    def __init__(self):
+    def __init__(self, use_asyncio=False, ai_engine=None, transcript_capacity=500):
         super().__init__()
-        self.ai_engine = AIEngine()
+        # Without an engine the window starts empty-handed; attach_engine() supplies it
+        self.ai_engine = None
+        self.transcript_capacity = transcript_capacity
+        # With asyncio every question is a task on the GUI thread's loop; otherwise
+        # questions go to the engine's worker-thread scheduler
+        self.use_asyncio = use_asyncio
+        self.async_engine = None
+        self.async_tasks = {}
+        self.async_request_ids = itertools.count(1)
         self.response_ready.connect(self.finish_response)
+        self.engine_ready.connect(self.attach_engine)
+        self.engine_failed.connect(lambda error: self.append_chat("System", f"Could not start the engine: {error}"))
+        # Streamed text is drawn by a timer at most 30 times a second, not once per token
+        self.updates = UpdateCoalescer(self.update_live_response, QtCore.QTimer.singleShot, telemetry=telemetry)
+        # Questions sent before the engine was ready
+        self.waiting_messages = []
         self.initUI()
+        if ai_engine is not None:
+            self.attach_engine(ai_engine)
+
+    def attach_engine(self, ai_engine):
+        self.ai_engine = ai_engine
+        if self.use_asyncio:
+            from async_engine import AsyncAIEngine
+            self.async_engine = AsyncAIEngine(ai_engine)
+        self.transcript.set_memory(ai_engine.memory)
+        # Filling the list would otherwise announce a mode switch
+        self.mode_combo.blockSignals(True)
+        self.mode_combo.addItems(ai_engine.backends.modes())
+        self.mode_combo.setCurrentText(ai_engine.ai_mode)
+        self.mode_combo.blockSignals(False)
+        self.mode_combo.setEnabled(True)
+        waiting, self.waiting_messages = self.waiting_messages, []
+        for text in waiting:
+            self.submit(text)
 
     def initUI(self):
         self.setWindowTitle("Jarvis - AI Assistant")
@@ -40,12 +92,15 @@ class JarvisWindow(QtWidgets.QMainWindow):
                 border: none;
             }
         """)
-        # Add model modes
-        self.mode_combo.addItems(["phi3_only", "openai_only", "hybrid"])
-        self.mode_combo.setCurrentText(self.ai_engine.ai_mode)
+        # Model modes are added once the engine is ready
+        self.mode_combo.setEnabled(False)
         self.mode_combo.currentTextChanged.connect(self.change_ai_mode)
         mode_layout.addWidget(self.mode_combo)
         mode_layout.addStretch()
+        # Optional per-stage timing line under each answer
+        self.show_timings = QtWidgets.QCheckBox("Show timings")
+        self.show_timings.setStyleSheet("color: #f0f0f0; font-family: 'Segoe UI'; font-size: 10pt;")
+        mode_layout.addWidget(self.show_timings)
         main_layout.addLayout(mode_layout)
 
         # Chat history area
@@ -62,6 +117,13 @@ class JarvisWindow(QtWidgets.QMainWindow):
             }
         """)
         main_layout.addWidget(self.chat_history)
+        # Only the newest messages stay in the document; scrolling to the top pages
+        # earlier turns back in from memory
+        self.live_start = None
+        self.transcript = Transcript(self, None, self.transcript_capacity)
+        self.chat_history.verticalScrollBar().actionTriggered.connect(
+            lambda action: QtCore.QTimer.singleShot(0, self.load_older_if_at_top)
+        )
         # Initial welcome message
         self.append_chat("Jarvis", "Hello! I'm Jarvis, your AI assistant. How can I help you today?")
 
@@ -140,8 +202,12 @@ class JarvisWindow(QtWidgets.QMainWindow):
         self.timer.timeout.connect(self.update_thinking)
         self.thinking_state = 0
 
-        # For response timing
-        self.start_time = None
+        # Questions still waiting for an answer (request id -> question), in send order
+        self.pending_requests = {}
+
+        # Request whose streamed text is shown (its document position is live_start)
+        self.live_request_id = None
+        self.live_text = ""
 
     def send_message(self):
         text = self.input_field.text().strip()
@@ -151,55 +217,212 @@ class JarvisWindow(QtWidgets.QMainWindow):
         self.input_field.clear()
 
         # Start the thinking indicator
-        self.thinking_label.setText("Thinking")
-        self.thinking_state = 0
-        self.timer.start(500)
-
-        # Record start time
-        self.start_time = time.time()
-        self.ai_engine.stop_response_flag = False
-
-        # Get AI response in a background thread
-        threading.Thread(target=self.get_response_thread, args=(text,), daemon=True).start()
-
-    def get_response_thread(self, text):
-        print("[DEBUG] Sending message to AI engine:", text)
-        response = self.ai_engine.get_response(text, update_chat_live=lambda x: None)
-        print("[DEBUG] Received response from AI engine:", repr(response))
-        self.response_ready.emit(response)
-
-    @QtCore.pyqtSlot(str)
-    def finish_response(self, response):
-        self.timer.stop()
-        self.thinking_label.clear()
-        thought_time = time.time() - self.start_time if self.start_time else 0
-        self.append_chat("System", f"Thought for {thought_time:.2f} seconds")
+        if not self.pending_requests and not self.waiting_messages:
+            self.thinking_label.setText("Thinking")
+            self.thinking_state = 0
+            self.timer.start(500)
+            self.updates.start()
+
+        if self.ai_engine is None:
+            self.waiting_messages.append(text)
+            return
+        self.submit(text)
+
+    def submit(self, text):
+        log.debug("Sending message to AI engine: %r", text)
+        if self.async_engine is not None:
+            request_id = next(self.async_request_ids)
+            self.async_tasks[request_id] = asyncio.ensure_future(self.ask_async(request_id, text))
+            self.pending_requests[request_id] = text
+            return
+
+        # Queue the request on the engine's scheduler. Its callbacks run on worker
+        # threads: streamed text goes to the coalescer, and the answer is emitted as a
+        # signal that Qt delivers on the GUI thread.
+        request_id = self.ai_engine.scheduler.submit(
+            text,
+            on_partial=self.updates.push,
+            on_done=lambda rid, response, elapsed, trace: self.response_ready.emit(
+                rid, response, elapsed, trace, time.perf_counter()
+            )
+        )
+        self.pending_requests[request_id] = text
+
+    async def ask_async(self, request_id, text):
+        # Runs on the GUI thread, so the widgets can be updated directly
+        started = time.perf_counter()
+        with telemetry.trace(text) as trace:
+            try:
+                response = await self.async_engine.get_response(
+                    text, lambda partial: self.updates.push(request_id, partial)
+                )
+            except asyncio.CancelledError:
+                response = "[stopped]"
+            except Exception as e:
+                log.exception("Request failed")
+                response = f"Error: {e}"
+        self.async_tasks.pop(request_id, None)
+        now = time.perf_counter()
+        self.finish_response(request_id, response, now - started, trace, now)
+
+    @QtCore.pyqtSlot(int, str, float, object, float)
+    def finish_response(self, request_id, response, thought_time, trace=None, handed_over_at=None):
+        log.debug("Received response from AI engine: %r", response)
+        question = self.pending_requests.pop(request_id, None)
+        answered_in_order = not self.pending_requests or request_id < min(self.pending_requests)
+        self.updates.discard(request_id)
+        if not self.pending_requests:
+            self.timer.stop()
+            self.thinking_label.clear()
+            self.updates.stop()
+
+        # Any streamed text is removed; a still-running request redraws it on its
+        # next update, so the in-progress message always stays last
+        self.clear_live_response()
+        if request_id == self.live_request_id:
+            self.live_request_id = None
+
+        # Say which question this answers when answers come back out of order
+        if question is not None and not answered_in_order:
+            self.append_chat("System", f"Thought for {thought_time:.2f} seconds (re: \"{question}\")")
+        else:
+            self.append_chat("System", f"Thought for {thought_time:.2f} seconds")
         self.append_chat("Jarvis", response.strip())
-        print("[DEBUG] Chat updated successfully")
+
+        # UI delivery: waiting for the GUI thread plus drawing the answer
+        if trace is not None and handed_over_at is not None:
+            telemetry.stage("ui_delivery", time.perf_counter() - handed_over_at, trace)
+            if self.show_timings.isChecked():
+                self.transcript.append(None, trace.summary(), "timing")
+
+    @QtCore.pyqtSlot(int, str)
+    def update_live_response(self, request_id, partial):
+        # Not drawn while paging back through history; the final answer brings the view back
+        if not self.transcript.following:
+            return
+        # Only one answer streams at a time; the others show up when they finish
+        if self.live_request_id is None:
+            self.live_request_id = request_id
+        if request_id != self.live_request_id:
+            return
+
+        # Update the in-progress paragraph in place rather than appending per chunk;
+        # usually the text only grew, so just the new words are inserted
+        text = partial.strip()
+        cursor = QtGui.QTextCursor(self.chat_history.document())
+        if self.live_start is not None and text.startswith(self.live_text):
+            cursor.movePosition(QtGui.QTextCursor.End)
+            cursor.insertText(text[len(self.live_text):], QtGui.QTextCharFormat())
+        else:
+            if self.live_start is None:
+                self.chat_history.append("")
+                cursor.movePosition(QtGui.QTextCursor.End)
+                self.live_start = cursor.position()
+            cursor.setPosition(self.live_start)
+            cursor.movePosition(QtGui.QTextCursor.End, QtGui.QTextCursor.KeepAnchor)
+            cursor.insertHtml("<b>Jarvis:</b> ")
+            cursor.insertText(text, QtGui.QTextCharFormat())
+        self.live_text = text
+        self.chat_history.verticalScrollBar().setValue(self.chat_history.verticalScrollBar().maximum())
+
+    def clear_live_response(self):
+        if self.live_start is None:
+            return
+        cursor = QtGui.QTextCursor(self.chat_history.document())
+        cursor.setPosition(self.live_start)
+        cursor.movePosition(QtGui.QTextCursor.End, QtGui.QTextCursor.KeepAnchor)
+        cursor.removeSelectedText()
+        cursor.deletePreviousChar()  # drop the empty paragraph the live text lived in
+        self.live_start = None
+        self.live_text = ""
 
     def update_thinking(self):
         self.thinking_state = (self.thinking_state % 3) + 1
         self.thinking_label.setText("Thinking" + "." * self.thinking_state)
 
     def append_chat(self, sender, message):
-        self.chat_history.setReadOnly(False)
-        formatted = f"<p><b>{sender}:</b> {message}</p>"
-        self.chat_history.append(formatted)
-        self.chat_history.setReadOnly(True)
+        self.transcript.append(sender, message)
         self.chat_history.verticalScrollBar().setValue(self.chat_history.verticalScrollBar().maximum())
 
+    # Transcript view: each message is one paragraph (block) of the document
+    def format_message(self, message):
+        if message.tag == "timing":
+            return f'<p style="color: #8c8c8c; font-size: 9pt;">{html.escape(message.text)}</p>'
+        return f"<p><b>{html.escape(message.sender)}:</b> {html.escape(message.text)}</p>"
+
+    def show_messages(self, messages, at_top):
+        # Streamed text must stay last; it is redrawn on its next update
+        self.clear_live_response()
+        if not at_top:
+            for message in messages:
+                self.chat_history.append(self.format_message(message))
+            return
+        cursor = QtGui.QTextCursor(self.chat_history.document())
+        cursor.beginEditBlock()
+        for message in messages:
+            cursor.insertHtml(self.format_message(message))
+            cursor.insertBlock()
+        cursor.endEditBlock()
+
+    def remove_messages(self, messages, from_top):
+        self.clear_live_response()
+        if len(messages) >= self.chat_history.document().blockCount():
+            self.chat_history.clear()
+            return
+        cursor = QtGui.QTextCursor(self.chat_history.document())
+        if from_top:
+            cursor.movePosition(QtGui.QTextCursor.NextBlock, QtGui.QTextCursor.KeepAnchor, len(messages))
+        else:
+            cursor.movePosition(QtGui.QTextCursor.End)
+            cursor.movePosition(QtGui.QTextCursor.PreviousBlock, QtGui.QTextCursor.KeepAnchor, len(messages))
+            cursor.movePosition(QtGui.QTextCursor.EndOfBlock, QtGui.QTextCursor.KeepAnchor)
+        cursor.removeSelectedText()
+
+    def load_older_if_at_top(self):
+        bar = self.chat_history.verticalScrollBar()
+        if bar.value() > bar.minimum() or not self.transcript.has_older():
+            return
+        # Keep the paragraph that was at the top in place rather than jumping to the oldest
+        height = bar.maximum()
+        if self.transcript.load_older():
+            bar.setValue(bar.value() + bar.maximum() - height)
+
     def stop_response(self):
-        print("[DEBUG] Stopping response generation")
-        self.ai_engine.stop_response_flag = True
-        self.thinking_label.setText("Stopping...")
+        log.info("Stopping response generation")
+        self.waiting_messages.clear()
+        if self.ai_engine is not None:
+            self.ai_engine.stop_response()
+        for task in list(self.async_tasks.values()):
+            task.cancel()
+        if self.pending_requests:
+            self.thinking_label.setText("Stopping...")
+        else:
+            self.timer.stop()
+            self.thinking_label.clear()
+            self.updates.stop()
 
     def change_ai_mode(self, mode):
-        print(f"[DEBUG] Changing AI mode to: {mode}")
         self.ai_engine.set_ai_mode(mode)
         # Optionally, display a system message that the mode changed:
         self.append_chat("System", f"AI Mode switched to: {mode}")
 
+def show_when_ready(window, preload=()):
+    """Shows window now and attaches the engine when the background startup has built it."""
+    events = []
+
+    def started(event):
+        startup.mark(event)
+        events.append(event)
+        if startup.probing() and len(events) == 2:
+            QtWidgets.QApplication.quit()
+
+    window.show()
+    QtCore.QTimer.singleShot(0, lambda: started("window"))
+    window.engine_ready.connect(lambda engine: started("ready"))
+    startup.load_engine(window.engine_ready.emit, lambda error: window.engine_failed.emit(str(error)), preload)
+
 if __name__ == "__main__":
+    configure_logging()
     app = QtWidgets.QApplication(sys.argv)
     app.setStyle("Fusion")
     # Create dark palette
@@ -219,6 +442,16 @@ if __name__ == "__main__":
     dark_palette.setColor(QtGui.QPalette.HighlightedText, QtCore.Qt.black)
     app.setPalette(dark_palette)
     
-    window = JarvisWindow()
-    window.show()
-    sys.exit(app.exec_())
+    if qasync is None:
+        window = JarvisWindow()
+        show_when_ready(window)
+        sys.exit(app.exec_())
+
+    loop = qasync.QEventLoop(app)
+    asyncio.set_event_loop(loop)
+    window = JarvisWindow(use_asyncio=True)
+    show_when_ready(window, preload=["async_engine"])
+    with loop:
+        loop.run_forever()
+        if window.async_engine is not None:
+            loop.run_until_complete(window.async_engine.close())
@@ -1,16 +1,174 @@
+import atexit
+import logging
+import queue
 import sqlite3
+import threading
+import time
+from contextlib import contextmanager
 from datetime import datetime
 
+log = logging.getLogger("jarvis.memory")
+
+
+def tune_connection(conn):
+    """WAL lets readers run alongside the writer; NORMAL skips the fsync on every commit."""
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+
+
+class WriteBehindWriter:
+    """Applies queued writes on a dedicated thread, batching them into one transaction.
+
+    This thread is the only writer to the database, so callers never contend for
+    SQLite's write lock. It starts with the first submit().
+    """
+
+    def __init__(self, db_path, batch_size=256):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.queue = queue.Queue()
+        self.closed = False
+
+        # Writes are numbered so flush() can wait for "everything submitted so far"
+        # without waiting on writes other threads keep adding after it
+        self.submitted = 0
+        self.committed = 0
+        self.progress = threading.Condition()
+
+        self.thread = None
+
+    def submit(self, sql, params=(), on_commit=None):
+        """Queues a write and returns immediately.
+
+        on_commit, if given, is called on the writer thread with the row id of the
+        write once it is committed.
+        """
+        with self.progress:
+            if self.closed:
+                raise sqlite3.ProgrammingError("Cannot write to a closed memory database.")
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name="memory-writer", daemon=True)
+                self.thread.start()
+            self.submitted += 1
+            self.queue.put((sql, params, on_commit))
+
+    def flush(self):
+        """Blocks until every write submitted so far is committed."""
+        with self.progress:
+            target = self.submitted
+            self.progress.wait_for(lambda: self.committed >= target)
+
+    def close(self):
+        """Commits pending writes and stops the writer thread."""
+        with self.progress:
+            if self.closed:
+                return
+            self.closed = True
+            if self.thread is None:
+                return
+            self.queue.put(None)
+        self.thread.join()
+
+    def run(self):
+        conn = sqlite3.connect(self.db_path)
+        tune_connection(conn)
+        running = True
+        while running:
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            writes = 0
+            committed = []  # (on_commit, row id) to report once the batch is on disk
+            try:
+                for item in batch:
+                    if item is None:
+                        running = False
+                        continue
+                    writes += 1
+                    sql, params, on_commit = item
+                    try:
+                        cursor = conn.execute(sql, params)
+                    except sqlite3.Error as e:
+                        log.warning("Dropped memory write: %s", e)
+                        continue
+                    if on_commit:
+                        committed.append((on_commit, cursor.lastrowid))
+                conn.commit()
+                for on_commit, rowid in committed:
+                    try:
+                        on_commit(rowid)
+                    except Exception:
+                        log.exception("Memory write callback failed")
+            finally:
+                with self.progress:
+                    self.committed += writes
+                    self.progress.notify_all()
+        conn.close()
+
+
 class Memory:
-    def __init__(self, db_path="memory.db"):
+    """Conversation and user-data store that is safe to use from any thread.
+
+    All writes go through one WriteBehindWriter; reads borrow a connection from a
+    small pool of read-only connections, so there is no shared cursor. Nothing is
+    tied to the creating thread, so asyncio code can call these methods through
+    loop.run_in_executor() / asyncio.to_thread().
+
+    The database is opened on first use (see open()), so building a Memory costs
+    nothing until something reads or writes it.
+    """
+
+    def __init__(self, db_path="memory.db", readers=4):
         self.db_path = db_path
-        self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
-        self.cursor = self.conn.cursor()
-        self.create_tables()
+        self.fts_enabled = False  # set by open() when SQLite has FTS5
+
+        # Conversation logging happens off the response path; the writer is
+        # flushed on close() and at interpreter exit so nothing is lost
+        self.writer = WriteBehindWriter(self.db_path)
+
+        self.readers = None  # queue of read-only connections, filled by open()
+        self.reader_count = readers
+        self.newest_id = 0  # see last_conversation_id
+        self.opened = False
+        self.closed = False
+        self.open_lock = threading.Lock()
+
+    def open(self):
+        """Creates the tables and the reader pool if that has not happened yet."""
+        if self.opened and not self.closed:
+            return
+        with self.open_lock:
+            if self.closed:
+                raise sqlite3.ProgrammingError("Cannot operate on a closed memory database.")
+            if self.opened:
+                return
+            self.create_tables()
+            readers = queue.Queue()
+            for _ in range(self.reader_count):
+                conn = sqlite3.connect(self.db_path, check_same_thread=False)
+                conn.execute("PRAGMA query_only = ON")
+                readers.put(conn)
+            conn = readers.get()
+            self.newest_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM conversations").fetchone()[0]
+            readers.put(conn)
+            self.readers = readers
+            atexit.register(self.close)
+            self.opened = True
+
+    @property
+    def last_conversation_id(self):
+        """Id of the newest committed turn; the writer keeps it current, so reading it never touches SQLite."""
+        self.open()
+        return self.newest_id
 
     def create_tables(self):
         """Create tables for storing conversation history and user preferences."""
-        self.cursor.execute('''
+        conn = sqlite3.connect(self.db_path)
+        tune_connection(conn)
+        conn.execute('''
             CREATE TABLE IF NOT EXISTS conversations (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 timestamp TEXT,
@@ -18,49 +176,247 @@ class Memory:
                 ai_response TEXT
             )
         ''')
-        
-        self.cursor.execute('''
+
+        conn.execute('''
             CREATE TABLE IF NOT EXISTS user_data (
                 key TEXT PRIMARY KEY,
                 value TEXT
             )
         ''')
-        self.conn.commit()
+
+        # Conversations held through server.py, one history per client session
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS session_conversations (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                session TEXT,
+                timestamp TEXT,
+                user_input TEXT,
+                ai_response TEXT
+            )
+        ''')
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS session_conversations_session ON session_conversations (session, id)"
+        )
+        conn.commit()
+        self.create_search_index(conn)
+        conn.close()
+
+    def create_search_index(self, conn):
+        """Full-text index over conversations, kept in sync by triggers."""
+        exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'conversations_fts'"
+        ).fetchone()
+        try:
+            conn.executescript('''
+                CREATE VIRTUAL TABLE IF NOT EXISTS conversations_fts USING fts5(
+                    user_input, ai_response, content='conversations', content_rowid='id',
+                    tokenize='porter unicode61'
+                );
+                CREATE TRIGGER IF NOT EXISTS conversations_fts_insert AFTER INSERT ON conversations BEGIN
+                    INSERT INTO conversations_fts (rowid, user_input, ai_response)
+                    VALUES (new.id, new.user_input, new.ai_response);
+                END;
+                CREATE TRIGGER IF NOT EXISTS conversations_fts_delete AFTER DELETE ON conversations BEGIN
+                    INSERT INTO conversations_fts (conversations_fts, rowid, user_input, ai_response)
+                    VALUES ('delete', old.id, old.user_input, old.ai_response);
+                END;
+                CREATE TRIGGER IF NOT EXISTS conversations_fts_update AFTER UPDATE ON conversations BEGIN
+                    INSERT INTO conversations_fts (conversations_fts, rowid, user_input, ai_response)
+                    VALUES ('delete', old.id, old.user_input, old.ai_response);
+                    INSERT INTO conversations_fts (rowid, user_input, ai_response)
+                    VALUES (new.id, new.user_input, new.ai_response);
+                END;
+            ''')
+        except sqlite3.OperationalError as e:
+            # SQLite built without FTS5; search_conversations falls back to LIKE
+            log.info("Full-text search unavailable: %s", e)
+            return
+        if not exists:
+            # First run against an existing memory.db: index the rows already there
+            conn.execute("INSERT INTO conversations_fts (conversations_fts) VALUES ('rebuild')")
+            conn.commit()
+        self.fts_enabled = True
+
+    @contextmanager
+    def reader(self):
+        """Borrows a read-only connection from the pool for the duration of the block."""
+        self.open()
+        conn = self.readers.get()
+        try:
+            yield conn
+        finally:
+            self.readers.put(conn)
 
     def store_conversation(self, user_input, ai_response):
-        """Store conversation in the database."""
+        """Queue a conversation turn for the background writer."""
+        self.open()
         timestamp = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
-        self.cursor.execute(
+        self.writer.submit(
             "INSERT INTO conversations (timestamp, user_input, ai_response) VALUES (?, ?, ?)",
-            (timestamp, user_input, ai_response)
+            (timestamp, user_input, ai_response), on_commit=self.conversation_stored
         )
-        self.conn.commit()
+
+    def conversation_stored(self, conversation_id):
+        # Runs on the writer thread, the only one that changes newest_id after open()
+        self.newest_id = max(self.newest_id, conversation_id)
+
+    def flush(self):
+        """Wait until queued conversation turns are on disk."""
+        self.writer.flush()
 
     def get_recent_conversations(self, limit=5):
         """Retrieve the last few interactions."""
-        self.cursor.execute("SELECT user_input, ai_response FROM conversations ORDER BY id DESC LIMIT ?", (limit,))
-        return self.cursor.fetchall()
+        self.flush()
+        with self.reader() as conn:
+            return conn.execute(
+                "SELECT user_input, ai_response FROM conversations ORDER BY id DESC LIMIT ?", (limit,)
+            ).fetchall()
+
+    def get_max_conversation_id(self, flush=True):
+        """Id of the newest stored turn, 0 if there are none; flush=False skips queued writes."""
+        if flush:
+            self.flush()
+        with self.reader() as conn:
+            return conn.execute("SELECT COALESCE(MAX(id), 0) FROM conversations").fetchone()[0]
+
+    def get_conversations_after(self, last_id, limit=1000, flush=True):
+        """Turns with id greater than last_id, oldest first, as (id, user_input, ai_response).
+
+        flush=False reads only what is already committed, without waiting for queued writes.
+        """
+        if flush:
+            self.flush()
+        with self.reader() as conn:
+            return conn.execute(
+                "SELECT id, user_input, ai_response FROM conversations WHERE id > ? ORDER BY id LIMIT ?",
+                (last_id, limit)
+            ).fetchall()
+
+    def get_conversations_before(self, before_id, limit=50):
+        """Committed turns with id below before_id, newest first, as (id, user_input, ai_response)."""
+        with self.reader() as conn:
+            return conn.execute(
+                "SELECT id, user_input, ai_response FROM conversations WHERE id < ? ORDER BY id DESC LIMIT ?",
+                (before_id, limit)
+            ).fetchall()
+
+    def get_conversations_by_ids(self, ids):
+        """Turns with the given ids as (id, user_input, ai_response)."""
+        if not ids:
+            return []
+        with self.reader() as conn:
+            return conn.execute(
+                f"SELECT id, user_input, ai_response FROM conversations WHERE id IN ({','.join('?' * len(ids))})",
+                list(ids)
+            ).fetchall()
+
+    def search_conversations(self, query, limit=10, offset=0, highlight=("[", "]")):
+        """Find past turns matching query, best match first.
+
+        Returns (id, timestamp, user_input, ai_response, score) tuples where the text
+        columns are snippets with matches wrapped in highlight; lower score is better
+        (BM25). Use offset for the next page.
+        """
+        # open() is what finds out whether FTS5 is there
+        self.open()
+        self.flush()
+        terms = query.split()
+        if not terms:
+            return []
+        if not self.fts_enabled:
+            pattern = f"%{query.strip()}%"
+            with self.reader() as conn:
+                return conn.execute('''
+                    SELECT id, timestamp, user_input, ai_response, 0.0 FROM conversations
+                    WHERE user_input LIKE ? OR ai_response LIKE ?
+                    ORDER BY id DESC LIMIT ? OFFSET ?
+                ''', (pattern, pattern, limit, offset)).fetchall()
+
+        # Quote every term so punctuation in the user's text is not read as FTS syntax
+        match = " ".join('"' + term.replace('"', '""') + '"' for term in terms)
+        start, end = highlight
+        with self.reader() as conn:
+            return conn.execute('''
+                SELECT c.id, c.timestamp,
+                       snippet(conversations_fts, 0, ?, ?, '...', 12),
+                       snippet(conversations_fts, 1, ?, ?, '...', 24),
+                       bm25(conversations_fts)
+                FROM conversations_fts JOIN conversations c ON c.id = conversations_fts.rowid
+                WHERE conversations_fts MATCH ?
+                ORDER BY bm25(conversations_fts) LIMIT ? OFFSET ?
+            ''', (start, end, start, end, match, limit, offset)).fetchall()
+
+    def store_session_conversation(self, session, user_input, ai_response):
+        """Queue a turn of a server session's conversation."""
+        self.open()
+        timestamp = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+        self.writer.submit(
+            "INSERT INTO session_conversations (session, timestamp, user_input, ai_response) VALUES (?, ?, ?, ?)",
+            (session, timestamp, user_input, ai_response)
+        )
+
+    def get_session_conversations(self, session, limit=5):
+        """The last few turns of one session, newest first."""
+        self.flush()
+        with self.reader() as conn:
+            return conn.execute(
+                "SELECT user_input, ai_response FROM session_conversations WHERE session = ? ORDER BY id DESC LIMIT ?",
+                (session, limit)
+            ).fetchall()
+
+    def clear_session(self, session):
+        """Forget one session's conversation."""
+        self.open()
+        self.writer.submit("DELETE FROM session_conversations WHERE session = ?", (session,))
+        self.flush()
 
     def store_user_data(self, key, value):
         """Store persistent user data (e.g., name, preferences)."""
-        self.cursor.execute("REPLACE INTO user_data (key, value) VALUES (?, ?)", (key, value))
-        self.conn.commit()
+        self.open()
+        self.writer.submit("REPLACE INTO user_data (key, value) VALUES (?, ?)", (key, value))
+        self.flush()
 
     def get_user_data(self, key):
         """Retrieve stored user data."""
-        self.cursor.execute("SELECT value FROM user_data WHERE key = ?", (key,))
-        result = self.cursor.fetchone()
+        with self.reader() as conn:
+            result = conn.execute("SELECT value FROM user_data WHERE key = ?", (key,)).fetchone()
         return result[0] if result else None
 
+    def get_all_user_data(self):
+        """Every stored (key, value) pair."""
+        with self.reader() as conn:
+            return conn.execute("SELECT key, value FROM user_data ORDER BY key").fetchall()
+
     def clear_memory(self):
         """Wipe stored conversations and user data."""
-        self.cursor.execute("DELETE FROM conversations")
-        self.cursor.execute("DELETE FROM user_data")
-        self.conn.commit()
+        self.open()
+        self.writer.submit("DELETE FROM conversations")
+        self.writer.submit("DELETE FROM user_data")
+        self.flush()
+
+    def close(self, timeout=2.0):
+        """Flush pending writes and close every database connection.
+
+        Waits up to timeout seconds for readers other threads still have checked
+        out; those that do not come back are left for the garbage collector.
+        """
+        with self.open_lock:
+            if self.closed:
+                return
+            self.closed = True
+        self.writer.close()
+        if self.readers is None:
+            return
+        deadline = time.monotonic() + timeout
+        for closed in range(self.reader_count):
+            try:
+                conn = self.readers.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                log.warning("%d memory reader(s) still in use at close; not waiting for them",
+                            self.reader_count - closed)
+                return
+            conn.close()
 
-    def close(self):
-        """Close the database connection."""
-        self.conn.close()
 
 # Example Usage
 if __name__ == "__main__":
@@ -0,0 +1,149 @@
+import json
+import os
+import threading
+import numpy as np
+from cache import HashingEmbedder
+
+
+class VectorIndex:
+    """Append-only matrix of unit vectors stored in a memory-mapped file.
+
+    Rows live in <path>/vectors.f32 with their ids in <path>/ids.i64, so the index
+    is loaded lazily by the OS instead of being read into RAM at startup. Capacity
+    doubles when full; appending never rewrites existing rows.
+    """
+
+    def __init__(self, path, dim, initial_capacity=1024):
+        self.path = path
+        self.dim = dim
+        os.makedirs(path, exist_ok=True)
+        self.meta_path = os.path.join(path, "meta.json")
+        meta = {"count": 0, "capacity": initial_capacity, "dim": dim}
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path) as f:
+                meta = json.load(f)
+            if meta["dim"] != dim:
+                # Embedder changed; the stored vectors are meaningless now
+                meta = {"count": 0, "capacity": initial_capacity, "dim": dim}
+        self.count = meta["count"]
+        self.capacity = meta["capacity"]
+        self.open_files()
+
+    def open_files(self):
+        self.vectors = self.open_array("vectors.f32", np.float32, (self.capacity, self.dim))
+        self.ids = self.open_array("ids.i64", np.int64, (self.capacity,))
+
+    def open_array(self, name, dtype, shape):
+        file_path = os.path.join(self.path, name)
+        size = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        with open(file_path, "ab") as f:
+            if f.tell() < size:
+                f.truncate(size)
+        return np.memmap(file_path, dtype=dtype, mode="r+", shape=shape)
+
+    def append(self, ids, vectors):
+        """Adds rows; ids and vectors must line up."""
+        needed = self.count + len(ids)
+        if needed > self.capacity:
+            self.vectors.flush()
+            self.ids.flush()
+            while self.capacity < needed:
+                self.capacity *= 2
+            self.open_files()
+        self.vectors[self.count:needed] = vectors
+        self.ids[self.count:needed] = ids
+        self.count = needed
+        self.save_meta()
+
+    def search(self, vector, k):
+        """Returns (ids, scores) of the k rows most similar to vector, best first."""
+        if self.count == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        scores = self.vectors[:self.count] @ vector
+        k = min(k, self.count)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return np.asarray(self.ids[top]), np.asarray(scores[top])
+
+    def last_id(self):
+        return int(self.ids[self.count - 1]) if self.count else 0
+
+    def reset(self):
+        self.count = 0
+        self.save_meta()
+
+    def save_meta(self):
+        self.vectors.flush()
+        self.ids.flush()
+        with open(self.meta_path, "w") as f:
+            json.dump({"count": self.count, "capacity": self.capacity, "dim": self.dim}, f)
+
+
+class ConversationRetriever:
+    """Finds past turns and stored user facts relevant to a new question.
+
+    Conversations are embedded once, as they are added to memory, into a
+    VectorIndex; each sync() only embeds rows newer than the last indexed id.
+    user_data is small, so its facts are kept in an in-memory matrix that is
+    rebuilt only when the stored facts change.
+    """
+
+    def __init__(self, memory, index_path="memory_index", embedder=None, min_score=0.3):
+        self.memory = memory
+        self.embedder = embedder or HashingEmbedder(dim=256)
+        self.min_score = min_score
+        self.index_path = index_path
+        self.index = None  # opened by the first sync(), so engines that never retrieve never map it
+        self.facts = []
+        self.fact_vectors = np.zeros((0, self.embedder.dim), dtype=np.float32)
+        self.lock = threading.Lock()
+
+    def sync(self, batch_size=1000):
+        """Embeds conversation turns committed since the last sync.
+
+        Turns still queued in the write-behind writer are picked up by a later sync,
+        so a query never waits for pending writes to reach the disk.
+        """
+        if self.index is None:
+            self.index = VectorIndex(self.index_path, self.embedder.dim)
+        if self.memory.get_max_conversation_id(flush=False) < self.index.last_id():
+            # Memory was cleared; old ids no longer point at anything
+            self.index.reset()
+        while True:
+            rows = self.memory.get_conversations_after(self.index.last_id(), batch_size, flush=False)
+            if not rows:
+                break
+            vectors = np.stack([self.embedder.embed(f"{user_input} {ai_response}")
+                                for _, user_input, ai_response in rows])
+            self.index.append([row[0] for row in rows], vectors)
+
+        facts = self.memory.get_all_user_data()
+        if facts != self.facts:
+            self.facts = facts
+            self.fact_vectors = np.stack(
+                [self.embedder.embed(f"my {key} is {value}") for key, value in facts]
+            ) if facts else np.zeros((0, self.embedder.dim), dtype=np.float32)
+
+    def retrieve(self, query, k=3):
+        """Returns up to k lines of remembered context relevant to query."""
+        with self.lock:
+            self.sync()
+            vector = self.embedder.embed(query)
+            items = []
+            if len(self.facts):
+                fact_scores = self.fact_vectors @ vector
+                for i in np.argsort(-fact_scores)[:k]:
+                    if fact_scores[i] >= self.min_score:
+                        key, value = self.facts[i]
+                        items.append((float(fact_scores[i]), f"The user's {key} is {value}."))
+
+            ids, scores = self.index.search(vector, k)
+            keep = [int(i) for i, score in zip(ids, scores) if score >= self.min_score]
+            turns = dict((row[0], row[1:]) for row in self.memory.get_conversations_by_ids(keep))
+            for conversation_id, score in zip(ids, scores):
+                if int(conversation_id) in turns:
+                    user_input, ai_response = turns[int(conversation_id)]
+                    items.append((float(score), f"Earlier the user said \"{user_input}\" and you replied \"{ai_response}\""))
+
+        items.sort(key=lambda item: -item[0])
+        return [text for _, text in items[:k]]
@@ -0,0 +1,260 @@
+"""Query routing: decides whether a prompt goes to OpenAI or stays on Phi-3.
+
+    python router.py bench                                   # routing cost vs. rule count
+    python router.py train --db memory.db                    # classifier from past answers
+    python router.py train --examples labeled.jsonl          # ... or from {"prompt", "route"} lines
+    python router.py route "who won the match last night?"
+
+Keyword phrases are compiled into one regex, factored by common prefix, that only
+matches whole words; the cost of a lookup depends on the prompt's length rather
+than on the number of rules. Each rule adds its weight to the log-odds of the
+prompt needing OpenAI, an optional classifier adds its own, and the result is a
+Route with the chosen backend and a confidence in [0.5, 1].
+"""
+
+import argparse
+import json
+import math
+import os
+import random
+import re
+import sqlite3
+import time
+from collections import namedtuple
+import numpy as np
+from cache import HashingEmbedder
+
+Route = namedtuple("Route", ["route", "confidence", "score", "matches"])
+
+
+def phrase_regex(phrases):
+    """One pattern matching any of phrases, with alternatives merged into a prefix trie."""
+    trie = {}
+    for phrase in phrases:
+        node = trie
+        for char in phrase:
+            node = node.setdefault(char, {})
+        node[""] = {}  # end of a phrase
+
+    def build(node):
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        # A phrase may end here or continue into a longer one; prefer the longer match
+        return f"(?:{body})?" if "" in node else body
+
+    return build(trie)
+
+
+class RouteClassifier:
+    """Logistic regression over HashingEmbedder vectors, giving the log-odds a prompt needs OpenAI."""
+
+    def __init__(self, embedder=None, weights=None, bias=0.0):
+        self.embedder = embedder or HashingEmbedder(dim=256)
+        self.weights = np.zeros(self.embedder.dim, dtype=np.float32) if weights is None else weights
+        self.bias = bias
+
+    def logit(self, text):
+        return float(self.embedder.embed(text) @ self.weights + self.bias)
+
+    def fit(self, prompts, labels, epochs=300, learning_rate=1.0, l2=1e-4):
+        """Trains on prompts with labels 1 (OpenAI) / 0 (Phi-3) by full-batch gradient descent."""
+        features = np.stack([self.embedder.embed(prompt) for prompt in prompts])
+        targets = np.asarray(labels, dtype=np.float32)
+        weights = np.zeros(features.shape[1], dtype=np.float32)
+        bias = 0.0
+        for _ in range(epochs):
+            predicted = 1.0 / (1.0 + np.exp(-(features @ weights + bias)))
+            error = predicted - targets
+            weights -= learning_rate * (features.T @ error / len(targets) + l2 * weights)
+            bias -= learning_rate * float(error.mean())
+        self.weights, self.bias = weights, bias
+        predicted = features @ weights + bias > 0
+        return float((predicted == (targets > 0.5)).mean())
+
+    def save(self, path):
+        np.savez(path, weights=self.weights, bias=self.bias, dim=self.embedder.dim)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(HashingEmbedder(dim=int(data["dim"])), data["weights"], float(data["bias"]))
+
+
+class QueryRouter:
+    """Weighted keyword/regex rules plus an optional classifier, routing prompts to one of two backends.
+
+    Weights are log-odds: the score starts at bias (negative, so prompts stay on
+    default without evidence), every matching rule adds its weight once, and the
+    classifier adds classifier_weight times its logit. A positive score routes to
+    route; the confidence is the sigmoid of the score's distance from zero.
+    A classifier_path is loaded on the first route(), if the file exists.
+    """
+
+    def __init__(self, route="openai", default="phi3", bias=-2.0, classifier=None, classifier_weight=1.0,
+                 classifier_path=None):
+        self.route_name = route
+        self.default = default
+        self.bias = bias
+        self.classifier = classifier
+        self.classifier_path = classifier_path
+        self.classifier_weight = classifier_weight
+        self.keywords = {}  # normalized phrase -> weight
+        self.patterns = []  # (regex source, weight)
+        self.keyword_regex = None
+        self.pattern_regex = None
+        self.dirty = False
+
+    def add_keywords(self, phrases, weight=4.0):
+        """Whole-word phrases ("who won", "latest") that count toward the routed backend."""
+        for phrase in phrases:
+            phrase = " ".join(phrase.lower().split())
+            if phrase:
+                self.keywords[phrase] = weight
+        self.dirty = True
+
+    def add_pattern(self, pattern, weight=4.0):
+        """A regex over the normalized (lowercased) prompt; a negative weight argues for default."""
+        re.compile(pattern)  # fail here rather than at the next route()
+        self.patterns.append((pattern, weight))
+        self.dirty = True
+
+    def compile(self):
+        self.keyword_regex = None
+        if self.keywords:
+            self.keyword_regex = re.compile(r"(?<!\w)" + phrase_regex(self.keywords) + r"(?!\w)")
+        self.pattern_regex = None
+        if self.patterns:
+            self.pattern_regex = re.compile(
+                "|".join(f"(?P<p{n}>{pattern})" for n, (pattern, _) in enumerate(self.patterns))
+            )
+        self.dirty = False
+
+    def load_classifier(self):
+        path, self.classifier_path = self.classifier_path, None
+        if os.path.exists(path):
+            self.classifier = RouteClassifier.load(path)
+
+    def route(self, text):
+        """Returns a Route(route, confidence, score, matches) for text."""
+        if self.dirty:
+            self.compile()
+        if self.classifier_path is not None:
+            self.load_classifier()
+        text = " ".join(text.lower().split())  # what cache.normalize_prompt does, without the regex
+        score = self.bias
+        matches = []
+        if self.keyword_regex is not None:
+            for phrase in set(self.keyword_regex.findall(text)):
+                score += self.keywords[phrase]
+                matches.append(phrase)
+        if self.pattern_regex is not None:
+            for index in {int(match.lastgroup[1:]) for match in self.pattern_regex.finditer(text)}:
+                pattern, weight = self.patterns[index]
+                score += weight
+                matches.append(pattern)
+        if self.classifier is not None:
+            score += self.classifier_weight * self.classifier.logit(text)
+        confidence = 1.0 / (1.0 + math.exp(-abs(score)))
+        return Route(self.route_name if score > 0 else self.default, confidence, score, matches)
+
+
+def examples_from_memory(db_path):
+    """(prompts, labels) from stored conversations, labelled by the backend that answered them.
+
+    These labels are the old router's decisions, so a classifier trained on them
+    learns to generalize the keyword rules rather than to correct them; hand-label
+    a JSONL file for that.
+    """
+    conn = sqlite3.connect(db_path)
+    try:
+        rows = conn.execute(
+            "SELECT user_input, ai_response FROM conversations "
+            "WHERE ai_response LIKE '(OpenAI)%' OR ai_response LIKE '(Phi-3)%'"
+        ).fetchall()
+    finally:
+        conn.close()
+    return [prompt for prompt, _ in rows], [1 if answer.startswith("(OpenAI)") else 0 for _, answer in rows]
+
+
+def examples_from_jsonl(path, route="openai"):
+    prompts, labels = [], []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                prompts.append(record["prompt"])
+                labels.append(1 if record["route"] == route else 0)
+    return prompts, labels
+
+
+def bench(rule_counts=(10, 100, 1000, 5000, 20000), prompts=500, seed=1):
+    """Prints compile time and per-prompt routing cost against a linear substring scan."""
+    rng = random.Random(seed)
+    syllables = ["ka", "lo", "mi", "ne", "ru", "ta", "vo", "zi", "pe", "sho"]
+    word = lambda: "".join(rng.choice(syllables) for _ in range(rng.randint(2, 4)))
+    texts = [" ".join(word() for _ in range(rng.randint(6, 20))) + "?" for _ in range(prompts)]
+
+    print(f"{'rules':>7} {'compile ms':>11} {'route us':>9} {'scan us':>9}")
+    for count in rule_counts:
+        phrases = list({" ".join(word() for _ in range(rng.randint(1, 3))) for _ in range(count)})
+        router = QueryRouter()
+        router.add_keywords(phrases)
+        started = time.perf_counter()
+        router.compile()
+        compile_ms = (time.perf_counter() - started) * 1000
+
+        started = time.perf_counter()
+        for text in texts:
+            router.route(text)
+        route_us = (time.perf_counter() - started) / len(texts) * 1e6
+
+        started = time.perf_counter()
+        for text in texts:
+            any(phrase in text.lower() for phrase in phrases)
+        scan_us = (time.perf_counter() - started) / len(texts) * 1e6
+        print(f"{count:>7} {compile_ms:>11.1f} {route_us:>9.2f} {scan_us:>9.2f}")
+
+    classifier = RouteClassifier()
+    started = time.perf_counter()
+    for text in texts:
+        classifier.logit(text)
+    print(f"classifier adds {(time.perf_counter() - started) / len(texts) * 1e6:.1f} us per prompt")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Train, inspect and benchmark the query router.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("bench", help="routing cost vs. number of rules")
+    train = commands.add_parser("train", help="fit the optional classifier")
+    source = train.add_mutually_exclusive_group(required=True)
+    source.add_argument("--db", help="memory database whose answers label the prompts")
+    source.add_argument("--examples", help='JSONL of {"prompt": ..., "route": "openai" | "phi3"}')
+    train.add_argument("-o", "--output", default="router_model.npz")
+    route = commands.add_parser("route", help="show the decision for a prompt")
+    route.add_argument("prompt")
+    route.add_argument("--db", default="memory.db")
+    args = parser.parse_args(argv)
+
+    if args.command == "bench":
+        bench()
+    elif args.command == "train":
+        prompts, labels = examples_from_memory(args.db) if args.db else examples_from_jsonl(args.examples)
+        if len(set(labels)) < 2:
+            parser.error("need examples of both routes to train")
+        classifier = RouteClassifier()
+        accuracy = classifier.fit(prompts, labels)
+        classifier.save(args.output)
+        print(f"Trained on {len(prompts)} prompts ({sum(labels)} OpenAI), training accuracy {accuracy:.1%}; "
+              f"saved {args.output}")
+    else:
+        from ai_engine import AIEngine
+        from memory import Memory
+        engine = AIEngine(memory=Memory(args.db))
+        print(engine.router.route(args.prompt))
+        engine.memory.close()
+
+
+if __name__ == "__main__":
+    main()
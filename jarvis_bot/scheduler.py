@@ -0,0 +1,174 @@
+import itertools
+import logging
+import queue
+import threading
+import time
+
+log = logging.getLogger("jarvis.scheduler")
+
+
+class SchedulerFullError(Exception):
+    """Raised when the request queue is at capacity."""
+
+
+class ScheduledRequest:
+    """One get_response call waiting in the queue or running, and everyone waiting on it."""
+
+    def __init__(self, key, user_input, priority):
+        self.key = key
+        self.user_input = user_input
+        self.priority = priority
+        self.subscribers = []  # (request_id, on_partial, on_done, submitted_at)
+        self.cancel = threading.Event()
+        self.submitted_at = time.time()
+
+
+class RequestScheduler:
+    """Runs AIEngine.get_response calls on a fixed pool of worker threads.
+
+    Requests wait in a priority queue (FIFO within a priority). A request for a
+    prompt that is already queued or running joins that call instead of starting
+    another one, and every caller gets the answer under its own request id.
+
+    on_partial(request_id, text) receives streamed text; on_done(request_id,
+    response, seconds_since_submit, trace) receives the final answer and the
+    telemetry Trace of the call that produced it. Both are called on a worker
+    thread.
+    """
+
+    HIGH, NORMAL, LOW = 0, 1, 2
+
+    def __init__(self, engine, workers=2, max_queue=64):
+        self.engine = engine
+        self.max_queue = max_queue
+        self.queue = queue.PriorityQueue()
+        self.lock = threading.Lock()
+        self.in_flight = {}  # cache key -> ScheduledRequest
+        self.jobs = {}  # request id -> ScheduledRequest
+        self.request_ids = itertools.count(1)
+        self.sequence = itertools.count()
+        self.running = 0
+        self.counters = {
+            "submitted": 0, "coalesced": 0, "completed": 0, "cancelled": 0, "rejected": 0,
+            "max_queue_depth": 0, "total_wait": 0.0
+        }
+        self.workers = [
+            threading.Thread(target=self.worker_loop, name=f"scheduler-{n}", daemon=True)
+            for n in range(workers)
+        ]
+        for worker in self.workers:
+            worker.start()
+
+    def submit(self, user_input, on_partial=None, on_done=None, priority=NORMAL):
+        """Queues user_input and returns its request id."""
+        key = self.engine.cache_key(user_input)
+        with self.lock:
+            request_id = next(self.request_ids)
+            subscriber = (request_id, on_partial, on_done, time.time())
+            job = self.in_flight.get(key)
+            if job is not None and not job.cancel.is_set():
+                job.subscribers.append(subscriber)
+                self.jobs[request_id] = job
+                self.counters["coalesced"] += 1
+                return request_id
+
+            if self.queue.qsize() >= self.max_queue:
+                self.counters["rejected"] += 1
+                raise SchedulerFullError(f"{self.max_queue} requests already waiting")
+            job = ScheduledRequest(key, user_input, priority)
+            job.subscribers.append(subscriber)
+            self.in_flight[key] = job
+            self.jobs[request_id] = job
+            self.queue.put((priority, next(self.sequence), job))
+            self.counters["submitted"] += 1
+            self.counters["max_queue_depth"] = max(self.counters["max_queue_depth"], self.queue.qsize())
+        return request_id
+
+    def worker_loop(self):
+        while True:
+            _, _, job = self.queue.get()
+            if job is None:
+                return
+            waited = time.time() - job.submitted_at
+            with self.lock:
+                self.running += 1
+                self.counters["total_wait"] += waited
+            telemetry = self.engine.telemetry
+            telemetry.observe("queue_wait_seconds", waited)
+            # The trace stays open until the subscribers have been handed the answer
+            with telemetry.trace(job.user_input) as trace:
+                try:
+                    if job.cancel.is_set():
+                        response = "[stopped]"
+                    else:
+                        response = self.engine.get_response(
+                            job.user_input, lambda text: self.publish(job, text), cancel=job.cancel
+                        )
+                except Exception as e:
+                    log.exception("Scheduled request failed")
+                    response = f"Error: {e}"
+                with self.lock:
+                    self.running -= 1
+                    self.counters["completed"] += 1
+                    if self.in_flight.get(job.key) is job:
+                        del self.in_flight[job.key]
+                    subscribers = list(job.subscribers)
+                    for request_id, _, _, _ in subscribers:
+                        self.jobs.pop(request_id, None)
+                # One subscriber's broken callback must not cost the others their answer or kill the worker
+                for request_id, _, on_done, submitted_at in subscribers:
+                    if on_done:
+                        try:
+                            on_done(request_id, response, time.time() - submitted_at, trace)
+                        except Exception:
+                            log.exception("on_done callback for request %s failed", request_id)
+
+    def publish(self, job, text):
+        with self.lock:
+            subscribers = list(job.subscribers)
+        for request_id, on_partial, _, _ in subscribers:
+            if on_partial:
+                try:
+                    on_partial(request_id, text)
+                except Exception:
+                    log.exception("on_partial callback for request %s failed", request_id)
+
+    def cancel(self, request_id):
+        """Stops the call serving request_id (shared with any coalesced requests)."""
+        with self.lock:
+            job = self.jobs.get(request_id)
+            if job is None:
+                return False
+            if self.in_flight.get(job.key) is job:
+                del self.in_flight[job.key]
+            self.counters["cancelled"] += 1
+        self.engine.cancel_streams(job.cancel)
+        return True
+
+    def cancel_all(self):
+        """Stops every queued and running request."""
+        with self.lock:
+            jobs = set(self.jobs.values())
+            self.in_flight.clear()
+            self.counters["cancelled"] += len(jobs)
+        for job in jobs:
+            self.engine.cancel_streams(job.cancel)
+        return len(jobs)
+
+    def stats(self):
+        """Queue depth, concurrency and throughput counters."""
+        with self.lock:
+            stats = dict(self.counters)
+            stats["queue_depth"] = self.queue.qsize()
+            stats["running"] = self.running
+            stats["workers"] = len(self.workers)
+        started = stats["completed"] + stats["running"]
+        stats["avg_wait"] = stats.pop("total_wait") / started if started else 0.0
+        return stats
+
+    def shutdown(self):
+        """Stops the workers once the requests already queued have run."""
+        for _ in self.workers:
+            self.queue.put((self.LOW + 1, next(self.sequence), None))
+        for worker in self.workers:
+            worker.join()
@@ -0,0 +1,373 @@
+"""Local HTTP/WebSocket server exposing Jarvis to several clients at once.
+
+    python server.py --port 8765 --workers 4
+
+Endpoints:
+    POST /chat            {"prompt": "...", "session": "abc", "stream": true}
+                          Streams NDJSON lines: {"delta": "..."} while the answer grows
+                          ({"text": "..."} if it was rewritten), then
+                          {"done": true, "response": "...", "session": "abc", "seconds": 1.2}.
+                          With "stream": false, a single JSON object like the last line.
+    GET  /ws              WebSocket; send {"prompt": "...", "session": "abc"}, receive
+                          {"type": "delta" | "text" | "done" | "error", ...} messages.
+    DELETE /sessions/{id} Forget a session's conversation.
+    GET  /health          Liveness, queue state and which backends are available.
+    GET  /metrics         Request, latency, queue and cache counters, plus per-stage
+                          latency histograms; ?format=prometheus for the text format.
+
+Every session has its own conversation history (stored in Memory), Ollama
+context and cache entries; backend connections are shared. At most `workers` answers
+are generated at once and at most `max_queue` requests wait for a worker; past
+that, requests get 503 with Retry-After.
+
+    python server.py --bench   # throughput vs. worker count against stand-in backends
+"""
+
+import startup
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import tempfile
+import time
+import uuid
+from collections import OrderedDict, deque
+import aiohttp
+from aiohttp import web
+from ai_engine import AIEngine
+from async_engine import AsyncAIEngine
+from backends import BackendRegistry
+from memory import Memory
+from telemetry import configure_logging
+
+
+class SessionMemory:
+    """The part of Memory an AIEngine uses, scoped to one server session."""
+
+    def __init__(self, memory, session_id):
+        self.memory = memory
+        self.session_id = session_id
+
+    def store_conversation(self, user_input, ai_response):
+        self.memory.store_session_conversation(self.session_id, user_input, ai_response)
+
+    def get_recent_conversations(self, limit=5):
+        return self.memory.get_session_conversations(self.session_id, limit)
+
+    def flush(self):
+        self.memory.flush()
+
+    def clear_memory(self):
+        self.memory.clear_session(self.session_id)
+
+
+class Session:
+    """One client conversation; its turns are answered one at a time, in order."""
+
+    def __init__(self, session_id, engine):
+        self.session_id = session_id
+        self.engine = engine
+        self.lock = asyncio.Lock()
+        self.last_used = time.monotonic()
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(fraction * len(values)))], 4)
+
+
+class JarvisServer:
+    """aiohttp application serving one AsyncAIEngine to many sessions."""
+
+    def __init__(self, engine, workers=4, max_queue=64, max_sessions=1000, session_ttl=3600):
+        self.engine = engine
+        self.workers = workers
+        self.max_queue = max_queue
+        self.max_sessions = max_sessions
+        self.session_ttl = session_ttl
+        self.worker_slots = asyncio.Semaphore(workers)
+        self.sessions = OrderedDict()  # session id -> Session, least recently used first
+        self.waiting = 0
+        self.running = 0
+        self.started_at = time.time()
+        self.counters = {"requests": 0, "completed": 0, "errors": 0, "rejected": 0, "disconnects": 0}
+        self.latencies = deque(maxlen=2048)
+        self.first_text_latencies = deque(maxlen=2048)
+
+        self.app = web.Application()
+        self.app.router.add_post("/chat", self.chat)
+        self.app.router.add_get("/ws", self.websocket)
+        self.app.router.add_delete("/sessions/{session_id}", self.delete_session)
+        self.app.router.add_get("/health", self.health)
+        self.app.router.add_get("/metrics", self.metrics)
+        self.app.on_cleanup.append(self.close)
+
+    def session(self, session_id=None):
+        """Looks up or creates a session, evicting idle ones past the limits."""
+        session_id = session_id or uuid.uuid4().hex
+        session = self.sessions.get(session_id)
+        if session is None:
+            memory = SessionMemory(self.engine.engine.memory, session_id)
+            session = Session(session_id, self.engine.for_session(memory))
+            self.sessions[session_id] = session
+        self.sessions.move_to_end(session_id)
+        session.last_used = time.monotonic()
+
+        # Dropping a Session only loses its Ollama context; the history stays in Memory
+        idle_before = time.monotonic() - self.session_ttl
+        for old_id, old in list(self.sessions.items()):
+            if len(self.sessions) <= self.max_sessions and old.last_used >= idle_before:
+                break
+            if old is not session and not old.lock.locked():
+                del self.sessions[old_id]
+        return session
+
+    async def answer(self, session, prompt):
+        """Yields the labelled answer so far for one turn of session; the last item is final."""
+        if self.waiting >= self.max_queue:
+            self.counters["rejected"] += 1
+            raise web.HTTPServiceUnavailable(
+                text=json.dumps({"error": "server busy, retry shortly"}),
+                content_type="application/json", headers={"Retry-After": "1"}
+            )
+        self.counters["requests"] += 1
+        started = time.perf_counter()
+        self.waiting += 1
+        queued = True
+        try:
+            async with session.lock, self.worker_slots:
+                self.waiting -= 1
+                queued = False
+                self.running += 1
+                try:
+                    first = True
+                    async with contextlib.aclosing(session.engine.stream_response(prompt)) as updates:
+                        async for text in updates:
+                            if first:
+                                self.first_text_latencies.append(time.perf_counter() - started)
+                                first = False
+                            yield text
+                finally:
+                    self.running -= 1
+        except (ConnectionResetError, asyncio.CancelledError, GeneratorExit):
+            # The client went away; closing the stream cancels the generation
+            self.counters["disconnects"] += 1
+            raise
+        except Exception:
+            self.counters["errors"] += 1
+            raise
+        finally:
+            if queued:
+                self.waiting -= 1
+        self.counters["completed"] += 1
+        self.latencies.append(time.perf_counter() - started)
+
+    async def chat(self, request):
+        try:
+            body = await request.json()
+            prompt = body["prompt"]
+        except (ValueError, KeyError, TypeError):
+            raise web.HTTPBadRequest(text=json.dumps({"error": 'expected JSON with a "prompt"'}),
+                                     content_type="application/json")
+        session = self.session(body.get("session"))
+        started = time.perf_counter()
+
+        if not body.get("stream", True):
+            response = ""
+            async with contextlib.aclosing(self.answer(session, prompt)) as updates:
+                async for response in updates:
+                    pass
+            return web.json_response({"session": session.session_id, "response": response,
+                                      "seconds": round(time.perf_counter() - started, 3)})
+
+        stream = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+        sent = ""
+        try:
+            async with contextlib.aclosing(self.answer(session, prompt)) as updates:
+                async for text in updates:
+                    if not stream.prepared:
+                        # Headers go out with the first text, so a rejected request still gets its 503
+                        await stream.prepare(request)
+                    # Send only what was added; a rewritten answer (stop sequence cut) is resent whole
+                    update = {"delta": text[len(sent):]} if text.startswith(sent) else {"text": text}
+                    await stream.write(json.dumps(update).encode() + b"\n")
+                    sent = text
+            if not stream.prepared:
+                await stream.prepare(request)
+            await stream.write(json.dumps({"done": True, "response": sent, "session": session.session_id,
+                                           "seconds": round(time.perf_counter() - started, 3)}).encode() + b"\n")
+            await stream.write_eof()
+        except ConnectionResetError:
+            pass  # the client hung up; answer() has already cancelled the generation
+        return stream
+
+    async def websocket(self, request):
+        ws = web.WebSocketResponse(heartbeat=30)
+        await ws.prepare(request)
+        default_session = uuid.uuid4().hex
+        async for message in ws:
+            if message.type != aiohttp.WSMsgType.TEXT:
+                continue
+            try:
+                body = json.loads(message.data)
+                prompt = body["prompt"]
+            except (ValueError, KeyError, TypeError):
+                await ws.send_json({"type": "error", "error": 'expected JSON with a "prompt"'})
+                continue
+            session = self.session(body.get("session", default_session))
+            started = time.perf_counter()
+            sent = ""
+            try:
+                async with contextlib.aclosing(self.answer(session, prompt)) as updates:
+                    async for text in updates:
+                        if text.startswith(sent):
+                            await ws.send_json({"type": "delta", "delta": text[len(sent):]})
+                        else:
+                            await ws.send_json({"type": "text", "text": text})
+                        sent = text
+            except web.HTTPServiceUnavailable:
+                await ws.send_json({"type": "error", "error": "server busy, retry shortly", "retry_after": 1})
+                continue
+            await ws.send_json({"type": "done", "response": sent, "session": session.session_id,
+                                "seconds": round(time.perf_counter() - started, 3)})
+        return ws
+
+    async def delete_session(self, request):
+        session_id = request.match_info["session_id"]
+        self.sessions.pop(session_id, None)
+        await asyncio.to_thread(self.engine.engine.memory.clear_session, session_id)
+        return web.json_response({"session": session_id, "cleared": True})
+
+    async def health(self, request):
+        busy = self.waiting >= self.max_queue
+        backends = self.engine.engine.backends
+        return web.json_response({
+            "status": "busy" if busy else "ok", "mode": self.engine.engine.ai_mode,
+            "running": self.running, "waiting": self.waiting, "workers": self.workers,
+            "backends": {name: backends.is_available(provider) for name, provider in backends.providers.items()}
+        }, status=503 if busy else 200)
+
+    async def metrics(self, request):
+        telemetry = self.engine.engine.telemetry
+        if request.query.get("format") == "prometheus":
+            gauges = {"running": self.running, "waiting": self.waiting, "sessions": len(self.sessions),
+                      **{f"{name}_total": value for name, value in self.counters.items()}}
+            lines = [f"jarvis_server_{name} {value}" for name, value in gauges.items()]
+            return web.Response(text=telemetry.prometheus_text() + "\n".join(lines) + "\n",
+                                content_type="text/plain", charset="utf-8")
+        latencies = list(self.latencies)
+        first_text = list(self.first_text_latencies)
+        uptime = time.time() - self.started_at
+        return web.json_response({
+            **self.counters,
+            "running": self.running, "waiting": self.waiting, "workers": self.workers,
+            "max_queue": self.max_queue, "sessions": len(self.sessions),
+            "uptime": round(uptime, 1),
+            "throughput": round(self.counters["completed"] / uptime, 3) if uptime else 0.0,
+            "latency": {"p50": percentile(latencies, 0.5), "p95": percentile(latencies, 0.95),
+                        "p99": percentile(latencies, 0.99)},
+            "first_text_latency": {"p50": percentile(first_text, 0.5), "p95": percentile(first_text, 0.95)},
+            "cache": self.engine.engine.cache.stats(),
+            "semantic_cache": self.engine.engine.semantic_cache.stats() if self.engine.engine.semantic_cache else None,
+            "backends": self.engine.engine.backends.status(),
+            "telemetry": telemetry.snapshot()
+        })
+
+    async def close(self, app=None):
+        self.engine.engine.backends.stop_health_checks()
+        await self.engine.close()
+
+
+def make_engine(db_path="memory.db", mode=None, workers=4):
+    ai_engine = AIEngine(memory=Memory(db_path))
+    if mode:
+        ai_engine.set_ai_mode(mode)
+    # Server history lives in session tables; the desktop user's facts stay private
+    ai_engine.retrieval_top_k = 0
+    return AsyncAIEngine(ai_engine, max_concurrency=workers)
+
+
+async def run_server(args):
+    server = JarvisServer(make_engine(args.db, args.mode, args.workers), args.workers, args.max_queue)
+    startup.mark("engine")
+    server.engine.engine.backends.start_health_checks()
+    if not startup.probing():
+        server.engine.engine.start_warm_up()
+    runner = web.AppRunner(server.app)
+    await runner.setup()
+    await web.TCPSite(runner, args.host, args.port).start()
+    startup.mark("ready")
+    if startup.probing():
+        await runner.cleanup()
+        return
+    print(f"Jarvis server on http://{args.host}:{args.port} ({args.workers} workers)")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+async def load_test(url, clients=32, requests_per_client=4):
+    """Fires requests from concurrent clients, each its own session; returns (requests/sec, latencies)."""
+    latencies = []
+
+    async def client(n, http):
+        for i in range(requests_per_client):
+            started = time.perf_counter()
+            async with http.post(f"{url}/chat", json={"prompt": f"load test client {n} request {i}",
+                                                      "session": f"load-{n}", "stream": False}) as response:
+                await response.read()
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=clients)) as http:
+        await asyncio.gather(*(client(n, http) for n in range(clients)))
+    return len(latencies) / (time.perf_counter() - started), latencies
+
+
+async def bench(worker_counts=(1, 2, 4, 8, 16), clients=32, requests_per_client=4):
+    """Prints how throughput scales with worker count against a stand-in backend."""
+    from fake_backends import FakeBackend, point_engine_at
+
+    backend = FakeBackend(tokens=20, first_token_delay=0.05, token_delay=0.01)
+    backend_url = await backend.start()
+    db_dir = tempfile.mkdtemp()
+    print(f"{clients} clients x {requests_per_client} requests, stand-in answers of ~0.25s")
+    print(f"{'workers':>8} {'req/s':>8} {'p50 s':>8} {'p95 s':>8}")
+    try:
+        for workers in worker_counts:
+            engine = make_engine(os.path.join(db_dir, f"bench-{workers}.db"), "phi3_only", workers)
+            point_engine_at(engine.engine, backend_url)
+            engine.engine.use_cached_answers = False  # every request must reach the backend
+            server = JarvisServer(engine, workers, max_queue=clients * 2)
+            runner = web.AppRunner(server.app)
+            await runner.setup()
+            await web.TCPSite(runner, "127.0.0.1", 0).start()
+            url = f"http://127.0.0.1:{runner.addresses[0][1]}"
+            throughput, latencies = await load_test(url, clients, requests_per_client)
+            print(f"{workers:>8} {throughput:>8.1f} {percentile(latencies, 0.5):>8.3f} "
+                  f"{percentile(latencies, 0.95):>8.3f}")
+            await runner.cleanup()
+            engine.engine.memory.close()
+    finally:
+        await backend.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve Jarvis over HTTP and WebSocket.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--workers", type=int, default=4, help="answers generated at once")
+    parser.add_argument("--max-queue", type=int, default=64, help="requests allowed to wait for a worker")
+    parser.add_argument("--mode", choices=BackendRegistry.from_config().modes())
+    parser.add_argument("--db", default="memory.db")
+    parser.add_argument("--bench", action="store_true", help="measure throughput against stand-in backends")
+    args = parser.parse_args()
+    configure_logging()
+    try:
+        asyncio.run(bench() if args.bench else run_server(args))
+    except KeyboardInterrupt:
+        pass
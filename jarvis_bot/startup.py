@@ -0,0 +1,159 @@
+"""Cold start: the engine is built off the UI thread, and each entry point reports its startup times.
+
+    python startup.py                      # every entry point, 5 launches each
+    python startup.py --entry main_pyqt --runs 10
+    python startup.py --first-answer       # first vs. later answers, with and without warm-up
+
+The windows appear before ai_engine (requests, numpy, memory.db, the caches) is
+even imported: load_engine() builds the AIEngine on a background thread, starts
+the backend health checks and preloads the local model, and hands the engine to
+the window when it is ready. Messages typed before then wait for it.
+
+Entry points call mark() at "window" (first paint), "engine" (engine built) and
+"ready" (accepting work). The times land in the jarvis_startup_seconds histogram;
+with JARVIS_STARTUP_PROBE set to the launch time (what this script does) they are
+printed as "startup <event> <seconds>" and the process exits once it is ready.
+"""
+
+import argparse
+import logging
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from telemetry import telemetry
+
+log = logging.getLogger("jarvis.startup")
+
+IMPORTED_AT = time.perf_counter()  # entry points import this module first
+LAUNCHED_AT = float(os.getenv("JARVIS_STARTUP_PROBE") or 0) or None
+
+# Entry point -> extra arguments for a startup probe
+ENTRY_POINTS = {
+    "main": [],
+    "main_pyqt": [],
+    "server": ["--port", "0"],
+    "batch": ["-", "-o", os.devnull],
+}
+
+
+def probing():
+    """Whether this process was launched by the startup benchmark and should exit once ready."""
+    return LAUNCHED_AT is not None
+
+
+def mark(event):
+    """Records the time from launch to event; returns the seconds."""
+    if probing():
+        seconds = time.time() - LAUNCHED_AT  # includes interpreter start-up
+        print(f"startup {event} {seconds:.4f}", flush=True)
+    else:
+        seconds = time.perf_counter() - IMPORTED_AT
+    telemetry.observe("startup_seconds", seconds, event=event)
+    log.info("Startup: %s after %.3fs", event, seconds)
+    return seconds
+
+
+def load_engine(on_ready, on_error=None, preload=(), warm_up=True):
+    """Builds an AIEngine on a background thread and calls on_ready(engine) there.
+
+    Modules in preload are imported on that thread too, so importing them later on
+    the UI thread is free. on_error(exception) is called if the engine cannot be built.
+    """
+    def run():
+        try:
+            from ai_engine import AIEngine
+            for module in preload:
+                __import__(module)
+            engine = AIEngine()
+        except Exception as e:
+            log.exception("Could not start the engine")
+            if on_error:
+                on_error(e)
+            return
+        mark("engine")
+        engine.backends.start_health_checks()
+        if warm_up and not probing():
+            engine.start_warm_up()
+        on_ready(engine)
+
+    thread = threading.Thread(target=run, name="engine-startup", daemon=True)
+    thread.start()
+    return thread
+
+
+def probe(entry, timeout=60):
+    """Launches entry point entry once and returns {event: seconds since launch}."""
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), f"{entry}.py")
+    env = dict(os.environ, JARVIS_STARTUP_PROBE=repr(time.time()))
+    # A fresh directory, so memory.db is created from nothing as on a first launch
+    result = subprocess.run([sys.executable, script] + ENTRY_POINTS[entry], env=env, cwd=tempfile.mkdtemp(),
+                            stdin=subprocess.DEVNULL, capture_output=True, text=True, timeout=timeout)
+    events = {}
+    for line in result.stdout.splitlines():
+        parts = line.split()
+        if len(parts) == 3 and parts[0] == "startup":
+            events[parts[1]] = float(parts[2])
+    if not events:
+        raise RuntimeError(f"{entry} reported nothing:\n{result.stderr[-2000:]}")
+    return events
+
+
+def bench_entry_points(entries, runs=5):
+    print(f"Seconds from launch, median of {runs} launches")
+    print(f"{'entry point':<12} {'window':>8} {'engine':>8} {'ready':>8}")
+    for entry in entries:
+        try:
+            launches = [probe(entry) for _ in range(runs)]
+        except (RuntimeError, subprocess.TimeoutExpired) as e:
+            print(f"{entry:<12} failed: {str(e).strip().splitlines()[-1]}")
+            continue
+        median = lambda event: (f"{statistics.median(l[event] for l in launches):>8.3f}"
+                                if all(event in l for l in launches) else f"{'-':>8}")
+        print(f"{entry:<12} {median('window')} {median('engine')} {median('ready')}")
+
+
+def bench_first_answer(load_delay=2.0, answers=3):
+    """Answer latencies against a stand-in Ollama that takes load_delay to load its model."""
+    from ai_engine import AIEngine
+    from fake_backends import FakeBackend, start_in_thread, point_engine_at
+    from memory import Memory
+
+    print(f"Stand-in Ollama with a {load_delay}s model load; seconds per answer")
+    for warm_up in (False, True):
+        backend = FakeBackend(tokens=20, first_token_delay=0.05, token_delay=0.01, load_delay=load_delay)
+        url, stop = start_in_thread(backend)
+        engine = AIEngine(memory=Memory(os.path.join(tempfile.mkdtemp(), "startup.db")))
+        point_engine_at(engine, url, url)
+        engine.set_ai_mode("phi3_only")
+        engine.use_cached_answers = False
+        if warm_up:
+            engine.start_warm_up()
+            time.sleep(load_delay + 0.5)  # the user reading the window before typing
+        latencies = []
+        for n in range(answers):
+            started = time.perf_counter()
+            engine.get_response(f"question {n}", lambda text: None)
+            latencies.append(time.perf_counter() - started)
+        print(f"  {'with' if warm_up else 'without':<8} warm-up: " + "  ".join(f"{s:.3f}" for s in latencies))
+        engine.memory.close()
+        stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure how fast each entry point starts.")
+    parser.add_argument("--entry", nargs="+", choices=list(ENTRY_POINTS), default=list(ENTRY_POINTS))
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--first-answer", action="store_true", help="time answers around the model warm-up")
+    args = parser.parse_args(argv)
+    if args.first_answer:
+        bench_first_answer()
+    else:
+        bench_entry_points(args.entry, args.runs)
+
+
+if __name__ == "__main__":
+    main()
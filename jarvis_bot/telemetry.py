@@ -0,0 +1,240 @@
+"""Per-stage latency tracing, counters and leveled logging for Jarvis.
+
+    JARVIS_LOG_LEVEL=DEBUG python main.py         # engine chatter on stderr
+    JARVIS_TRACE_FILE=traces.jsonl python main.py # one JSON line of stage timings per request
+
+Stages: cache_lookup, routing, prompt_build, <backend>_connect, <backend>_first_token,
+<backend>_complete, post_process, memory_write and ui_delivery. The server exports
+everything at /metrics (JSON) and /metrics?format=prometheus.
+"""
+
+import bisect
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Bucket upper bounds in seconds, from a cache lookup up to a long generation
+LATENCY_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+STAGE_NAMES = {
+    "cache_lookup": "cache", "routing": "route", "prompt_build": "prompt",
+    "phi3_connect": "phi3 connect", "phi3_first_token": "phi3 first token", "phi3_complete": "phi3 done",
+    "openai_connect": "openai connect", "openai_first_token": "openai first token",
+    "openai_complete": "openai done", "post_process": "post", "memory_write": "memory",
+    "ui_delivery": "ui"
+}
+
+
+def configure_logging(level=None):
+    """Sets up the "jarvis" loggers; the level comes from JARVIS_LOG_LEVEL (default WARNING).
+
+    Below the configured level a log call returns after one integer comparison and
+    never formats its message, so debug logging costs nothing when it is off.
+    """
+    level = level or os.getenv("JARVIS_LOG_LEVEL", "WARNING")
+    logging.basicConfig(format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    logging.getLogger("jarvis").setLevel(level.upper() if isinstance(level, str) else level)
+
+
+class Histogram:
+    """Fixed-bucket latency histogram (Prometheus style)."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last slot is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-th quantile (None if empty)."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+
+class Trace:
+    """Stage timings of one request, in the order the stages finished."""
+
+    def __init__(self, label=""):
+        self.label = label
+        self.started = time.perf_counter()
+        self.finished = None
+        self.stages = []  # (stage, seconds)
+        self.lock = threading.Lock()  # hedged requests time both backends at once
+
+    def add(self, stage, seconds):
+        with self.lock:
+            self.stages.append((stage, seconds))
+
+    def total(self):
+        return (self.finished or time.perf_counter()) - self.started
+
+    def as_dict(self):
+        stages = {}
+        with self.lock:
+            for stage, seconds in self.stages:
+                stages[stage] = round(stages.get(stage, 0.0) + seconds, 6)
+        return {"label": self.label, "total": round(self.total(), 6), "stages": stages}
+
+    def summary(self):
+        """One-line breakdown for display, e.g. "cache 0.1ms · phi3 first token 310ms · ..."."""
+        parts = []
+        for stage, seconds in self.as_dict()["stages"].items():
+            if stage.endswith("_complete") or seconds >= 0.0005:
+                parts.append(f"{STAGE_NAMES.get(stage, stage)} {seconds * 1000:.0f}ms")
+            else:
+                parts.append(f"{STAGE_NAMES.get(stage, stage)} {seconds * 1000:.2f}ms")
+        return " · ".join(parts)
+
+
+current_trace = contextvars.ContextVar("jarvis_trace", default=None)
+
+
+class Telemetry:
+    """Process-wide counters, latency histograms and per-request traces.
+
+    Stages are timed with span() (or stage() for intervals measured by hand); each
+    lands in the jarvis_stage_seconds histogram and in the trace of the request
+    being served, which follows the request through contextvars. Finished traces
+    are appended to JARVIS_TRACE_FILE as JSON lines when that is set; everything
+    else is exported with prometheus_text() or snapshot().
+    """
+
+    def __init__(self, trace_path=None):
+        self.enabled = True
+        self.trace_path = trace_path or os.getenv("JARVIS_TRACE_FILE")
+        self.counters = {}  # (name, labels) -> value
+        self.histograms = {}  # (name, labels) -> Histogram
+        self.lock = threading.Lock()
+
+    def count(self, name, value=1, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    def stage(self, stage, seconds, trace=None):
+        """Records a finished stage of the current request (or of trace, e.g. from the UI thread)."""
+        if not self.enabled:
+            return
+        self.observe("stage_seconds", seconds, stage=stage)
+        trace = trace or current_trace.get()
+        if trace is not None:
+            trace.add(stage, seconds)
+
+    @contextmanager
+    def span(self, stage):
+        """Times the block as stage."""
+        if not self.enabled:
+            yield
+            return
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stage(stage, time.perf_counter() - started)
+
+    @contextmanager
+    def trace(self, label=""):
+        """Collects the stages timed inside the block into one Trace.
+
+        Nested calls join the trace already in progress, so a request traced by the
+        scheduler is not split again by get_response.
+        """
+        trace = current_trace.get()
+        if trace is not None:
+            yield trace
+            return
+        trace = Trace(label)
+        token = current_trace.set(trace)
+        try:
+            yield trace
+        finally:
+            current_trace.reset(token)
+            self.finish(trace)
+
+    def finish(self, trace):
+        trace.finished = time.perf_counter()
+        if not self.enabled:
+            return
+        self.observe("request_seconds", trace.total())
+        if self.trace_path:
+            line = json.dumps({"time": time.time(), **trace.as_dict()})
+            with self.lock, open(self.trace_path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+    def snapshot(self):
+        """Counters and histogram summaries as a JSON-friendly dict."""
+        def name_of(name, labels):
+            return name + ("{" + ",".join(f"{k}={v}" for k, v in labels) + "}" if labels else "")
+
+        with self.lock:
+            counters = {name_of(*key): value for key, value in self.counters.items()}
+            histograms = {
+                name_of(*key): {"count": h.count, "sum": round(h.sum, 6), "p50": h.quantile(0.5),
+                                "p95": h.quantile(0.95), "p99": h.quantile(0.99)}
+                for key, h in self.histograms.items()
+            }
+        return {"counters": counters, "histograms": histograms}
+
+    def prometheus_text(self):
+        """Everything in the Prometheus text exposition format."""
+        def labels_text(labels, extra=()):
+            pairs = [f'{k}="{v}"' for k, v in tuple(labels) + tuple(extra)]
+            return "{" + ",".join(pairs) + "}" if pairs else ""
+
+        lines = []
+        with self.lock:
+            for name in sorted({name for name, _ in self.counters}):
+                lines.append(f"# TYPE jarvis_{name}_total counter")
+                for (key_name, labels), value in sorted(self.counters.items()):
+                    if key_name == name:
+                        lines.append(f"jarvis_{name}_total{labels_text(labels)} {value}")
+            for name in sorted({name for name, _ in self.histograms}):
+                lines.append(f"# TYPE jarvis_{name} histogram")
+                for (key_name, labels), h in sorted(self.histograms.items(), key=lambda item: item[0]):
+                    if key_name != name:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(h.buckets + (float("inf"),), h.counts):
+                        cumulative += count
+                        le = "+Inf" if bound == float("inf") else repr(bound)
+                        lines.append(f"jarvis_{name}_bucket{labels_text(labels, (('le', le),))} {cumulative}")
+                    lines.append(f"jarvis_{name}_sum{labels_text(labels)} {h.sum}")
+                    lines.append(f"jarvis_{name}_count{labels_text(labels)} {h.count}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self.lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+
+telemetry = Telemetry()
@@ -0,0 +1,37 @@
+import os
+import sys
+
+import pytest
+
+# The modules live flat in jarvis_bot/ and import each other by name
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_backends import FakeBackend, start_in_thread, point_engine_at  # noqa: E402
+from memory import Memory  # noqa: E402
+
+
+@pytest.fixture
+def memory(tmp_path):
+    memory = Memory(str(tmp_path / "memory.db"))
+    yield memory
+    memory.close()
+
+
+@pytest.fixture
+def backend():
+    """A stand-in Ollama/OpenAI server on a free port; backend.url is its base URL."""
+    backend = FakeBackend(tokens=20, first_token_delay=0.01, token_delay=0.002)
+    _, stop = start_in_thread(backend)
+    yield backend
+    stop()
+
+
+@pytest.fixture
+def engine(memory, backend):
+    """An AIEngine answering from the stand-in backend in <local>_only mode."""
+    from ai_engine import AIEngine
+    engine = AIEngine(memory=memory)
+    point_engine_at(engine, backend.url)
+    engine.set_ai_mode(f"{engine.backends.local.name}_only")
+    yield engine
+    engine.scheduler.shutdown()
@@ -0,0 +1,161 @@
+import os
+import threading
+import time
+
+from memory import Memory
+
+
+def test_stop_is_not_undone_by_the_next_request(engine, backend):
+    engine.use_cached_answers = False
+    lookup_cached = engine.lookup_cached
+    reached, resume = threading.Event(), threading.Event()
+
+    def held_lookup(user_input, backend):
+        # Holds the first call just before it reaches the backend
+        if user_input == "first question":
+            reached.set()
+            resume.wait(5)
+        return lookup_cached(user_input, backend)
+
+    engine.lookup_cached = held_lookup
+    results = {}
+    first = threading.Thread(target=lambda: results.setdefault(
+        "first", engine.get_response("first question", lambda text: None)))
+    first.start()
+    assert reached.wait(5)
+    engine.stop_response()
+    # A request started after the stop must not revive the stopped one
+    results["second"] = engine.get_response("second question", lambda text: None)
+    resume.set()
+    first.join(5)
+
+    assert results["first"].endswith("[stopped]")
+    assert results["second"].endswith("word19")
+
+
+def test_answers_shaped_by_context_are_not_cached(engine, backend):
+    engine.get_response("what did I just say?", lambda text: None)
+    engine.get_response("what did I just say?", lambda text: None)
+
+    assert backend.counters["requests"] == 2
+    assert len(engine.cache) == 0
+
+
+def test_questions_sent_without_context_are_cached_under_default_settings(engine, backend):
+    # OpenAI requests carry the question alone, whatever the history settings
+    engine.set_ai_mode(f"{engine.backends.remote.name}_only")
+    first = engine.get_response("what is the boiling point of water?", lambda text: None)
+    second = engine.get_response("what is the boiling point of water?", lambda text: None)
+
+    assert engine.context_history_turns and engine.retrieval_top_k
+    assert backend.counters["requests"] == 1
+    assert second == first
+
+
+def test_hybrid_caches_remote_answers_but_not_local_ones(engine, backend):
+    engine.set_ai_mode("hybrid")
+    for _ in range(2):
+        engine.get_response("who won the world cup final?", lambda text: None)
+        engine.get_response("tell me about my day", lambda text: None)
+
+    # The factual question goes to the remote once; the local one carries history every time
+    assert backend.counters["requests"] == 3
+    assert len(engine.cache) == 1
+
+
+def test_context_free_answers_are_cached(engine, backend):
+    engine.context_history_turns = 0
+    engine.retrieval_top_k = 0
+    first = engine.get_response("what is the boiling point of water?", lambda text: None)
+    second = engine.get_response("what is the boiling point of water?", lambda text: None)
+
+    assert backend.counters["requests"] == 1
+    assert second == first
+
+
+def test_building_an_engine_opens_nothing(tmp_path):
+    from ai_engine import AIEngine
+    engine = AIEngine(memory=Memory(str(tmp_path / "memory.db")))
+    try:
+        # No database, cache connection, writer thread, vector index or router model yet
+        assert os.listdir(tmp_path) == []
+        assert engine.memory.writer.thread is None and engine.cache.conn is None
+        assert engine.retriever.index is None and engine.router.classifier_path is not None
+    finally:
+        engine.scheduler.shutdown()
+        engine.memory.close()
+
+
+def test_partial_text_streams_to_the_callback(engine, backend):
+    engine.use_cached_answers = False
+    updates = []
+    answer = engine.get_response("tell me something", updates.append)
+
+    label = f"({engine.backends.local.label}) "
+    # One growing update per token, each carrying the backend label, then the final answer
+    assert len(updates) > backend.tokens
+    assert updates[0] == f"{label}Answer"
+    assert all(later.startswith(earlier) for earlier, later in zip(updates, updates[1:-1]))
+    assert updates[-1] == answer == f"{label}Answer" + "".join(f" word{n}" for n in range(1, backend.tokens))
+
+
+def test_streaming_off_sends_only_the_final_answer(engine, backend):
+    engine.use_cached_answers = False
+    engine.stream_responses = False
+    updates = []
+    answer = engine.get_response("tell me something", updates.append)
+
+    assert updates == [answer]
+
+
+def test_answers_that_start_with_error_are_still_answers(engine, backend, monkeypatch):
+    engine.context_history_turns = 0
+    engine.retrieval_top_k = 0
+    monkeypatch.setattr(backend, "words", lambda: ["Error", " handling", " in", " Python"])
+    first = engine.get_response("how does error handling work?", lambda text: None)
+    second = engine.get_response("how does error handling work?", lambda text: None)
+
+    assert first.endswith("Error handling in Python") and second == first
+    assert backend.counters["requests"] == 1
+    assert list(engine.backends.local.outcomes) == [True]
+
+
+def test_stop_sequences_are_found_across_chunk_boundaries(engine):
+    stops = ["\nUser:", "<|end|>"]
+    text = ""
+    found = []
+    for chunk in ["Sure.", "\nUs", "er", ": next"]:
+        text += chunk
+        found.append(engine.find_stop_sequence(text, stops, len(chunk)))
+
+    # Only the chunk completing "\nUser:" finds it, at the index where it starts
+    assert found == [-1, -1, -1, len("Sure.")]
+    # Text before the newest chunk's reach was checked on earlier chunks and is not searched again
+    assert engine.find_stop_sequence("a<|end|> and \nUser:", stops, 3) == len("a<|end|> and ")
+
+
+def test_a_stop_sequence_split_across_tokens_ends_the_stream(engine, backend, monkeypatch):
+    engine.use_cached_answers = False
+    filler = [f" word{n}" for n in range(200)]
+    monkeypatch.setattr(backend, "words", lambda: ["Sure", ", done.", "\nUs", "er:", " and then"] + filler)
+    updates = []
+    answer = engine.get_response("say something", updates.append)
+
+    assert answer == f"({engine.backends.local.label}) Sure, done."
+    assert not any("User" in update for update in updates)
+    # The rest of the generation is abandoned rather than read to the end
+    deadline = time.monotonic() + 5
+    while not backend.counters["disconnects"] and time.monotonic() < deadline:
+        time.sleep(0.02)
+    assert backend.counters["disconnects"] == 1
+
+
+def test_failed_calls_are_flagged_and_not_cached(engine):
+    engine.context_history_turns = 0
+    engine.retrieval_top_k = 0
+    engine.backends.local.url = "http://127.0.0.1:9/api/generate"  # nothing listens on the discard port
+    answer = engine.get_response("hello?", lambda text: None)
+
+    assert engine.is_error_response(answer)
+    assert list(engine.backends.local.outcomes) == [False]
+    assert len(engine.cache) == 0
@@ -0,0 +1,70 @@
+import asyncio
+import threading
+
+import pytest
+
+from async_engine import AsyncAIEngine
+
+
+def test_cache_and_post_processing_run_off_the_event_loop(engine, backend):
+    engine.context_history_turns = 0
+    engine.retrieval_top_k = 0
+    threads = {}
+    for name in ("lookup_cached", "finish_response"):
+        def recorded(*args, method=getattr(engine, name), name=name, **kwargs):
+            threads[name] = threading.current_thread()
+            return method(*args, **kwargs)
+        setattr(engine, name, recorded)
+
+    async def run():
+        async_engine = AsyncAIEngine(engine)
+        try:
+            return await async_engine.get_response("hello there")
+        finally:
+            await async_engine.close()
+
+    assert asyncio.run(run()).endswith("word19")
+    assert threads["lookup_cached"] is not threading.main_thread()
+    assert threads["finish_response"] is not threading.main_thread()
+
+
+def test_hedged_winner_failure_is_raised(engine):
+    engine.backends.remote.api_key = "test-key"
+    local = engine.backends.local
+
+    async def ask_backend(provider, user_input, on_partial=None):
+        if provider is local:
+            on_partial("Partial")
+            raise RuntimeError("stream broke")
+        await asyncio.sleep(5)
+        return "too late"
+
+    async def run():
+        async_engine = AsyncAIEngine(engine)
+        async_engine.ask_backend = ask_backend
+        try:
+            await async_engine.hedged_response("hello there")
+        finally:
+            await async_engine.close()
+
+    with pytest.raises(RuntimeError, match="stream broke"):
+        asyncio.run(run())
+
+
+@pytest.mark.parametrize("mode", ["local", "remote"])
+def test_both_protocols_cut_at_a_stop_sequence_split_across_tokens(engine, backend, monkeypatch, mode):
+    engine.use_cached_answers = False
+    provider = getattr(engine.backends, mode)
+    engine.set_ai_mode(f"{provider.name}_only")
+    monkeypatch.setattr(backend, "words", lambda: ["Sure", ", done.", "\nUs", "er:", " and then"])
+
+    async def run():
+        async_engine = AsyncAIEngine(engine)
+        try:
+            return await async_engine.get_response("say something")
+        finally:
+            await async_engine.close()
+
+    # Same answer as the sync engine gives, since both feed the body to the same stream parser
+    assert asyncio.run(run()) == f"({provider.label}) Sure, done."
+    assert engine.get_response("say something", lambda text: None) == f"({provider.label}) Sure, done."
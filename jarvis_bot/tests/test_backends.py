@@ -0,0 +1,81 @@
+import json
+
+import pytest
+import requests
+
+from backends import BackendBusyError, BackendClient, BackendRegistry, Provider
+from context import strip_label
+
+
+def generate(client, backend, prompt="hello"):
+    """One streamed generate call read to the end; returns the answer text."""
+    response = client.post(f"{backend.url}/api/generate", json={"model": "phi3", "prompt": prompt})
+    try:
+        response.raise_for_status()
+        return "".join(json.loads(line).get("response", "") for line in response.iter_lines() if line)
+    finally:
+        client.release(response)
+
+
+def test_connections_are_reused(backend):
+    client = BackendClient("phi3")
+    answers = [generate(client, backend) for _ in range(5)]
+    assert answers[0].startswith("Answer") and len(set(answers)) == 1
+    assert len(backend.client_ports) == 1
+    client.close()
+
+
+def test_read_timeout(backend):
+    backend.first_token_delay = 1.0
+    client = BackendClient("phi3", read_timeout=0.2)
+    with pytest.raises(requests.exceptions.RequestException):
+        generate(client, backend)
+    client.close()
+
+
+def test_overload_is_retried(backend):
+    backend.fail_next = 2
+    client = BackendClient("phi3", backoff_factor=0.01)
+    assert generate(client, backend).startswith("Answer")
+    assert backend.counters["requests"] == 1 and backend.fail_next == 0
+    client.close()
+
+
+def test_concurrency_limit(backend):
+    client = BackendClient("phi3", max_concurrency=1, queue_timeout=0.1)
+    held = client.post(f"{backend.url}/api/generate", json={"model": "phi3", "prompt": "hello"})
+    with pytest.raises(BackendBusyError):
+        client.post(f"{backend.url}/api/generate", json={"model": "phi3", "prompt": "hello"})
+    client.release(held)
+    assert generate(client, backend).startswith("Answer")
+    client.close()
+
+
+def make_registry():
+    return BackendRegistry([
+        Provider("phi3", "ollama", "http://localhost:11434/api/generate", "phi3", label="Phi-3"),
+        Provider("llama", "ollama", "http://localhost:11435/api/generate", "llama3", label="Llama"),
+        Provider("mistral", "ollama", "http://localhost:11436/api/generate", "mistral", label="Mistral"),
+        Provider("openai", "openai", "https://api.openai.com/v1/chat/completions", "gpt-4o",
+                 label="OpenAI", api_key="test-key"),
+    ])
+
+
+def test_only_modes_fail_over_within_the_same_kind():
+    registry = make_registry()
+    names = [p.name for p in registry.candidates("phi3", same_kind=True)]
+    assert names[0] == "phi3" and "openai" not in names
+    assert [p.name for p in registry.candidates("phi3")][-1] == "openai"
+
+
+def test_untimed_providers_are_tried_after_timed_ones():
+    registry = make_registry()
+    registry.get("mistral").record_latency(0.8)
+    assert [p.name for p in registry.candidates("phi3")] == ["phi3", "mistral", "llama", "openai"]
+
+
+def test_strip_label_covers_every_configured_provider():
+    labels = make_registry().labels()
+    assert strip_label("(Llama) Hi there", labels) == "Hi there"
+    assert strip_label("(OpenAI) Hi there", labels) == "Hi there"
+    assert strip_label("(Someone) Hi there", labels) == "(Someone) Hi there"
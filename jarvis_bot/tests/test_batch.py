@@ -0,0 +1,97 @@
+import asyncio
+import json
+
+from ai_engine import ErrorResponse
+from batch import BatchRunner, Checkpoint
+
+
+class StandInEngine:
+    """Answers prompts like an AsyncAIEngine over engine would, each after its own delay."""
+
+    def __init__(self, engine, delays=None, hold=None):
+        self.engine = engine
+        self.delays = delays or {}
+        self.hold = hold
+        self.asked = []
+
+    async def get_response(self, prompt):
+        self.asked.append(prompt)
+        if prompt == self.hold:
+            await asyncio.Event().wait()
+        await asyncio.sleep(self.delays.get(prompt, 0.0))
+        if prompt == "bad":
+            return ErrorResponse("Error: no answer")
+        return f"answer to {prompt}"
+
+
+def lines(*prompts):
+    return [json.dumps(prompt) + "\n" for prompt in prompts]
+
+
+def run(runner, input_lines):
+    asyncio.run(runner.run(iter(input_lines)))
+
+
+def written(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def test_ordered_mode_writes_in_input_order(tmp_path, engine):
+    # The first prompt is the slowest, so every later one finishes before it
+    stand_in = StandInEngine(engine, delays={"p0": 0.2, "p1": 0.1})
+    output_path = tmp_path / "out.jsonl"
+    with open(output_path, "w", encoding="utf-8") as output:
+        runner = BatchRunner(stand_in, output, Checkpoint(str(tmp_path / "out.progress")), concurrency=4)
+        run(runner, lines("p0", "p1", "bad", "p3"))
+
+    results = written(output_path)
+    assert [result["prompt"] for result in results] == ["p0", "p1", "bad", "p3"]
+    assert [result["error"] for result in results] == [False, False, True, False]
+    assert runner.counters == {"answered": 3, "errors": 1, "skipped": 0}
+
+
+def test_as_completed_mode_writes_in_finishing_order(tmp_path, engine):
+    stand_in = StandInEngine(engine, delays={"p0": 0.2, "p1": 0.1})
+    output_path = tmp_path / "out.jsonl"
+    with open(output_path, "w", encoding="utf-8") as output:
+        runner = BatchRunner(stand_in, output, Checkpoint(str(tmp_path / "out.progress")), concurrency=4, ordered=False)
+        run(runner, lines("p0", "p1", "p2"))
+
+    assert [result["prompt"] for result in written(output_path)] == ["p2", "p1", "p0"]
+
+
+def test_an_interrupted_run_resumes_after_the_last_written_line(tmp_path, engine):
+    output_path = tmp_path / "out.jsonl"
+    checkpoint_path = str(tmp_path / "out.progress")
+    prompts = lines("p0", "p1", "p2", "p3", "p4", "p5")
+
+    # p3 never finishes; p4 finishes but is held back behind it, so the run is
+    # stopped with p0-p2 written and p4 answered but not yet written
+    async def interrupted():
+        with open(output_path, "w", encoding="utf-8") as output:
+            runner = BatchRunner(StandInEngine(engine, hold="p3"), output, Checkpoint(checkpoint_path), concurrency=2)
+            task = asyncio.ensure_future(runner.run(iter(prompts)))
+            while runner.next_line < 3:
+                await asyncio.sleep(0.01)
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+    asyncio.run(interrupted())
+    checkpoint = Checkpoint(checkpoint_path)
+    assert checkpoint.state["next_line"] == 3
+
+    # Resumed as run_batch does: cut the output back to the checkpoint, then skip what is done
+    stand_in = StandInEngine(engine)
+    with open(output_path, "r+", encoding="utf-8") as output:
+        output.seek(checkpoint.state["output_bytes"])
+        output.truncate()
+        runner = BatchRunner(stand_in, output, checkpoint, concurrency=2)
+        run(runner, prompts)
+
+    assert stand_in.asked == ["p3", "p4", "p5"]
+    assert runner.counters["skipped"] == 3
+    assert [result["prompt"] for result in written(output_path)] == ["p0", "p1", "p2", "p3", "p4", "p5"]
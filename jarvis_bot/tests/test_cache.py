@@ -0,0 +1,97 @@
+import time
+
+import numpy as np
+
+from cache import SemanticCache
+
+
+class StubEmbedder:
+    """Fixed unit vectors per prompt, so each test sets the similarity it needs."""
+
+    def __init__(self, vectors):
+        self.vectors = {prompt: np.asarray(vector, dtype=np.float32) / np.linalg.norm(vector)
+                        for prompt, vector in vectors.items()}
+        self.calls = 0
+
+    def embed(self, text):
+        self.calls += 1
+        return self.vectors[text]
+
+
+class BrokenEmbedder:
+    def embed(self, text):
+        raise ConnectionError("embedding model is down")
+
+
+def test_close_prompt_is_a_hit_and_distant_one_a_miss():
+    embedder = StubEmbedder({"what can you do": [1, 0], "what can you help with": [0.95, 0.05],
+                             "what is the weather": [0.5, 0.5]})
+    cache = SemanticCache(embedder, threshold=0.9)
+    cache.put("mode", "what can you do", "Lots")
+
+    assert cache.get("mode", "what can you help with") == "Lots"
+    assert cache.get("mode", "what is the weather") is None
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+
+def test_namespaces_are_kept_apart():
+    cache = SemanticCache(StubEmbedder({"hello": [1, 0]}))
+    cache.put("phi3_only", "hello", "Hi from Phi-3")
+
+    assert cache.get("openai_only", "hello") is None
+    assert cache.get("phi3_only", "hello") == "Hi from Phi-3"
+
+
+def test_expired_entries_are_not_served():
+    cache = SemanticCache(StubEmbedder({"hello": [1, 0]}))
+    cache.put("mode", "hello", "Hi", ttl=0.01)
+    time.sleep(0.02)
+
+    assert cache.get("mode", "hello") is None
+
+
+def test_full_cache_replaces_least_recently_used():
+    embedder = StubEmbedder({"a": [1, 0, 0], "b": [0, 1, 0], "c": [0, 0, 1]})
+    cache = SemanticCache(embedder, max_entries=2)
+    cache.put("mode", "a", "A")
+    cache.put("mode", "b", "B")
+    cache.get("mode", "a")
+    cache.put("mode", "c", "C")
+
+    assert cache.get("mode", "a") == "A"
+    assert cache.get("mode", "b") is None
+    assert cache.get("mode", "c") == "C"
+    assert cache.stats()["evictions"] == 1
+
+
+def test_embedding_errors_are_misses():
+    cache = SemanticCache(BrokenEmbedder())
+    cache.put("mode", "hello", "Hi")
+
+    assert cache.get("mode", "hello") is None
+    assert cache.stats()["size"] == 0
+
+
+def test_engine_has_no_semantic_tier_by_default(engine):
+    assert engine.semantic_cache is None
+
+
+def test_semantic_tier_tells_reversed_prompts_apart(engine, backend):
+    engine.use_semantic_cache()
+    engine.context_history_turns = 0
+    engine.retrieval_top_k = 0
+    engine.get_response("convert 10 km to miles", lambda text: None)
+    engine.get_response("convert 10 miles to km", lambda text: None)
+
+    assert backend.counters["requests"] == 2
+    assert engine.semantic_cache.stats()["size"] == 2
+    # Embedding calls have their own connection slots, apart from the generations'
+    assert engine.semantic_cache.embedder.client is not engine.backends.local.client
+
+
+def test_time_sensitive_questions_skip_the_semantic_tier(engine, backend):
+    engine.use_semantic_cache()
+    embedder = engine.semantic_cache.embedder = StubEmbedder({"latest news": [1, 0]})
+    engine.get_response("latest news", lambda text: None)
+
+    assert embedder.calls == 0
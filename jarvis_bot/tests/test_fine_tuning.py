@@ -0,0 +1,75 @@
+import json
+
+import numpy as np
+import pytest
+
+from fine_tuning import ANSWER_TEMPLATE, PROMPT_TEMPLATE, ByteTokenizer, PackedDataset, prepare
+
+RECORDS = [{"input": f"question {n}?", "output": "answer " * (n % 7) + f"number {n}"} for n in range(30)]
+
+
+@pytest.fixture
+def source(tmp_path):
+    path = tmp_path / "training_data.jsonl"
+    with open(path, "w", encoding="utf-8") as f:
+        for record in RECORDS:
+            f.write(json.dumps(record) + "\n")
+        f.write("\n")  # blank lines are skipped
+    return str(path)
+
+
+def expected_examples():
+    """(tokens, mask) of every record as prepare() should lay them out."""
+    tokenizer = ByteTokenizer()
+    examples = []
+    for record in RECORDS:
+        prompt = tokenizer.encode(PROMPT_TEMPLATE.format(input=record["input"]))
+        answer = tokenizer.encode(ANSWER_TEMPLATE.format(output=record["output"])) + [tokenizer.eos_id]
+        examples.append((prompt + answer, [0] * len(prompt) + [1] * len(answer)))
+    return examples
+
+
+def test_shards_hold_every_example_back_to_back(source, tmp_path):
+    directory = str(tmp_path / "dataset")
+    # Small rows and shards, so examples run across row and shard boundaries
+    index = prepare(source, directory, seq_len=64, rows_per_shard=3, workers=1, batch_size=4)
+    dataset = PackedDataset(directory)
+    examples = expected_examples()
+    tokens = np.concatenate([dataset[row][0] for row in range(len(dataset))])
+    mask = np.concatenate([dataset[row][1] for row in range(len(dataset))])
+    lengths = [len(example_tokens) for example_tokens, _ in examples]
+
+    assert len(index["shards"]) > 1 and index["examples"] == len(RECORDS)
+    assert index["tokens"] == sum(lengths) and len(dataset) == -(-sum(lengths) // 64)
+    assert tokens[:sum(lengths)].tolist() == [token for example, _ in examples for token in example]
+    assert mask[:sum(lengths)].tolist() == [flag for _, example_mask in examples for flag in example_mask]
+    assert index["answer_tokens"] == int(mask.sum())
+    # Only the tail of the last row is padding, never part of the loss
+    assert set(tokens[sum(lengths):].tolist()) <= {index["pad_id"]} and not mask[sum(lengths):].any()
+
+    # Example starts, per row, line up with where each example begins in the stream
+    starts = np.cumsum([0] + lengths[:-1])
+    for row in range(len(dataset)):
+        inside = starts[(starts >= row * 64) & (starts < (row + 1) * 64)] - row * 64
+        assert dataset.example_starts(row).tolist() == inside.tolist()
+    assert ByteTokenizer().decode(tokens[:lengths[0]]).startswith("<|user|>\nquestion 0?<|end|>")
+
+
+def test_an_up_to_date_dataset_is_reused(source, tmp_path):
+    directory = str(tmp_path / "dataset")
+    first = prepare(source, directory, seq_len=64, rows_per_shard=3, workers=1)
+
+    assert prepare(source, directory, seq_len=64, rows_per_shard=3, workers=1) == first
+    rebuilt = prepare(source, directory, seq_len=128, rows_per_shard=3, workers=1)
+    assert rebuilt["settings"]["seq_len"] == 128 and rebuilt["rows"] < first["rows"]
+
+
+def test_the_process_pool_packs_the_same_shards(source, tmp_path):
+    single = prepare(source, str(tmp_path / "single"), seq_len=64, rows_per_shard=3, workers=1, batch_size=4)
+    pooled = prepare(source, str(tmp_path / "pooled"), seq_len=64, rows_per_shard=3, workers=2, batch_size=4)
+
+    assert pooled["shards"] == single["shards"]
+    for shard in single["shards"]:
+        for suffix in ("tokens", "mask", "starts"):
+            name = f"{shard['name']}.{suffix}"
+            assert (tmp_path / "pooled" / name).read_bytes() == (tmp_path / "single" / name).read_bytes()
@@ -0,0 +1,56 @@
+import time
+
+import pytest
+
+from fake_backends import FakeBackend, point_engine_at, start_in_thread
+
+
+@pytest.fixture
+def remote():
+    """A second stand-in server for the OpenAI-compatible backend, slow to start answering."""
+    remote = FakeBackend(tokens=20, first_token_delay=1.0, token_delay=0.002)
+    _, stop = start_in_thread(remote)
+    yield remote
+    stop()
+
+
+@pytest.fixture
+def hybrid(engine, backend, remote):
+    point_engine_at(engine, backend.url, remote.url)
+    engine.use_cached_answers = False
+    engine.set_ai_mode("hybrid_hedged")
+    return engine
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.02)
+    return condition()
+
+
+def test_hedged_keeps_the_first_to_answer_and_cuts_off_the_other(hybrid, backend, remote):
+    started = time.perf_counter()
+    answer = hybrid.get_response("tell me a story", lambda text: None)
+
+    assert answer.startswith(f"({hybrid.backends.local.label}) Answer")
+    assert time.perf_counter() - started < remote.first_token_delay
+    assert remote.counters["requests"] == 1
+    # The slow call's connection is dropped rather than read to the end
+    assert wait_for(lambda: remote.counters["disconnects"] == 1)
+
+
+def test_hedged_asks_only_the_local_backend_when_the_remote_is_unavailable(hybrid, backend, remote):
+    hybrid.backends.remote.api_key = None
+    answer = hybrid.get_response("tell me a story", lambda text: None)
+
+    assert answer.startswith(f"({hybrid.backends.local.label}) Answer")
+    assert remote.counters["requests"] == 0
+
+
+def test_hybrid_routes_factual_questions_before_calling(hybrid, backend, remote):
+    hybrid.set_ai_mode("hybrid")
+    answer = hybrid.get_response("who won the world cup final?", lambda text: None)
+
+    assert answer.startswith(f"({hybrid.backends.remote.label}) Answer")
+    assert backend.counters["requests"] == 0
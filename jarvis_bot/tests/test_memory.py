@@ -0,0 +1,158 @@
+import sqlite3
+import threading
+
+import pytest
+
+from memory import Memory, WriteBehindWriter
+
+
+def test_concurrent_writes_and_reads_lose_nothing(memory):
+    threads, iterations = 8, 100
+    errors = []
+
+    def worker(n):
+        try:
+            for i in range(iterations):
+                memory.store_conversation(f"thread {n} question {i}", f"answer {i}")
+                if i % 10 == 0:
+                    memory.store_user_data(f"thread-{n}", str(i))
+                memory.get_recent_conversations(5)
+                memory.get_user_data(f"thread-{n}")
+        except Exception as e:
+            errors.append(e)
+
+    workers = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+
+    assert not errors, errors
+    assert memory.get_max_conversation_id() == threads * iterations
+    for n in range(threads):
+        assert memory.get_user_data(f"thread-{n}") == str((iterations - 1) // 10 * 10)
+
+
+def test_writer_flush_makes_writes_visible(tmp_path):
+    path = str(tmp_path / "writer.db")
+    sqlite3.connect(path).execute("CREATE TABLE t (n INTEGER)").connection.close()
+    writer = WriteBehindWriter(path, batch_size=8)
+    for n in range(100):
+        writer.submit("INSERT INTO t VALUES (?)", (n,))
+    writer.flush()
+
+    conn = sqlite3.connect(path)
+    assert conn.execute("SELECT COUNT(*) FROM t").fetchone()[0] == 100
+    writer.close()
+    conn.close()
+
+
+def test_writer_close_commits_pending_writes_and_stops(tmp_path):
+    path = str(tmp_path / "writer.db")
+    sqlite3.connect(path).execute("CREATE TABLE t (n INTEGER)").connection.close()
+    writer = WriteBehindWriter(path)
+    for n in range(50):
+        writer.submit("INSERT INTO t VALUES (?)", (n,))
+    writer.close()
+    writer.close()  # a second close is a no-op
+
+    assert not writer.thread.is_alive()
+    with pytest.raises(sqlite3.ProgrammingError):
+        writer.submit("INSERT INTO t VALUES (?)", (0,))
+    conn = sqlite3.connect(path)
+    assert conn.execute("SELECT COUNT(*) FROM t").fetchone()[0] == 50
+    conn.close()
+
+
+def test_writer_survives_a_bad_write(tmp_path):
+    path = str(tmp_path / "writer.db")
+    sqlite3.connect(path).execute("CREATE TABLE t (n INTEGER)").connection.close()
+    writer = WriteBehindWriter(path)
+    writer.submit("INSERT INTO missing VALUES (?)", (1,))
+    writer.submit("INSERT INTO t VALUES (?)", (2,))
+    writer.close()
+
+    conn = sqlite3.connect(path)
+    assert conn.execute("SELECT n FROM t").fetchall() == [(2,)]
+    conn.close()
+
+
+def test_search_uses_the_index_on_a_memory_that_was_never_opened(tmp_path):
+    path = str(tmp_path / "memory.db")
+    earlier = Memory(path)
+    earlier.store_conversation("Do foxes hunt at night?", "Mostly at dusk")
+    earlier.close()
+
+    memory = Memory(path)
+    try:
+        results = memory.search_conversations("fox")
+        if not memory.fts_enabled:
+            pytest.skip("SQLite built without FTS5")
+        # A stemmed, highlighted FTS match rather than the LIKE fallback
+        assert [row[2] for row in results] == ["Do [foxes] hunt at night?"]
+    finally:
+        memory.close()
+
+
+def test_search_index_follows_inserts_updates_and_deletes(memory):
+    memory.open()
+    if not memory.fts_enabled:
+        pytest.skip("SQLite built without FTS5")
+    memory.store_conversation("What is the capital of France?", "Paris")
+    memory.store_conversation("How tall is Everest?", "About 8849 metres")
+    assert [row[3] for row in memory.search_conversations("capital")] == ["Paris"]
+
+    memory.writer.submit("UPDATE conversations SET ai_response = ? WHERE ai_response = ?",
+                         ("Paris, on the Seine", "Paris"))
+    assert memory.search_conversations("seine")
+    assert memory.search_conversations("everest")
+
+    memory.writer.submit("DELETE FROM conversations WHERE user_input LIKE ?", ("%capital%",))
+    assert not memory.search_conversations("capital")
+    assert not memory.search_conversations("seine")
+    assert memory.search_conversations("everest")
+
+    memory.clear_memory()
+    assert not memory.search_conversations("everest")
+
+
+def test_memory_opens_on_first_use(tmp_path):
+    path = tmp_path / "lazy.db"
+    memory = Memory(str(path))
+    assert not path.exists() and memory.writer.thread is None
+
+    memory.store_conversation("hello", "hi")
+    assert memory.get_recent_conversations() == [("hello", "hi")]
+    assert memory.last_conversation_id == 1
+    memory.close()
+    with pytest.raises(sqlite3.ProgrammingError):
+        memory.get_user_data("name")
+
+
+def test_closing_an_unused_memory_touches_nothing(tmp_path):
+    path = tmp_path / "unused.db"
+    memory = Memory(str(path))
+    memory.close()
+    assert not path.exists()
+
+
+def test_close_does_not_wait_forever_for_a_busy_reader(tmp_path):
+    memory = Memory(str(tmp_path / "busy.db"))
+    checked_out, release = threading.Event(), threading.Event()
+
+    def hold_reader():
+        with memory.reader():
+            checked_out.set()
+            release.wait(5)
+
+    holder = threading.Thread(target=hold_reader)
+    holder.start()
+    assert checked_out.wait(5)
+    closer = threading.Thread(target=memory.close)  # waits up to 2 s by default
+    closer.start()
+    closer.join(4)
+    finished = not closer.is_alive()
+    release.set()
+    holder.join(5)
+
+    assert finished
@@ -0,0 +1,15 @@
+from retrieval import ConversationRetriever
+
+
+def test_retrieve_finds_committed_turns_without_flushing(memory, tmp_path, monkeypatch):
+    retriever = ConversationRetriever(memory, str(tmp_path / "memory_index"))
+    memory.store_conversation("my favourite colour is teal", "Noted, teal it is.")
+    memory.flush()
+
+    def no_flush():
+        raise AssertionError("retrieve() waited for the write-behind queue")
+
+    monkeypatch.setattr(memory, "flush", no_flush)
+    results = retriever.retrieve("what is my favourite colour", k=1)
+
+    assert results and "teal" in results[0]
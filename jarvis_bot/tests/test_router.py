@@ -0,0 +1,56 @@
+import math
+
+import pytest
+
+from router import QueryRouter
+
+
+@pytest.fixture
+def router():
+    router = QueryRouter()
+    router.add_keywords(["latest", "news", "who won", "what happened in"])
+    return router
+
+
+def test_keywords_match_whole_words_only(router):
+    assert router.route("What's the LATEST on the election?").route == "openai"
+    assert router.route("Who   won the cup?").matches == ["who won"]
+    # Inside longer words they do not count
+    for prompt in ("explain latestness", "sign me up for the newsletter", "whoever wonders why"):
+        decision = router.route(prompt)
+        assert decision.route == "phi3" and decision.matches == []
+
+
+def test_overlapping_phrases_prefer_the_longer_match(router):
+    router.add_keywords(["new", "newsletter"], weight=1.0)
+
+    assert router.route("the newsletter").matches == ["newsletter"]
+    assert router.route("what is new").matches == ["new"]
+
+
+def test_weights_add_up_against_the_bias():
+    router = QueryRouter(bias=-2.0)
+    router.add_keywords(["score"], weight=1.5)
+    router.add_keywords(["tonight"], weight=1.5)
+
+    one = router.route("what was the score?")
+    assert one.route == "phi3" and one.score == pytest.approx(-0.5)
+    # Each matching rule counts once, however often it appears
+    both = router.route("score tonight? the score!")
+    assert both.route == "openai" and both.score == pytest.approx(1.0)
+    assert both.confidence == pytest.approx(1 / (1 + math.exp(-1.0)))
+
+
+def test_negative_patterns_argue_for_the_default(router):
+    router.add_pattern(r"\bin my (?:notes|diary)\b", weight=-7.0)
+
+    assert router.route("latest news").route == "openai"
+    decision = router.route("latest news in my notes")
+    assert decision.route == "phi3" and decision.score == pytest.approx(-2.0 + 4 + 4 - 7)
+
+
+def test_a_missing_classifier_file_is_looked_for_once(router, tmp_path):
+    router.classifier_path = str(tmp_path / "router_model.npz")
+
+    assert router.route("latest news").route == "openai"
+    assert router.classifier is None and router.classifier_path is None
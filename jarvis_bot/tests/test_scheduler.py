@@ -0,0 +1,19 @@
+import threading
+
+
+def test_raising_callbacks_do_not_kill_the_workers(engine, backend):
+    engine.use_cached_answers = False
+    done = threading.Event()
+    answers = []
+
+    def broken(*args):
+        raise RuntimeError("broken UI callback")
+
+    for n in range(3):
+        engine.scheduler.submit(f"question {n}", on_partial=broken, on_done=broken)
+    engine.scheduler.submit("last question", on_done=lambda request_id, response, *rest: (
+        answers.append(response), done.set()))
+
+    assert done.wait(10)
+    assert answers[0].endswith("word19")
+    assert all(worker.is_alive() for worker in engine.scheduler.workers)
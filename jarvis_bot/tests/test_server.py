@@ -0,0 +1,37 @@
+import asyncio
+
+from fake_backends import point_engine_at
+from server import JarvisServer, make_engine
+
+
+def test_sessions_share_no_answers_or_history(tmp_path, backend):
+    engine = make_engine(str(tmp_path / "server.db"))
+    ai_engine = engine.engine
+    point_engine_at(ai_engine, backend.url)
+    ai_engine.set_ai_mode(f"{ai_engine.backends.local.name}_only")
+    # No history in the prompt, so only the session scope keeps the caches apart
+    ai_engine.context_history_turns = 0
+
+    async def run():
+        server = JarvisServer(engine)
+        alice, bob = server.session("alice"), server.session("bob")
+        try:
+            await alice.engine.get_response("what is my name?")
+            await bob.engine.get_response("what is my name?")
+            await alice.engine.get_response("what is my name?")
+        finally:
+            await engine.close()
+        return alice.engine.engine, bob.engine.engine
+
+    alice, bob = asyncio.run(run())
+    try:
+        # Alice's second question is her own cached answer; Bob's first is not hers
+        assert backend.counters["requests"] == 2
+        assert alice.cache_key("what is my name?") != bob.cache_key("what is my name?")
+        assert len(ai_engine.memory.get_session_conversations("alice", 10)) == 1
+        assert len(ai_engine.memory.get_session_conversations("bob", 10)) == 1
+        assert alice.active_streams is not bob.active_streams
+        assert alice.running_calls is not bob.running_calls
+    finally:
+        ai_engine.scheduler.shutdown()
+        ai_engine.memory.close()
@@ -0,0 +1,12 @@
+from training_data import runaway
+
+
+def test_runaway_counts_repeats_of_one_line():
+    rule = runaway(max_chars=4000, max_repeats=3)
+    looping = {"input": "q", "output": "\n".join(["Sure!"] * 4)}
+    varied = {"input": "q", "output": "a\na\nb\nb\nc\nc"}  # three lines repeated once each
+
+    assert rule(looping) is None
+    assert rule({"input": "q", "output": "\n".join(["Sure!"] * 3)}) is not None
+    assert rule(varied) is varied
+    assert rule({"input": "q", "output": "x" * 4001}) is None
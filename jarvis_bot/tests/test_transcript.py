@@ -0,0 +1,37 @@
+from transcript import Transcript
+
+
+class RecordingView:
+    def __init__(self):
+        self.shown = []
+
+    def show_messages(self, messages, at_top):
+        self.shown.extend(messages)
+
+    def remove_messages(self, messages, from_top):
+        pass
+
+
+def test_append_does_not_query_sqlite(memory, monkeypatch):
+    memory.store_conversation("hello", "(Phi-3) hi")
+    memory.flush()
+    transcript = Transcript(RecordingView(), memory)
+
+    def no_query():
+        raise AssertionError("append() read from SQLite")
+
+    monkeypatch.setattr(memory, "reader", no_query)
+    message = transcript.append("You", "next question")
+
+    assert message.before == 2
+
+
+def test_next_id_follows_committed_turns(memory):
+    transcript = Transcript(RecordingView(), memory)
+    assert transcript.next_id() == 1
+    for n in range(3):
+        memory.store_conversation(f"question {n}", "answer")
+    memory.flush()
+
+    assert transcript.next_id() == 4
+    assert transcript.next_id() == memory.get_max_conversation_id() + 1
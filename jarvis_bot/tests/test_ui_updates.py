@@ -0,0 +1,88 @@
+import threading
+
+from ui_updates import UpdateCoalescer
+
+
+class ManualTimer:
+    """call_later stand-in: queued callbacks run only when the test fires them, like a UI loop would."""
+
+    def __init__(self):
+        self.queued = []
+
+    def __call__(self, milliseconds, callback):
+        self.queued.append((milliseconds, callback))
+
+    def fire(self):
+        queued, self.queued = self.queued, []
+        for _, callback in queued:
+            callback()
+
+
+def test_only_the_newest_text_per_request_is_delivered():
+    delivered = []
+    timer = ManualTimer()
+    updates = UpdateCoalescer(lambda request_id, text: delivered.append((request_id, text)), timer, rate=50)
+    updates.start()
+    for text in ("A", "An", "Ans"):
+        updates.push(1, text)
+    updates.push(2, "Other")
+    assert delivered == []  # nothing is drawn until the timer ticks
+
+    timer.fire()
+    assert sorted(delivered) == [(1, "Ans"), (2, "Other")]
+    assert timer.queued[0][0] == 20  # re-armed at 1000 / rate ms
+    # A tick with nothing new draws nothing
+    timer.fire()
+    assert len(delivered) == 2
+    assert updates.stats()["pushed"] == 4 and updates.stats()["delivered"] == 2
+
+
+def test_discarded_text_is_never_delivered():
+    delivered = []
+    timer = ManualTimer()
+    updates = UpdateCoalescer(lambda request_id, text: delivered.append(text), timer)
+    updates.start()
+    updates.push(1, "partial")
+    updates.discard(1)
+    timer.fire()
+
+    assert delivered == []
+
+
+def test_stop_lets_the_timer_lapse_after_a_last_flush():
+    delivered = []
+    timer = ManualTimer()
+    updates = UpdateCoalescer(lambda request_id, text: delivered.append(text), timer)
+    updates.start()
+    updates.start()  # a second start while ticking arms no second timer
+    assert len(timer.queued) == 1
+
+    updates.push(1, "last words")
+    updates.stop()
+    timer.fire()
+    assert delivered == ["last words"] and timer.queued == [] and not updates.ticking
+    updates.start()
+    assert len(timer.queued) == 1
+
+
+def test_pushes_from_other_threads_are_all_accounted_for():
+    delivered = {}
+    timer = ManualTimer()
+    updates = UpdateCoalescer(lambda request_id, text: delivered.__setitem__(request_id, text), timer)
+    updates.start()
+
+    def stream(request_id):
+        for n in range(500):
+            updates.push(request_id, f"word{n}")
+
+    threads = [threading.Thread(target=stream, args=(request_id,)) for request_id in range(4)]
+    for thread in threads:
+        thread.start()
+    while any(thread.is_alive() for thread in threads):
+        timer.fire()
+    for thread in threads:
+        thread.join()
+    timer.fire()
+
+    assert delivered == {request_id: "word499" for request_id in range(4)}
+    assert updates.stats()["pushed"] == 2000
@@ -0,0 +1,320 @@
+"""Incremental export of stored conversations as fine-tuning data.
+
+    python training_data.py                          # memory.db -> training_data.jsonl, new turns only
+    python training_data.py --db memory.db -o training_data.jsonl --max-chars 2000
+    python training_data.py --rebuild                # start the file over
+    python training_data.py --bench --rows 1000000   # throughput and peak memory
+
+Turns are read from the conversations table chunk_size rows at a time above a
+high-water-mark id, so a re-run only looks at turns stored since the last one.
+Each turn goes through the rules, which clean it up or drop it; what is left is
+deduplicated by a hash of its normalized text and appended as
+{"input": ..., "output": ...}.
+
+The hashes, the high-water mark and the output size live in a SQLite file beside
+the output (training_data.jsonl.state) and are committed together after every
+chunk. An interrupted run is cut back to the last commit when the next one
+starts, and memory use does not grow with the number of rows.
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import sys
+import tempfile
+import time
+from collections import Counter
+from telemetry import configure_logging
+
+log = logging.getLogger("jarvis.training_data")
+
+# The Phi-3 stop sequences in ai_engine: anything after one is a turn the model invented
+TURN_MARKERS = ("\nUser:", "\nAI:", "\n---", "<|user|>", "<|end|>")
+LABEL = re.compile(r"^\([^()\n]{1,40}\) ")  # "(Phi-3) ", added by AIEngine to say who answered
+ERROR_PREFIXES = ("Error", "OpenAI API Error", "I couldn't find an answer")
+
+
+# A rule takes an example ({"input": ..., "output": ...}) and returns it, possibly
+# changed, or None to leave it out of the export. Dropped turns are counted under
+# the rule's __name__.
+
+def strip_label(example):
+    example["output"] = LABEL.sub("", example["output"], count=1)
+    return example
+
+
+def drop_stopped(example):
+    """Answers the user stopped half way (stored with " [stopped]" when store_partial_responses is on)."""
+    return None if example["output"].endswith(" [stopped]") else example
+
+
+def drop_errors(example):
+    return None if example["output"].startswith(ERROR_PREFIXES) else example
+
+
+def cut_invented_turns(example):
+    output = example["output"]
+    positions = [position for position in map(output.find, TURN_MARKERS) if position != -1]
+    if positions:
+        example["output"] = output[:min(positions)]
+    return example
+
+
+def drop_empty(example):
+    example["input"] = example["input"].strip()
+    example["output"] = example["output"].strip()
+    return example if example["input"] and example["output"] else None
+
+
+def runaway(max_chars=4000, max_repeats=3):
+    """A rule dropping answers longer than max_chars or repeating a line more than max_repeats times."""
+    def drop_runaway(example):
+        output = example["output"]
+        if len(output) > max_chars:
+            return None
+        counts = Counter(line.strip() for line in output.splitlines() if line.strip())
+        if counts and max(counts.values()) > max_repeats:
+            return None
+        return example
+    return drop_runaway
+
+
+DEFAULT_RULES = [strip_label, drop_stopped, drop_errors, cut_invented_turns, drop_empty, runaway()]
+
+
+def content_hash(example):
+    """Hash of the example with case and whitespace ignored, so retyped duplicates match."""
+    text = " ".join(example["input"].split()).casefold() + "\0" + " ".join(example["output"].split()).casefold()
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+
+class ExportState:
+    """Hashes already exported, the high-water-mark id and the output size, in one SQLite file."""
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS seen (hash BLOB PRIMARY KEY) WITHOUT ROWID")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS progress (key TEXT PRIMARY KEY, value INTEGER)")
+        self.conn.commit()
+        self.last_id = self.get("last_id")
+        self.output_bytes = self.get("output_bytes")
+        self.new = not self.conn.execute("SELECT 1 FROM progress").fetchone()
+
+    def get(self, key):
+        row = self.conn.execute("SELECT value FROM progress WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else 0
+
+    def add(self, digest):
+        """Records digest; False if it was already there."""
+        return self.conn.execute("INSERT OR IGNORE INTO seen VALUES (?)", (digest,)).rowcount == 1
+
+    def commit(self, last_id, output_bytes):
+        self.last_id, self.output_bytes = last_id, output_bytes
+        self.conn.executemany("REPLACE INTO progress VALUES (?, ?)",
+                              [("last_id", last_id), ("output_bytes", output_bytes)])
+        self.conn.commit()
+        self.new = False
+
+    def reset(self):
+        self.conn.execute("DELETE FROM seen")
+        self.conn.execute("DELETE FROM progress")
+        self.conn.commit()
+        self.last_id = self.output_bytes = 0
+        self.new = True
+
+    def close(self):
+        self.conn.close()
+
+
+class TrainingDataExporter:
+    """Appends the conversations stored since the last run to a JSONL file of training examples."""
+
+    def __init__(self, db_path="memory.db", output_path="training_data.jsonl", state_path=None, rules=None,
+                 chunk_size=5000):
+        self.db_path = db_path
+        self.output_path = output_path
+        self.state_path = state_path or f"{output_path}.state"
+        self.rules = DEFAULT_RULES if rules is None else rules
+        self.chunk_size = chunk_size
+
+    def open_state(self, rebuild=False):
+        state = ExportState(self.state_path)
+        size = os.path.getsize(self.output_path) if os.path.exists(self.output_path) else 0
+        if rebuild or size < state.output_bytes:
+            if not rebuild:
+                log.warning("%s is shorter than the last export left it; exporting everything again",
+                            self.output_path)
+            state.reset()
+            open(self.output_path, "w").close()
+        elif state.new and size:
+            # A file exported before there was any state, e.g. by hand: keep it, never repeat its examples
+            self.seed(state)
+        return state
+
+    def seed(self, state):
+        """Records the hashes of the examples already in the output file."""
+        seeded = 0
+        with open(self.output_path, "rb") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                    state.add(content_hash({"input": record["input"], "output": record["output"]}))
+                    seeded += 1
+                except (ValueError, KeyError, TypeError):
+                    continue
+            output_bytes = f.tell()
+            if output_bytes:
+                f.seek(-1, os.SEEK_END)
+                ends_with_newline = f.read(1) == b"\n"
+        if output_bytes and not ends_with_newline:
+            with open(self.output_path, "ab") as f:
+                output_bytes += f.write(b"\n")
+        state.commit(0, output_bytes)
+        log.info("Seeded %d examples already in %s", seeded, self.output_path)
+
+    def run(self, rebuild=False, report_every=5.0):
+        """Exports the new turns; returns the counts of what happened to them."""
+        counts = {"read": 0, "written": 0, "duplicates": 0, "bytes": 0, "seconds": 0.0, "dropped": {}}
+        state = self.open_state(rebuild)
+        # Read-only, so a mistyped --db fails instead of creating an empty database
+        source = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True)
+        started = reported = time.perf_counter()
+        try:
+            with open(self.output_path, "r+b" if os.path.exists(self.output_path) else "wb") as output:
+                # Anything past the last commit belongs to an interrupted run
+                output.seek(state.output_bytes)
+                output.truncate()
+                while True:
+                    rows = source.execute(
+                        "SELECT id, user_input, ai_response FROM conversations WHERE id > ? ORDER BY id LIMIT ?",
+                        (state.last_id, self.chunk_size)
+                    ).fetchall()
+                    if not rows:
+                        break
+                    lines = []
+                    for _, user_input, ai_response in rows:
+                        example = self.apply_rules({"input": user_input or "", "output": ai_response or ""},
+                                                   counts["dropped"])
+                        if example is None:
+                            continue
+                        if not state.add(content_hash(example)):
+                            counts["duplicates"] += 1
+                            continue
+                        lines.append(json.dumps(example, ensure_ascii=False) + "\n")
+                    data = "".join(lines).encode("utf-8")
+                    output.write(data)
+                    output.flush()
+                    state.commit(rows[-1][0], state.output_bytes + len(data))
+                    counts["read"] += len(rows)
+                    counts["written"] += len(lines)
+                    counts["bytes"] += len(data)
+                    now = time.perf_counter()
+                    if report_every and now - reported >= report_every:
+                        reported = now
+                        print(f"{counts['read']} turns read, {counts['read'] / (now - started):.0f}/s",
+                              file=sys.stderr)
+        finally:
+            source.close()
+            state.close()
+        counts["seconds"] = time.perf_counter() - started
+        return counts
+
+    def apply_rules(self, example, dropped):
+        for rule in self.rules:
+            example = rule(example)
+            if example is None:
+                dropped[rule.__name__] = dropped.get(rule.__name__, 0) + 1
+                return None
+        return example
+
+
+def summary(counts):
+    seconds = counts["seconds"]
+    dropped = ", ".join(f"{name} {n}" for name, n in sorted(counts["dropped"].items())) or "none"
+    return (f"{counts['read']} turns in {seconds:.1f}s ({counts['read'] / seconds if seconds else 0:.0f}/s, "
+            f"{counts['bytes'] / seconds / 1e6 if seconds else 0:.1f} MB/s written): {counts['written']} examples, "
+            f"{counts['duplicates']} duplicates, dropped: {dropped}")
+
+
+def make_bench_db(path, rows):
+    """A conversations table of rows synthetic turns, with repeats, labels, errors and invented turns."""
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE conversations (id INTEGER PRIMARY KEY AUTOINCREMENT, timestamp TEXT, "
+                 "user_input TEXT, ai_response TEXT)")
+
+    def turns():
+        for n in range(rows):
+            kind = n % 10
+            if kind < 3:
+                yield "hello", "(Phi-3) Hello! How can I assist you today?"
+            elif kind == 3:
+                yield f"question {n}", ""
+            elif kind == 4:
+                yield f"question {n}", "Error: No response from Phi-3."
+            elif kind == 5:
+                yield f"question {n}", f"(Phi-3) Answer {n}.\n\n---\n\nUser: and then?\n\nAI: " + "more " * 50
+            else:
+                yield f"question {n}", f"(Phi-3) A reasonably sized answer to question {n}. " * 3
+
+    conn.executemany("INSERT INTO conversations (timestamp, user_input, ai_response) VALUES ('', ?, ?)", turns())
+    conn.commit()
+    conn.close()
+
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def bench(rows=1000000, chunk_size=5000):
+    """Exports rows synthetic turns, then the few added after it, printing throughput and peak memory."""
+    directory = tempfile.mkdtemp()
+    db_path = os.path.join(directory, "memory.db")
+    output_path = os.path.join(directory, "training_data.jsonl")
+    make_bench_db(db_path, rows)
+    baseline = peak_rss_mb()
+    exporter = TrainingDataExporter(db_path, output_path, chunk_size=chunk_size)
+    print(f"Full export:        {summary(exporter.run(report_every=0))}")
+    rss = peak_rss_mb()
+    if rss is not None:
+        print(f"Peak memory: {rss:.0f} MB ({rss - baseline:+.0f} MB during the export)")
+
+    conn = sqlite3.connect(db_path)
+    conn.executemany("INSERT INTO conversations (timestamp, user_input, ai_response) VALUES ('', ?, ?)",
+                     [(f"new question {n}", f"(Phi-3) New answer {n}.") for n in range(1000)])
+    conn.commit()
+    conn.close()
+    print(f"Incremental export: {summary(exporter.run(report_every=0))}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export stored conversations as JSONL training data.")
+    parser.add_argument("--db", default="memory.db", help="memory database to read")
+    parser.add_argument("-o", "--output", default="training_data.jsonl")
+    parser.add_argument("--state", help="export state file (default: OUTPUT.state)")
+    parser.add_argument("--chunk-size", type=int, default=5000, help="turns read and committed at a time")
+    parser.add_argument("--max-chars", type=int, default=4000, help="longer answers are dropped as runaways")
+    parser.add_argument("--rebuild", action="store_true", help="forget earlier runs and export everything again")
+    parser.add_argument("--bench", action="store_true", help="measure throughput on synthetic turns")
+    parser.add_argument("--rows", type=int, default=1000000, help="turns in the --bench database")
+    args = parser.parse_args(argv)
+    configure_logging()
+    if args.bench:
+        bench(args.rows, args.chunk_size)
+        return
+    rules = DEFAULT_RULES[:-1] + [runaway(args.max_chars)]
+    exporter = TrainingDataExporter(args.db, args.output, args.state, rules, args.chunk_size)
+    print(summary(exporter.run(args.rebuild)), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+"""Bounded chat transcript shared by the Tk and Qt windows.
+
+    python transcript.py bench                    # 50k messages through the Qt window
+    python transcript.py bench --gui tk --messages 20000
+
+Only the newest capacity messages stay in the widget; the oldest fifth is dropped
+whenever a new one overflows it, so an append costs the same at message 50,000 as
+at message 50.
+Scrolling to the top pages earlier turns back in from Memory, page_size turns at
+a time, and dropping the newest ones if that overflows the widget; the next new
+message jumps back to the end. Lines that never reached Memory (cache hits,
+timings, mode switches) do not come back once dropped.
+"""
+
+import argparse
+import os
+import tempfile
+import time
+from collections import deque, namedtuple
+
+# before: the lowest conversation id that may belong to this message or a later
+# one, so Memory turns with a smaller id are the history that precedes it (None
+# for messages shown before the memory was attached: the session's start)
+Message = namedtuple("Message", ["sender", "text", "tag", "before"])
+
+
+class Transcript:
+    """The messages a chat widget shows, of which at most capacity are kept.
+
+    view draws them: show_messages(messages, at_top) inserts messages at the start
+    or the end of the widget, remove_messages(messages, from_top) deletes that many
+    messages from the start or the end. capacity=None keeps everything (the old
+    behaviour, for comparison).
+    """
+
+    def __init__(self, view, memory=None, capacity=500, page_size=50, user_sender="You", bot_sender="Jarvis"):
+        self.view = view
+        self.memory = memory
+        self.capacity = capacity
+        self.page_size = page_size
+        self.user_sender = user_sender
+        self.bot_sender = bot_sender
+        self.shown = deque()
+        self.recent = deque(maxlen=capacity)  # what to show when returning to the end
+        self.following = True  # the newest message is shown
+        self.session_before = self.next_id()
+        self.history_floor = 1  # no turns exist below this id
+
+    def set_memory(self, memory):
+        """Attaches the Memory to page history from, once the engine has opened it."""
+        self.memory = memory
+        self.session_before = self.next_id()
+
+    def next_id(self):
+        # Only committed turns count; a turn still queued gets a higher id anyway.
+        # Memory tracks the newest id as its writer commits, so this never touches SQLite
+        return self.memory.last_conversation_id + 1 if self.memory else None
+
+    def first_before(self):
+        before = self.shown[0].before if self.shown else None
+        return self.session_before if before is None else before
+
+    def __len__(self):
+        return len(self.shown)
+
+    def append(self, sender, text, tag=None):
+        message = Message(sender, text, tag, self.next_id())
+        self.recent.append(message)
+        if not self.following:
+            self.follow()
+            return message
+        self.shown.append(message)
+        self.view.show_messages([message], at_top=False)
+        if self.capacity is not None and len(self.shown) > self.capacity:
+            # Widgets lay out again everything below a removal, so drop a batch at a time
+            batch = max(1, self.capacity // 5)
+            self.view.remove_messages([self.shown.popleft() for _ in range(batch)], from_top=True)
+        return message
+
+    def follow(self):
+        """Shows the newest messages again after paging back through history."""
+        if self.following:
+            return
+        self.view.remove_messages(list(self.shown), from_top=False)
+        self.shown = deque(self.recent)
+        self.view.show_messages(list(self.shown), at_top=False)
+        self.following = True
+
+    def has_older(self):
+        if self.memory is None:
+            return False
+        return self.first_before() > self.history_floor
+
+    def load_older(self):
+        """Shows the page of stored turns before the first message; returns how many messages it added."""
+        if not self.has_older():
+            return 0
+        before = self.first_before()
+        # Two messages per turn; a bigger page would push out the turns nearest the view
+        page_size = self.page_size if self.capacity is None else max(1, min(self.page_size, self.capacity // 2))
+        rows = self.memory.get_conversations_before(before, page_size)
+        if len(rows) < page_size:
+            self.history_floor = rows[-1][0] if rows else before
+        messages = []
+        for turn_id, user_input, ai_response in reversed(rows):
+            messages.append(Message(self.user_sender, user_input, "user", turn_id))
+            messages.append(Message(self.bot_sender, ai_response, "bot", turn_id))
+        if not messages:
+            return 0
+        self.shown.extendleft(reversed(messages))
+        self.view.show_messages(messages, at_top=True)
+        if self.capacity is not None and len(self.shown) > self.capacity:
+            dropped = [self.shown.pop() for _ in range(len(self.shown) - self.capacity)]
+            self.view.remove_messages(dropped[::-1], from_top=False)
+            self.following = False
+        return len(messages)
+
+
+def bench(gui="qt", messages=50000, history=25000, window=1000):
+    """Appends messages through a real chat window, bounded and unbounded, printing per-append cost."""
+    from ai_engine import AIEngine
+    from memory import Memory
+
+    db_dir = tempfile.mkdtemp()
+    memory = Memory(os.path.join(db_dir, "transcript.db"))
+    for n in range(history):
+        memory.store_conversation(f"earlier question {n}", f"(Phi-3) earlier answer {n} " * 3)
+    memory.flush()
+    engine = AIEngine(memory=memory)
+    texts = [("an answer of ordinary length, " * (1 + n % 7)).strip() for n in range(16)]
+
+    if gui == "qt":
+        from PyQt5 import QtWidgets
+        app = QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+        from main_pyqt import JarvisWindow
+        make_window = lambda capacity: JarvisWindow(ai_engine=engine, transcript_capacity=capacity)
+        add = lambda window_, n: window_.append_chat("You" if n % 2 else "Jarvis", texts[n % len(texts)])
+        pump = app.processEvents
+        show = lambda window_: window_.show()
+        resize = lambda window_: window_.resize(window_.width() - 200, window_.height())
+        close = lambda window_: window_.close()
+    else:
+        import tkinter as tk
+        from gui import JarvisGUI
+        root = tk.Tk()
+        make_window = lambda capacity: JarvisGUI(root, engine, transcript_capacity=capacity)
+        add = lambda window_, n: window_.add_chat_line(texts[n % len(texts)], "user" if n % 2 else "bot")
+        pump = root.update
+        show = lambda window_: None  # the root window is already mapped
+        resize = lambda window_: root.geometry(f"{root.winfo_width() - 200}x{root.winfo_height()}")
+        close = lambda window_: [child.destroy() for child in root.winfo_children()]
+
+    print(f"{messages} messages through the {gui} window, per-append cost in us (mean of each {window})")
+    print(f"{'capacity':>9} {'first':>9} {'middle':>9} {'last':>9} {'total s':>8} {'kept':>7} {'page in ms':>11} "
+          f"{'reflow ms':>10}")
+    for capacity in (500, None):
+        window_ = make_window(capacity)
+        show(window_)  # a hidden widget skips layout, which is most of the cost
+        pump()
+        costs = []
+        started = time.perf_counter()
+        for n in range(messages):
+            before = time.perf_counter()
+            add(window_, n)
+            costs.append(time.perf_counter() - before)
+            if n % 100 == 0:
+                pump()  # let the widget lay out as it would between real messages
+        total = time.perf_counter() - started
+        kept = len(window_.transcript)
+        mean = lambda part: sum(part) / len(part) * 1e6
+        middle = messages // 2
+        before = time.perf_counter()
+        window_.transcript.load_older()
+        pump()
+        paged = (time.perf_counter() - before) * 1000
+        before = time.perf_counter()
+        resize(window_)  # every line wraps again, as when the user resizes the window
+        pump()
+        reflow = (time.perf_counter() - before) * 1000
+        print(f"{capacity or 'none':>9} {mean(costs[:window]):>9.1f} {mean(costs[middle:middle + window]):>9.1f} "
+              f"{mean(costs[-window:]):>9.1f} {total:>8.1f} {kept:>7} {paged:>11.1f} {reflow:>10.1f}")
+        close(window_)
+    memory.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the bounded chat transcript.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    bench_parser = commands.add_parser("bench", help="append cost at 50k messages, bounded vs. unbounded")
+    bench_parser.add_argument("--gui", choices=["qt", "tk"], default="qt")
+    bench_parser.add_argument("--messages", type=int, default=50000)
+    bench_parser.add_argument("--history", type=int, default=25000, help="stored turns to page back through")
+    args = parser.parse_args(argv)
+    bench(args.gui, args.messages, args.history)
+
+
+if __name__ == "__main__":
+    main()
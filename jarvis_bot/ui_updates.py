@@ -0,0 +1,208 @@
+"""Coalesces streamed answers into a capped number of UI updates per second.
+
+    python ui_updates.py bench                              # Qt window, 2000 tokens/s
+    python ui_updates.py bench --gui tk --tokens-per-second 500
+
+Backends hand over the whole answer so far with every token. Passing each one to
+the UI thread (root.after(0, ...) or a queued Qt signal) posts one event per
+token, so at high token rates the event loop redraws text that is replaced a
+moment later and timers such as the thinking animation fall behind. The windows
+instead push() into an UpdateCoalescer, which keeps only the newest text per
+request, and a timer on the UI thread draws it at most rate times a second.
+"""
+
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+
+class UpdateCoalescer:
+    """Newest streamed text per request, delivered on the UI thread at a capped rate.
+
+    push() may be called from any thread; it only stores the text. Between start()
+    and stop() a timer armed with call_later(milliseconds, callback), which must
+    run callback on the UI thread, calls deliver(request_id, text) for every
+    request that streamed since the last tick.
+    """
+
+    def __init__(self, deliver, call_later, rate=30, telemetry=None):
+        self.deliver = deliver
+        self.call_later = call_later
+        self.interval_ms = max(1, round(1000 / rate))
+        self.telemetry = telemetry
+        self.pending = {}  # request id -> newest text
+        self.lock = threading.Lock()
+        self.running = False
+        self.ticking = False
+        self.pushed = 0
+        self.delivered = 0
+        self.flushes = 0
+        self.ui_seconds = 0.0
+
+    def push(self, request_id, text):
+        with self.lock:
+            self.pending[request_id] = text
+            self.pushed += 1
+
+    def discard(self, request_id):
+        """Drops undelivered text of a request whose final answer is being shown."""
+        with self.lock:
+            self.pending.pop(request_id, None)
+
+    def start(self):
+        self.running = True
+        if not self.ticking:
+            self.ticking = True
+            self.call_later(self.interval_ms, self.tick)
+
+    def stop(self):
+        """Stops ticking once nothing is streaming; the timer lapses at its next tick."""
+        self.running = False
+
+    def tick(self):
+        self.flush()
+        if self.running:
+            self.call_later(self.interval_ms, self.tick)
+        else:
+            self.ticking = False
+
+    def flush(self):
+        with self.lock:
+            if not self.pending:
+                return
+            pending, self.pending = self.pending, {}
+        started = time.perf_counter()
+        for request_id, text in pending.items():
+            self.deliver(request_id, text)
+        elapsed = time.perf_counter() - started
+        self.flushes += 1
+        self.delivered += len(pending)
+        self.ui_seconds += elapsed
+        if self.telemetry is not None:
+            self.telemetry.observe("ui_flush_seconds", elapsed)
+
+    def stats(self):
+        """Texts pushed and delivered, flushes, and UI-thread time spent drawing them."""
+        with self.lock:
+            pushed = self.pushed
+        return {
+            "pushed": pushed, "delivered": self.delivered, "flushes": self.flushes,
+            "ui_seconds": round(self.ui_seconds, 6),
+            "ui_us_per_push": round(self.ui_seconds / pushed * 1e6, 2) if pushed else None
+        }
+
+
+def bench(gui="qt", tokens=2000, tokens_per_second=2000, rate=30):
+    """Streams tokens into a real chat window per token and coalesced, printing UI-thread cost."""
+    from ai_engine import AIEngine
+    from memory import Memory
+
+    engine = AIEngine(memory=Memory(os.path.join(tempfile.mkdtemp(), "ui_updates.db")))
+    drawn = [0]
+
+    def draw(request_id, text):
+        drawn[0] += 1
+        window.update_live_response(request_id, text)
+
+    if gui == "qt":
+        from PyQt5 import QtCore, QtWidgets
+        app = QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+        from main_pyqt import JarvisWindow
+
+        class Relay(QtCore.QObject):
+            # The old path: one queued signal per token
+            partial = QtCore.pyqtSignal(int, str)
+
+        window = JarvisWindow(ai_engine=engine)
+        window.show()
+        relay = Relay()
+        relay.partial.connect(draw)
+        per_token = relay.partial.emit
+        call_later = QtCore.QTimer.singleShot
+
+        def run_until(done):
+            loop = QtCore.QEventLoop()
+            poll = QtCore.QTimer()
+            poll.timeout.connect(lambda: done.is_set() and loop.quit())
+            poll.start(5)
+            loop.exec_()
+            poll.stop()
+    else:
+        import tkinter as tk
+        from gui import JarvisGUI
+        root = tk.Tk()
+        window = JarvisGUI(root, engine)
+        per_token = lambda request_id, text: root.after(0, draw, request_id, text)
+        call_later = root.after
+
+        def run_until(done):
+            def poll():
+                root.quit() if done.is_set() else root.after(5, poll)
+            poll()
+            root.mainloop()
+
+    updates = window.updates
+    updates.interval_ms = max(1, round(1000 / rate))
+    print(f"{tokens} tokens at {tokens_per_second}/s into the {gui} window, flushing at {rate} Hz")
+    print(f"{'delivery':<10} {'ui events':>9} {'ui us/token':>12} {'lag p95 ms':>11} {'lag max ms':>11}")
+    for request_id, mode in enumerate(("per-token", "coalesced"), 1):
+        send = per_token if mode == "per-token" else updates.push
+        window.pending_requests[request_id] = "bench"
+        drawn[0] = 0
+        delivered = updates.delivered
+        done = threading.Event()
+
+        # A 10 ms heartbeat on the UI thread; how late it runs is what the user feels
+        lags = []
+        last_beat = [time.perf_counter()]
+
+        def heartbeat():
+            now = time.perf_counter()
+            lags.append(max(0.0, now - last_beat[0] - 0.010))
+            last_beat[0] = now
+            if not done.is_set():
+                call_later(10, heartbeat)
+
+        def produce():
+            text = ""
+            started = time.perf_counter()
+            for n in range(tokens):
+                text += f" word{n}"
+                send(request_id, text)
+                delay = started + (n + 1) / tokens_per_second - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            time.sleep(0.1)  # let the last flush land
+            done.set()
+
+        updates.start()
+        call_later(10, heartbeat)
+        cpu = time.thread_time()  # the UI thread's CPU time; waiting for events costs none
+        threading.Thread(target=produce, daemon=True).start()
+        run_until(done)
+        cpu = time.thread_time() - cpu
+        updates.stop()
+        window.finish_response(request_id, "done", 0.0)
+        events = drawn[0] + updates.delivered - delivered
+        lags.sort()
+        print(f"{mode:<10} {events:>9} {cpu / tokens * 1e6:>12.1f} "
+              f"{lags[int(0.95 * len(lags))] * 1000:>11.1f} {lags[-1] * 1000:>11.1f}")
+    engine.memory.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark coalesced UI updates for streamed answers.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    bench_parser = commands.add_parser("bench", help="UI-thread time per token, per-token vs. coalesced")
+    bench_parser.add_argument("--gui", choices=["qt", "tk"], default="qt")
+    bench_parser.add_argument("--tokens", type=int, default=2000)
+    bench_parser.add_argument("--tokens-per-second", type=int, default=2000)
+    bench_parser.add_argument("--rate", type=int, default=30, help="flushes per second")
+    args = parser.parse_args(argv)
+    bench(args.gui, args.tokens, args.tokens_per_second, args.rate)
+
+
+if __name__ == "__main__":
+    main()